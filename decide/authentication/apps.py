@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'authentication'
+
+    def ready(self):
+        import authentication.signals
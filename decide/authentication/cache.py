@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+from base.channels import get_channel, publish_on_commit
+from .serializers import UserSerializer
+
+
+class TokenCache:
+    """
+    Per-process LRU cache of the user of each authentication token, as returned by the getuser endpoint.
+
+    The entries expire after AUTH_TOKEN_CACHE_TTL seconds and at most AUTH_TOKEN_CACHE_SIZE of them are kept,
+    dropping the least recently used ones. They are invalidated through the 'token' topic of the channel of
+    base.channels: the signals of authentication.signals publish "key:<token>" when a token is deleted (the
+    logout) and "user:<id>" when a user is saved or deleted (a deactivation, a change of the staff flag...),
+    right away in this process and once the change is committed in the rest. The cache is bypassed while the
+    channel isn't healthy.
+
+    Attributes:
+        entries (OrderedDict): User data and expiration time by token, the least recently used first.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that queried the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.channel = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60)
+
+    def connect(self):
+        channel = get_channel()
+        with self.lock:
+            if channel is not self.channel:
+                self.entries.clear()
+                self.channel = channel
+                channel.subscribe('token', self.receive)
+        return channel
+
+    def fetch(self, keys):
+        """
+        Gets the users of some tokens from the database, with one query for every 1000 tokens.
+
+        Args:
+            keys (list): The tokens.
+
+        Returns:
+            dict: The serialized user by token, without the tokens that don't exist.
+        """
+
+        users = {}
+        for i in range(0, len(keys), 1000):
+            qs = Token.objects.select_related('user').filter(
+                key__in=keys[i:i + 1000])
+            for tk in qs:
+                users[tk.key] = dict(UserSerializer(tk.user, many=False).data)
+        return users
+
+    def get(self, key):
+        """
+        Gets the user of a token.
+
+        Args:
+            key (str): The token.
+
+        Returns:
+            dict: The serialized user, or None if the token doesn't exist. It mustn't be modified.
+        """
+
+        if not key or not isinstance(key, str):
+            return None
+        return self.get_many([key]).get(key, None)
+
+    def get_many(self, keys):
+        """
+        Gets the users of some tokens, querying the database once for all the tokens that aren't cached.
+
+        Args:
+            keys (list): The tokens.
+
+        Returns:
+            dict: The serialized user by token, without the invalid tokens. The users mustn't be modified.
+        """
+
+        channel = self.connect()
+        now = time.monotonic()
+        users, missing = {}, []
+        with self.lock:
+            for key in set(keys):
+                if not key or not isinstance(key, str):
+                    continue
+                entry = self.entries.get(key, None)
+                if entry and entry[1] > now and channel.healthy:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    users[key] = entry[0]
+                else:
+                    self.misses += 1
+                    missing.append(key)
+            generation = self.generation
+
+        if not missing:
+            return users
+
+        fetched = self.fetch(missing)
+        users.update(fetched)
+        if fetched and channel.healthy:
+            with self.lock:
+                # not caching them if something was invalidated while fetching
+                if generation == self.generation:
+                    for key, user in fetched.items():
+                        self.entries[key] = (user, now + self.ttl)
+                        self.entries.move_to_end(key)
+                    while len(self.entries) > self.size:
+                        self.entries.popitem(last=False)
+        return users
+
+    def receive(self, message):
+        """
+        Applies an invalidation published in the channel. Called by the channel.
+
+        Args:
+            message (str): "key:<token>" or "user:<id>", or None to drop every entry.
+        """
+
+        with self.lock:
+            self.generation += 1
+            if message is None:
+                self.entries.clear()
+                return
+
+            kind, value = message.split(':', 1)
+            if kind == 'key':
+                self.entries.pop(value, None)
+            elif kind == 'user':
+                user_id = int(value)
+                keys = [k for k, (user, expires) in self.entries.items()
+                        if user['id'] == user_id]
+                for key in keys:
+                    del self.entries[key]
+
+    def invalidate_token(self, key):
+        self.connect()
+        publish_on_commit('token', 'key:{}'.format(key), local=True)
+
+    def invalidate_user(self, user_id):
+        self.connect()
+        publish_on_commit('token', 'user:{}'.format(int(user_id)),
+                          local=True)
+
+    def clear(self):
+        self.receive(None)
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The entries, hits, misses and hit ratio of the cache.
+        """
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+tokens = TokenCache()
@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .cache import tokens
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """
+    A Django signal receiver that drops a deleted Token, like the one of a logout, from the token caches of
+    every process.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Token): The instance of the Token model that was deleted.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    tokens.invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, created=False, **kwargs):
+    """
+    A Django signal receiver that drops the tokens of a changed User, like a deactivated one, from the token
+    caches of every process.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (User): The instance of the User model that was saved or deleted.
+        created (bool): True if a new record was created.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    if not created:
+        tokens.invalidate_user(instance.id)
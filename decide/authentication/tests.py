@@ -2,6 +2,8 @@ from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from django.contrib.auth.models import User
+from django.test import override_settings
+from unittest import mock
 from rest_framework.authtoken.models import Token
 
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
@@ -10,7 +12,9 @@ from base.tests import BaseTestCase
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
-from base import mods
+from base import channels, mods
+from base.perms import get_user
+from .cache import tokens
 
 
 class AuthTestCase(APITestCase):
@@ -245,3 +249,116 @@ class AuthTestCase(APITestCase):
             sorted(list(response.json().keys())),
             ['token', 'user_pk']
         )
+
+
+@override_settings(CHANNEL_BACKEND='base.channels.LocalChannel')
+class TokenCacheTestCase(APITestCase):
+    """
+    Test case for the cache of the users of the tokens.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        mods.mock_query(self.client)
+        channels.reset()
+        tokens.clear()
+        tokens.hits = tokens.misses = 0
+        self.user = User(username='voter1')
+        self.user.set_password('123')
+        self.user.save()
+        self.staff = User(username='staff', is_staff=True)
+        self.staff.save()
+
+    def tearDown(self):
+        tokens.clear()
+        channels.reset()
+        self.client = None
+
+    def login(self, username='voter1', password='123'):
+        data = {'username': username, 'password': password}
+        response = self.client.post(
+            '/authentication/login/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_hit(self):
+        token = self.login()
+        response = self.client.post(
+            '/authentication/getuser/', token, format='json')
+        self.assertEqual(response.json()['username'], 'voter1')
+
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                '/authentication/getuser/', token, format='json')
+        self.assertEqual(response.json()['username'], 'voter1')
+        self.assertEqual(tokens.stats()['hits'], 1)
+        self.assertEqual(tokens.stats()['misses'], 1)
+
+    def test_logout(self):
+        token = self.login()
+        self.assertEqual(get_user(token['token'])['id'], self.user.id)
+
+        response = self.client.post(
+            '/authentication/logout/', token, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_user(token['token']), {})
+        response = self.client.post(
+            '/authentication/getuser/', token, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_deactivation(self):
+        token = self.login()['token']
+        self.assertTrue(get_user(token))
+        self.assertEqual(tokens.stats()['entries'], 1)
+
+        channel = channels.get_channel()
+        with mock.patch.object(channel, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            self.assertEqual(tokens.stats()['entries'], 0)
+            # the other processes are notified once committed
+            publish.assert_not_called()
+        publish.assert_called_once_with('token',
+                                        'user:{}'.format(self.user.id))
+
+    def test_staff(self):
+        token = Token.objects.create(user=self.staff).key
+        self.assertTrue(get_user(token)['is_staff'])
+        with self.assertNumQueries(0):
+            self.assertTrue(get_user(token)['is_staff'])
+
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertFalse(get_user(token)['is_staff'])
+
+    def test_size(self):
+        keys = [Token.objects.create(user=self.user).key]
+        keys.append(Token.objects.create(user=self.staff).key)
+        keys.append(Token.objects.create(
+            user=User.objects.create(username='other')).key)
+
+        with self.settings(AUTH_TOKEN_CACHE_SIZE=2):
+            for key in keys:
+                get_user(key)
+            # the first one is the least recently used
+            self.assertEqual(list(tokens.entries), keys[1:])
+            get_user(keys[1])
+            get_user(keys[0])
+            self.assertEqual(list(tokens.entries), [keys[1], keys[0]])
+
+    def test_ttl(self):
+        token = self.login()['token']
+        with self.settings(AUTH_TOKEN_CACHE_TTL=0):
+            get_user(token)
+            get_user(token)
+        self.assertEqual(tokens.stats()['hits'], 0)
+        self.assertEqual(tokens.stats()['misses'], 2)
+
+    def test_unhealthy_channel(self):
+        token = self.login()['token']
+        with mock.patch.object(channels.LocalChannel, 'healthy', False):
+            get_user(token)
+            self.assertEqual(get_user(token)['id'], self.user.id)
+        self.assertEqual(tokens.stats()['hits'], 0)
+        self.assertEqual(tokens.stats()['entries'], 0)
@@ -4,7 +4,7 @@ from rest_framework.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_401_UNAUTHORIZED
 )
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.contrib.auth import logout
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
@@ -17,7 +17,7 @@ from django.template import loader
 from django.views.generic import CreateView
 from django.urls import reverse_lazy
 from django import forms
-from .serializers import UserSerializer
+from .cache import tokens
 import re
 from django.contrib.auth import authenticate, login
 from django.core.mail import EmailMessage
@@ -244,8 +244,10 @@ class GetUserView(APIView):
         :rtype: Response
         """
         key = request.data.get('token', '')
-        tk = get_object_or_404(Token, key=key)
-        return Response(UserSerializer(tk.user, many=False).data)
+        user = tokens.get(key)
+        if not user:
+            raise Http404
+        return Response(user)
 
 
 class LogoutView(APIView):
@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalChannel:
+    '''
+    Publish/subscribe channel inside this process.
+
+    It's enough for tests and for deployments with only one process. With
+    several gunicorn workers a channel shared by all of them is needed, like
+    the RedisChannel.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = {}
+
+    @property
+    def healthy(self):
+        '''
+        True while the messages published by other processes are being
+        received. Caches should be bypassed when it's False.
+        '''
+
+        return True
+
+    def subscribe(self, topic, callback):
+        '''
+        Registers the callback for the messages of the topic. It's called
+        with the message, or with None when some messages could have been
+        lost and everything should be invalidated.
+        '''
+
+        with self.lock:
+            self.listeners.setdefault(topic, []).append(callback)
+
+    def publish(self, topic, message):
+        self.deliver(topic, message)
+
+    def deliver(self, topic, message):
+        with self.lock:
+            listeners = list(self.listeners.get(topic, []))
+        for callback in listeners:
+            callback(message)
+
+
+class RedisChannel(LocalChannel):
+    '''
+    Publish/subscribe channel shared by every process through redis.
+
+    The messages are delivered in the publisher process right away and in
+    the rest of them by a subscriber thread. While that thread isn't
+    connected the channel isn't healthy, and every time it reconnects the
+    listeners are called with None.
+    '''
+
+    PREFIX = 'decide:'
+
+    def __init__(self, url=None):
+        import redis
+
+        super().__init__()
+        url = url or getattr(settings, 'CHANNEL_REDIS_URL',
+                             settings.CELERY_BROKER_URL)
+        self.redis = redis.Redis.from_url(url, socket_connect_timeout=1)
+        self.connected = False
+        self.thread = None
+        self.id = uuid.uuid4().hex
+
+    @property
+    def healthy(self):
+        return self.connected
+
+    def subscribe(self, topic, callback):
+        super().subscribe(topic, callback)
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.listen,
+                                               daemon=True)
+                self.thread.start()
+
+    def publish(self, topic, message):
+        self.deliver(topic, message)
+        try:
+            data = '{}:{}'.format(self.id, message)
+            self.redis.publish(self.PREFIX + topic, data)
+        except Exception as e:
+            logger.warning('Error publishing in the %s channel: %s', topic, e)
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.psubscribe(self.PREFIX + '*')
+                for msg in pubsub.listen():
+                    if msg['type'] == 'psubscribe':
+                        self.connected = True
+                        self.invalidate_all()
+                    elif msg['type'] == 'pmessage':
+                        self.receive(msg['channel'], msg['data'])
+            except Exception:
+                if self.connected:
+                    logger.warning('Redis channel disconnected, retrying')
+            self.connected = False
+            time.sleep(1)
+
+    def receive(self, channel, data):
+        topic = channel.decode()[len(self.PREFIX):]
+        sender, message = data.decode().split(':', 1)
+        # already delivered in the publisher
+        if sender != self.id:
+            self.deliver(topic, message)
+
+    def invalidate_all(self):
+        with self.lock:
+            listeners = [cb for cbs in self.listeners.values() for cb in cbs]
+        for callback in listeners:
+            callback(None)
+
+
+_channel = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_channel():
+    '''
+    Returns the channel of this process, an instance of the class
+    configured in the CHANNEL_BACKEND setting.
+    '''
+
+    global _channel, _pid
+
+    with _lock:
+        if _pid != os.getpid():
+            backend = getattr(settings, 'CHANNEL_BACKEND',
+                              'base.channels.LocalChannel')
+            _channel = import_string(backend)()
+            _pid = os.getpid()
+        return _channel
+
+
+def publish_on_commit(topic, message, local=False):
+    '''
+    Publishes a message about a change of the database once the current
+    transaction is committed, or right away outside of one. Published
+    before, the listeners could load the old data again and keep it, and a
+    rolled back change would be published anyway.
+
+    With local, the message is also delivered in this process right away,
+    as it already reads the change. Only for the messages that drop cached
+    data, which is harmless if the change is rolled back.
+    '''
+
+    if local:
+        get_channel().deliver(topic, message)
+    transaction.on_commit(lambda: get_channel().publish(topic, message))
+
+
+def reset():
+    '''
+    Forgets the channel of this process. A new one is created on demand.
+    '''
+
+    global _pid
+    with _lock:
+        _pid = None
@@ -0,0 +1,154 @@
+import os
+import threading
+import urllib
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class Pool:
+    '''
+    Keep-alive http session for one base url.
+
+    The connections are kept in a bounded pool, so no more than
+    MODS_POOL_SIZE queries are in flight at the same time against the same
+    base url; the rest of them wait for a free connection. Idempotent GET
+    queries are retried with backoff on connection errors and 502, 503 and
+    504 responses.
+    '''
+
+    def __init__(self):
+        size = getattr(settings, 'MODS_POOL_SIZE', 10)
+        retries = getattr(settings, 'MODS_RETRIES', 3)
+        retry = Retry(
+            total=retries,
+            backoff_factor=getattr(settings, 'MODS_RETRY_BACKOFF', 0.5),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size,
+                                   pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.waits = 0
+        self.queries = 0
+
+    def request(self, method, url, **kwargs):
+        timeout = (getattr(settings, 'MODS_CONNECT_TIMEOUT', 5),
+                   getattr(settings, 'MODS_READ_TIMEOUT', 300))
+        kwargs.setdefault('timeout', timeout)
+
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.waits += 1
+            self.slots.acquire()
+
+        with self.lock:
+            self.in_use += 1
+            self.queries += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def stats(self):
+        '''
+        Returns the pool metrics:
+
+         * in_use: queries in flight
+         * waits: queries that had to wait for a free connection
+         * queries: queries done, without counting retries
+         * requests: http requests done, counting retries
+         * connections: tcp connections opened
+         * reuse_ratio: requests done over an already open connection
+        '''
+
+        pools = self.adapter.poolmanager.pools
+        pools = [pools[k] for k in pools.keys()]
+        requests_done = sum(p.num_requests for p in pools)
+        connections = sum(p.num_connections for p in pools)
+        reuse = 0.0
+        if requests_done:
+            reuse = max(requests_done - connections, 0) / requests_done
+
+        with self.lock:
+            return {
+                'in_use': self.in_use,
+                'waits': self.waits,
+                'queries': self.queries,
+                'requests': requests_done,
+                'connections': connections,
+                'reuse_ratio': reuse,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_pools = {}
+_pid = None
+_lock = threading.Lock()
+
+
+def get_pool(url):
+    '''
+    Returns the Pool for the base url (scheme and host) of the url.
+
+    The pools are created lazily and per process, so the workers forked by
+    gunicorn never share sockets.
+    '''
+
+    global _pid
+
+    parts = urllib.parse.urlsplit(url)
+    base = '{}://{}'.format(parts.scheme, parts.netloc)
+    with _lock:
+        if _pid != os.getpid():
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(base)
+        if not pool:
+            pool = _pools[base] = Pool()
+    return pool
+
+
+def request(method, url, **kwargs):
+    '''
+    Makes an http request using the keep-alive pool of the url.
+
+    Accepts the same params than requests.request.
+    '''
+
+    return get_pool(url).request(method, url, **kwargs)
+
+
+def stats():
+    '''
+    Returns the metrics of every pool, by base url.
+    '''
+
+    with _lock:
+        pools = dict(_pools)
+    return {base: pool.stats() for base, pool in pools.items()}
+
+
+def reset():
+    '''
+    Closes every pool. New ones will be created on demand.
+    '''
+
+    with _lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
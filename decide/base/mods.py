@@ -1,6 +1,171 @@
+import json
 import urllib
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
+from django.test.client import RequestFactory
+from django.urls import resolve
+
+from base import client
+from base import wire
+
+
+class LocalResponse:
+    '''
+    Response returned by in-process queries.
+
+    It exposes the subset of the requests.Response interface used by the
+    decide modules: status_code, content, headers, json(), iter_lines()
+    and close(). The content of streaming responses is only read by
+    json() or iter_lines().
+    '''
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.streaming = response.streaming
+        if self.streaming:
+            self.streaming_content = response.streaming_content
+        else:
+            self.content = response.content
+
+    def json(self):
+        if self.streaming:
+            self.content = b''.join(self.streaming_content)
+            self.streaming = False
+        return json.loads(self.content)
+
+    def iter_lines(self, chunk_size=None):
+        return split_lines(self.streaming_content if self.streaming
+                           else [self.content])
+
+    def close(self):
+        # the django response is closed by the request that made the query
+        pass
+
+
+def split_lines(chunks):
+    '''
+    Yields the non empty lines of a response read in chunks.
+    '''
+
+    pending = b''
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from (line for line in lines if line)
+    if pending:
+        yield pending
+
+
+def is_local(modname, baseurl=None):
+    '''
+    Returns True if the module should be queried in-process.
+
+    A module is local when it's installed in this instance and its url,
+    the baseurl param or the one configured in settings.APIS, is our own
+    settings.BASEURL. The in-process dispatch can be disabled with the
+    MODS_LOCAL_DISPATCH setting.
+    '''
+
+    if not getattr(settings, 'MODS_LOCAL_DISPATCH', True):
+        return False
+
+    mod = modname.split('/')[0]
+    if mod not in settings.MODULES:
+        return False
+
+    if not baseurl:
+        baseurl = getattr(settings, 'APIS', {}).get(mod, settings.BASEURL)
+    return baseurl.rstrip('/') == settings.BASEURL.rstrip('/')
+
+
+def local_query(modname, entry_point='/', method='get', **kwargs):
+    '''
+    Resolves the view for the query and calls it in the same process,
+    without going through the network. Returns a LocalResponse.
+    '''
+
+    url = '/{}{}'.format(modname, entry_point)
+    params = kwargs.get('params', None)
+    if params:
+        url += '?{}'.format(urllib.parse.urlencode(params))
+
+    base = urllib.parse.urlparse(settings.BASEURL)
+    extra = {
+        'HTTP_HOST': base.netloc,
+        'secure': base.scheme == 'https',
+    }
+    if 'HTTP_AUTHORIZATION' in kwargs:
+        extra['HTTP_AUTHORIZATION'] = kwargs['HTTP_AUTHORIZATION']
+    if kwargs.get('binary', False):
+        extra['HTTP_ACCEPT'] = wire.MEDIA_TYPE
+
+    factory = RequestFactory()
+    q = getattr(factory, method)
+    if method == 'get':
+        request = q(url, **extra)
+    elif kwargs.get('binary', False):
+        request = q(url, data=wire.dumps(kwargs.get('json', {})),
+                    content_type=wire.MEDIA_TYPE, **extra)
+    else:
+        json_data = kwargs.get('json', {})
+        request = q(url, data=json.dumps(json_data),
+                    content_type='application/json', **extra)
+
+    def dispatch(request):
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        return match.func(request, *match.args, **match.kwargs)
+
+    response = convert_exception_to_response(dispatch)(request)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return LocalResponse(response)
+
+
+def remote_query(modname, entry_point='/', method='get', baseurl=None,
+                 **kwargs):
+    '''
+    Makes the query through http, using the keep-alive connection pool of
+    base.client. Returns a requests.Response.
+    '''
+
+    if not baseurl:
+        mod = getattr(settings, 'APIS', {}).get(modname, settings.BASEURL)
+    else:
+        mod = baseurl
+
+    url = '{}/{}{}'.format(mod, modname, entry_point)
+
+    headers = {}
+    if 'HTTP_AUTHORIZATION' in kwargs:
+        headers['Authorization'] = kwargs['HTTP_AUTHORIZATION']
+    if kwargs.get('binary', False):
+        headers['Accept'] = wire.MEDIA_TYPE
+
+    params = kwargs.get('params', None)
+    if params:
+        url += '?{}'.format(urllib.parse.urlencode(params))
+
+    if method == 'get':
+        response = client.request(method, url, headers=headers,
+                                  stream=kwargs.get('stream', False))
+    elif kwargs.get('binary', False):
+        headers['Content-Type'] = wire.MEDIA_TYPE
+        response = client.request(method, url,
+                                  data=wire.dumps(kwargs.get('json', {})),
+                                  headers=headers)
+    else:
+        json_data = kwargs.get('json', {})
+        response = client.request(method, url, json=json_data,
+                                  headers=headers)
+
+    return response
 
 
 def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
@@ -15,12 +180,20 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     This function returns the json returned. If there's a problem an
     execption will be raised.
 
+    Modules served by this same instance (see is_local) are queried
+    in-process, the rest of them through http.
+
     Optional parameters
 
     This function can receive optional parameters to complete the query,
     you can complete the query with GET params using the **params** keyword
     and with json data, using the **json** keyword.
 
+    With **binary=True** the json data is sent, and the answer requested, in
+    the binary format of base.wire, which is much smaller and faster to
+    read for the lists of ciphertexts. If the module doesn't support it
+    (415), the query is made again with json.
+
     Examples
 
     >>> r = query('voting', params={'id': 1})
@@ -30,32 +203,34 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     >>> assert(len(r) == len(msgs))
     '''
 
-    if not baseurl:
-        mod = settings.APIS.get(modname, settings.BASEURL)
+    if is_local(modname, baseurl):
+        response = local_query(modname, entry_point, method, **kwargs)
     else:
-        mod = baseurl
+        response = remote_query(modname, entry_point, method, baseurl,
+                                **kwargs)
 
-    q = getattr(requests, method)
-    url = '{}/{}{}'.format(mod, modname, entry_point)
-
-    headers = {}
-    if 'HTTP_AUTHORIZATION' in kwargs:
-        headers['Authorization'] = kwargs['HTTP_AUTHORIZATION']
-
-    params = kwargs.get('params', None)
-    if params:
-        url += '?{}'.format(urllib.parse.urlencode(params))
-
-    if method == 'get':
-        response = q(url, headers=headers)
-    else:
-        json_data = kwargs.get('json', {})
-        response = q(url, json=json_data, headers=headers)
+    if kwargs.get('binary', False) and response.status_code == 415:
+        kwargs['binary'] = False
+        return query(modname, entry_point, method, baseurl, **kwargs)
 
     if kwargs.get('response', False):
         return response
     else:
-        return response.json()
+        return read_body(response)
+
+
+def read_body(response):
+    '''
+    Returns the data of a response of any kind returned by query, reading
+    it as json or with base.wire according to its Content-Type.
+    '''
+
+    if response.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+        return wire.loads(response.content)
+    return response.json()
+
+
+_query = query
 
 
 def get(*args, **kwargs):
@@ -66,6 +241,124 @@ def post(*args, **kwargs):
     return query(*args, method='post', **kwargs)
 
 
+def stream(*args, **kwargs):
+    '''
+    Makes a get query whose response is NDJSON, and yields the objects of
+    its lines one by one, while the response is being read. Nothing is
+    yielded if the response isn't a 200.
+
+    With binary=True the response is requested in the binary format of
+    base.wire, whose meta has the names of the fields of the items, and
+    the same objects are yielded.
+
+    >>> for vote in stream('store', params={'export': 'ndjson'}):
+    ...     print(vote['a'], vote['b'])
+    '''
+
+    response = query(*args, method='get', response=True, stream=True,
+                     **kwargs)
+    if response.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+        yield from read_batches(response)
+    else:
+        yield from read_ndjson(response)
+
+
+def read_ndjson(response):
+    '''
+    Yields the objects of the lines of a NDJSON response, of any kind
+    returned by query, while it's being read. Nothing is yielded if the
+    response isn't a 200.
+    '''
+
+    if response.status_code != 200:
+        return
+
+    if not hasattr(response, 'iter_lines'):
+        # django test client responses, see mock_query
+        chunks = (response.streaming_content if response.streaming
+                  else [response.content])
+        yield from (json.loads(line) for line in split_lines(chunks))
+        return
+
+    try:
+        for line in response.iter_lines(chunk_size=65536):
+            if line:
+                yield json.loads(line)
+    finally:
+        # releasing the connection if the caller stops before the end
+        response.close()
+
+
+def read_batches(response):
+    '''
+    Yields the items of the batches of a response in the binary format of
+    base.wire, of any kind returned by query, as dicts with the fields of
+    its meta, while it's being read. Nothing is yielded if the response
+    isn't a 200.
+    '''
+
+    if response.status_code != 200:
+        return
+
+    if hasattr(response, 'iter_content'):
+        chunks = response.iter_content(chunk_size=65536)
+    elif response.streaming:
+        chunks = response.streaming_content
+    else:
+        chunks = [response.content]
+
+    try:
+        batches = wire.iter_batches(chunks)
+        fields = next(batches, {}).get('fields', ())
+        for items in batches:
+            for item in items:
+                yield dict(zip(fields, item))
+    finally:
+        response.close()
+
+
+def pipeline(func, items, window=1):
+    '''
+    Calls func(*item) for every item, with up to window calls running at
+    the same time in threads, and yields the results in the order of the
+    items. The items are consumed as the calls finish, so they can be
+    generated while the previous ones are being processed.
+
+    It's used to keep several chunks in flight along the chain of mixnet
+    authorities, see read_chunk.
+    '''
+
+    if window <= 1:
+        for item in items:
+            yield func(*item)
+        return
+
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, *item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_chunk(data, seq, count):
+    '''
+    Returns the messages of the answer to a chunk sent to a mixnet
+    authority, {"seq": int, "count": int, "msgs": list}, checking that it
+    acknowledges the chunk seq with its count messages. Raises ValueError
+    otherwise.
+    '''
+
+    if (not isinstance(data, dict) or data.get('seq') != seq or
+            data.get('count') != count or
+            len(data.get('msgs', ())) != count):
+        raise ValueError('Chunk {} not acknowledged: {}'.format(
+            seq, str(data)[:200]))
+    return data['msgs']
+
+
 def mock_query(client):
     '''
     Function to build a mock to override the query function in this module.
@@ -88,6 +381,10 @@ def mock_query(client):
 
         if method == 'get':
             response = q(url, format='json')
+        elif kwargs.get('binary', False):
+            response = q(url, data=wire.dumps(kwargs.get('json', {})),
+                         content_type=wire.MEDIA_TYPE,
+                         HTTP_ACCEPT=wire.MEDIA_TYPE)
         else:
             json_data = kwargs.get('json', {})
             response = q(url, data=json_data, format='json')
@@ -95,7 +392,16 @@ def mock_query(client):
         if kwargs.get('response', False):
             return response
         else:
-            return response.json()
+            return read_body(response)
 
     global query
     query = test_query
+
+
+def unmock_query():
+    '''
+    Restores the query function overridden by mock_query.
+    '''
+
+    global query
+    query = _query
@@ -1,8 +1,20 @@
+import threading
+import time
+from unittest import mock
+
+import requests
 from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
+from rest_framework.test import APILiveServerTestCase
 from rest_framework.test import APITestCase
 
+from base import client
 from base import mods
+from base import wire
+from store.models import Vote
+from voting.models import Question, Voting
 
 
 class BaseTestCase(APITestCase):
@@ -34,3 +46,272 @@ class BaseTestCase(APITestCase):
 
     def logout(self):
         self.client.credentials()
+
+
+class ModsLocalDispatchTestCase(APILiveServerTestCase):
+    """
+    Compares the in-process dispatch of base.mods with the http one.
+
+    The live server is configured as our own BASEURL, so both ways end
+    in the same views and must return the same data.
+    """
+
+    def setUp(self):
+        q = Question(desc='test question')
+        q.save()
+        self.voting = Voting(name='test voting', question=q)
+        self.voting.save()
+        self.settings = override_settings(BASEURL=self.live_server_url,
+                                          APIS={})
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.voting = None
+
+    def test_is_local(self):
+        self.assertTrue(mods.is_local('voting'))
+        self.assertTrue(mods.is_local('authentication/getuser'))
+        self.assertTrue(mods.is_local('mixnet', self.live_server_url))
+        self.assertFalse(mods.is_local('mixnet', 'http://10.0.0.1:8000'))
+        self.assertFalse(mods.is_local('unknown'))
+        with override_settings(APIS={'voting': 'http://10.0.0.1:8000'}):
+            self.assertFalse(mods.is_local('voting'))
+        with override_settings(MODS_LOCAL_DISPATCH=False):
+            self.assertFalse(mods.is_local('voting'))
+
+    def test_same_response(self):
+        params = {'id': self.voting.id}
+        local = mods.local_query('voting', params=params)
+        remote = mods.remote_query('voting', params=params)
+        self.assertEqual(local.status_code, remote.status_code)
+        self.assertEqual(local.json(), remote.json())
+        self.assertEqual(local.json()[0]['id'], self.voting.id)
+
+        data = {'token': 'invalid'}
+        local = mods.local_query('authentication', '/getuser/',
+                                 method='post', json=data)
+        remote = mods.remote_query('authentication', '/getuser/',
+                                   method='post', json=data)
+        self.assertEqual(local.status_code, 404)
+        self.assertEqual(local.status_code, remote.status_code)
+        self.assertEqual(local.json(), remote.json())
+
+    def test_stream(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        token = Token.objects.create(user=staff).key
+        Vote.objects.bulk_create([
+            Vote(voting_id=self.voting.id, voter_id=i, a=i, b=i + 1)
+            for i in range(20)
+        ])
+
+        params = {'voting_id': self.voting.id, 'export': 'ndjson'}
+        auth = 'Token ' + token
+        with override_settings(STORE_EXPORT_CHUNK_SIZE=6):
+            local = mods.local_query('store', params=params,
+                                     HTTP_AUTHORIZATION=auth)
+            remote = mods.remote_query('store', params=params, stream=True,
+                                       HTTP_AUTHORIZATION=auth)
+            self.assertTrue(local.streaming)
+            local = list(mods.read_ndjson(local))
+            remote = list(mods.read_ndjson(remote))
+        self.assertEqual(local, remote)
+        self.assertEqual([(v['a'], v['b']) for v in local],
+                         [(i, i + 1) for i in range(20)])
+
+        local = mods.local_query('store', params=params)
+        self.assertEqual(local.status_code, 401)
+        self.assertEqual(list(mods.read_ndjson(local)), [])
+
+    def test_stream_binary(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        token = Token.objects.create(user=staff).key
+        Vote.objects.bulk_create([
+            Vote(voting_id=self.voting.id, voter_id=i, a=2 ** 300 + i, b=i)
+            for i in range(20)
+        ])
+
+        params = {'voting_id': self.voting.id, 'export': 'ndjson'}
+        auth = 'Token ' + token
+        with override_settings(STORE_EXPORT_CHUNK_SIZE=6):
+            ndjson = list(mods.read_ndjson(mods.local_query(
+                'store', params=params, HTTP_AUTHORIZATION=auth)))
+            local = mods.local_query('store', params=params, binary=True,
+                                     HTTP_AUTHORIZATION=auth)
+            remote = mods.remote_query('store', params=params, stream=True,
+                                       binary=True, HTTP_AUTHORIZATION=auth)
+            self.assertEqual(remote.headers['Content-Type'], wire.MEDIA_TYPE)
+            local = list(mods.read_batches(local))
+            remote = list(mods.read_batches(remote))
+        self.assertEqual(local, ndjson)
+        self.assertEqual(remote, ndjson)
+        self.assertEqual([(v['a'], v['b']) for v in local],
+                         [(2 ** 300 + i, i) for i in range(20)])
+
+    def test_local_dispatch(self):
+        """
+        The queries of the local modules are served in-process, without
+        going through the network.
+        """
+
+        params = {'voter_id': 1}
+        path = 'census/{}'.format(self.voting.id)
+        expected = mods.local_query(path, params=params)
+        with mock.patch('base.mods.remote_query',
+                        side_effect=AssertionError('remote query')), \
+                mock.patch('socket.socket.connect',
+                           side_effect=AssertionError('socket opened')):
+            response = mods.query(path, params=params, response=True)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+
+
+class ModsClientTestCase(APILiveServerTestCase):
+    """
+    Tests the keep-alive connection pool used by the http queries.
+    """
+
+    def setUp(self):
+        client.reset()
+
+    def tearDown(self):
+        client.reset()
+
+    def test_pool_reuse(self):
+        N = 10
+        url = '{}/census/1/'.format(self.live_server_url)
+        for i in range(N):
+            response = client.request('get', url, params={'voter_id': 1})
+            self.assertEqual(response.status_code, 401)
+
+        stats = client.stats()[self.live_server_url]
+        self.assertEqual(stats['queries'], N)
+        self.assertEqual(stats['requests'], N)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['waits'], 0)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reuse_ratio'], (N - 1) / N)
+
+    def test_pool_per_base_url(self):
+        p1 = client.get_pool(self.live_server_url + '/voting/')
+        p2 = client.get_pool(self.live_server_url + '/census/1/')
+        p3 = client.get_pool('http://10.0.0.1:8000/mixnet/')
+        self.assertIs(p1, p2)
+        self.assertIsNot(p1, p3)
+
+    @override_settings(MODS_POOL_SIZE=2)
+    def test_pool_waits(self):
+        N = 8
+        url = '{}/census/1/'.format(self.live_server_url)
+        threads = [
+            threading.Thread(target=client.request, args=('get', url))
+            for i in range(N)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = client.stats()[self.live_server_url]
+        self.assertEqual(stats['queries'], N)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertLessEqual(stats['connections'], 2)
+
+    @override_settings(MODS_RETRIES=2, MODS_RETRY_BACKOFF=0,
+                       MODS_CONNECT_TIMEOUT=0.5)
+    def test_retry_get(self):
+        # nothing listening on this port
+        url = 'http://127.0.0.1:9/'
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.request('get', url)
+        stats = client.stats()['http://127.0.0.1:9']
+        self.assertEqual(stats['queries'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+
+class ModsPipelineTestCase(TestCase):
+    """
+    Tests the pipelining of the chunks sent along the mixnet chain.
+    """
+
+    def test_pipeline(self):
+        lock = threading.Lock()
+        running, peak, read = [0], [0], []
+
+        def items():
+            for i in range(10):
+                read.append(i)
+                yield i, i * 10
+
+        def func(seq, value):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            # the later chunks end first
+            time.sleep(0.01 * (10 - seq))
+            with lock:
+                running[0] -= 1
+            return seq, value
+
+        results = list(mods.pipeline(func, items(), window=3))
+        self.assertEqual(results, [(i, i * 10) for i in range(10)])
+        self.assertEqual(peak[0], 3)
+
+        peak[0] = 0
+        results = []
+        for r in mods.pipeline(func, items(), window=1):
+            # serially, nothing is read before the previous one ends
+            self.assertEqual(len(read) - 10, r[0] + 1)
+            results.append(r)
+        self.assertEqual(results, [(i, i * 10) for i in range(10)])
+        self.assertEqual(peak[0], 1)
+
+    def test_read_chunk(self):
+        msgs = [[1, 2], [3, 4]]
+        data = {'seq': 4, 'count': 2, 'msgs': msgs}
+        self.assertEqual(mods.read_chunk(data, 4, 2), msgs)
+        for wrong in ({'seq': 3, 'count': 2, 'msgs': msgs},
+                      {'seq': 4, 'count': 1, 'msgs': msgs},
+                      {'seq': 4, 'count': 3, 'msgs': msgs},
+                      msgs, 'Not found', None):
+            with self.assertRaises(ValueError):
+                mods.read_chunk(wrong, 4, 2)
+
+
+class WireTestCase(TestCase):
+    """
+    Tests the binary format of base.wire.
+    """
+
+    def test_roundtrip(self):
+        pairs = [[2 ** 2047 + i, i] for i in range(10)]
+        for data in (pairs, [0, 1, 2 ** 64], [],
+                     {'seq': 3, 'count': 10, 'msgs': pairs},
+                     {'detail': 'Not found.'}, 'Chunk 1 not acknowledged',
+                     [{'voter_id': 1}], [-1, 2]):
+            self.assertEqual(wire.loads(wire.dumps(data)), data)
+
+        # every number of the batch takes 256 bytes
+        body = wire.dumps(pairs)
+        self.assertEqual(len(body), 8 + 7 + 20 * 256)
+        self.assertEqual(wire.loads(bytearray(body)), pairs)
+
+        for wrong in (body[:-1], body[:6], b''):
+            with self.assertRaises(ValueError):
+                wire.loads(wrong)
+
+    def test_iter_batches(self):
+        items = [[i, 2 ** 100 * i, 7] for i in range(30)]
+        body = wire.pack_meta({'fields': ['x', 'y', 'z']})
+        body += b''.join(wire.pack_batch(items[i:i + 7])
+                         for i in range(0, 30, 7))
+
+        for size in (1, 5, 64, len(body)):
+            chunks = (body[i:i + size] for i in range(0, len(body), size))
+            batches = list(wire.iter_batches(chunks))
+            self.assertEqual(batches[0], {'fields': ['x', 'y', 'z']})
+            self.assertEqual([len(b) for b in batches[1:]], [7, 7, 7, 7, 2])
+            self.assertEqual(sum(batches[1:], []), items)
+
+        with self.assertRaises(ValueError):
+            list(wire.iter_batches([body[:-3]]))
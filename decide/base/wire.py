@@ -0,0 +1,202 @@
+'''
+Compact binary format for the batches of big integers (ciphertexts and
+votes) sent between store, voting and mixnet.
+
+A body is the length-prefixed JSON of everything but the numbers, followed
+by length-prefixed batches of numbers:
+
+    body  := meta_len:u32 meta:json batch*
+    batch := count:u32 width:u16 arity:u8 numbers
+
+where numbers are count * arity big-endian unsigned integers of width bytes
+each. The width is the one of the biggest number of the batch, that is the
+size of the key for the ciphertexts, so every number of a batch takes the
+same space and can be read without copying the body. All the integers of
+the headers are big-endian.
+
+A dict with a "msgs" list is sent as the dict without it and a batch with
+the msgs; a bare list as the null meta and a batch; anything else, or
+lists of anything but non-negative ints, as the meta alone. The items of
+a batch with arity 1 are ints and the rest of them lists of arity ints,
+like in the JSON bodies.
+
+It's negotiated through the Content-Type and Accept headers with the
+MEDIA_TYPE, JSON is still the default.
+'''
+
+import json
+import struct
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+
+MEDIA_TYPE = 'application/vnd.decide.batch'
+
+LENGTH = struct.Struct('>I')
+HEADER = struct.Struct('>IHB')
+
+
+def number_width(numbers):
+    '''
+    Returns the bytes needed by the biggest of the numbers, at least 1.
+    '''
+
+    return max(((n.bit_length() + 7) // 8 for n in numbers), default=0) or 1
+
+
+def pack_batch(items, arity=None):
+    '''
+    Packs a list of ints (arity 1), or of lists or tuples of arity ints, as
+    a batch. Negative numbers aren't supported.
+    '''
+
+    if arity is None:
+        arity = 1 if not items or isinstance(items[0], int) else len(items[0])
+    if arity == 1:
+        numbers = [int(n) for n in items]
+    else:
+        numbers = [int(n) for item in items for n in item]
+        if len(numbers) != len(items) * arity:
+            raise ValueError('All the items must have {} numbers'
+                             .format(arity))
+
+    width = number_width(numbers)
+    header = HEADER.pack(len(items), width, arity)
+    return header + b''.join(n.to_bytes(width, 'big') for n in numbers)
+
+
+def unpack_batch(view, offset=0):
+    '''
+    Reads the batch that starts at the offset of a memoryview. Returns the
+    items and the offset of the end of the batch.
+    '''
+
+    if len(view) - offset < HEADER.size:
+        raise ValueError('Truncated batch header')
+    count, width, arity = HEADER.unpack_from(view, offset)
+    offset += HEADER.size
+    end = offset + count * arity * width
+    if end > len(view) or not arity or not width:
+        raise ValueError('Truncated batch')
+
+    numbers = [int.from_bytes(view[i:i + width], 'big')
+               for i in range(offset, end, width)]
+    if arity == 1:
+        return numbers, end
+    items = zip(*[iter(numbers)] * arity)
+    return [list(item) for item in items], end
+
+
+def pack_meta(meta):
+    meta = json.dumps(meta).encode()
+    return LENGTH.pack(len(meta)) + meta
+
+
+def dumps(data):
+    '''
+    Returns the body of data, see the format above.
+    '''
+
+    try:
+        if isinstance(data, dict) and isinstance(data.get('msgs'), list):
+            meta = {k: v for k, v in data.items() if k != 'msgs'}
+            return pack_meta(meta) + pack_batch(data['msgs'])
+        if isinstance(data, list):
+            return pack_meta(None) + pack_batch(data)
+    except (TypeError, ValueError, OverflowError):
+        # not numbers, like the list of votes of the store
+        pass
+    return pack_meta(data)
+
+
+def loads(data):
+    '''
+    Reads a body written by dumps, from bytes or any other buffer. The
+    numbers of all the batches are joined.
+    '''
+
+    view = memoryview(data)
+    if len(view) < LENGTH.size:
+        raise ValueError('Truncated body')
+    size, = LENGTH.unpack_from(view, 0)
+    offset = LENGTH.size + size
+    if offset > len(view):
+        raise ValueError('Truncated body')
+    meta = json.loads(bytes(view[LENGTH.size:offset]))
+    if offset == len(view):
+        return meta
+
+    msgs = []
+    while offset < len(view):
+        items, offset = unpack_batch(view, offset)
+        msgs.extend(items)
+    if meta is None:
+        return msgs
+    meta['msgs'] = msgs
+    return meta
+
+
+def iter_batches(chunks):
+    '''
+    Yields the meta and then the items of every batch of a body that is
+    received in chunks of bytes, like a streamed response, while it's being
+    read. Every batch is parsed as soon as it's complete.
+    '''
+
+    buffer = bytearray()
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        if not started:
+            if len(buffer) < LENGTH.size:
+                continue
+            size, = LENGTH.unpack_from(buffer, 0)
+            if len(buffer) < LENGTH.size + size:
+                continue
+            offset = LENGTH.size + size
+            started = True
+            yield json.loads(bytes(buffer[LENGTH.size:offset]))
+
+        while len(buffer) - offset >= HEADER.size:
+            count, width, arity = HEADER.unpack_from(buffer, offset)
+            if len(buffer) - offset < HEADER.size + count * arity * width:
+                break
+            with memoryview(buffer) as view:
+                items, offset = unpack_batch(view, offset)
+            yield items
+        del buffer[:offset]
+
+    if buffer:
+        raise ValueError('Truncated body')
+
+
+class BatchParser(BaseParser):
+    '''
+    Parses the bodies of MEDIA_TYPE into the same data as the JSON ones.
+    '''
+
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except (ValueError, struct.error) as e:
+            raise ParseError('Binary parse error - {}'.format(e))
+
+
+class BatchRenderer(BaseRenderer):
+    '''
+    Renders the data of a response as a body of MEDIA_TYPE, when the
+    request accepts it.
+    '''
+
+    media_type = MEDIA_TYPE
+    format = 'batch'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return dumps(data)
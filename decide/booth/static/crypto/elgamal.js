@@ -26,3 +26,67 @@ ElGamal.encrypt = function(pk, m, r) {
 
   return { alpha: alpha, beta: beta };
 };
+
+// Fiat-Shamir challenge of a proof, like mixnet.mixcrypt.challenge
+ElGamal.challenge = function(q, values) {
+  var data = values.map(function(v) { return v.toString(); }).join(',');
+  var hex = sjcl.codec.hex.fromBits(sjcl.hash.sha256.hash(data));
+  return new BigInt(hex, 16).mod(q);
+};
+
+// Encrypts a ballot of the homomorphic tally, g for the option at the
+// index choice and 1 for the rest, with a proof that every ciphertext is
+// the one of 0 or 1 and that they add up to 1, like
+// mixnet.mixcrypt.prove_ballot
+ElGamal.proveBallot = function(pk, choice, size) {
+  var p = pk.p, g = pk.g, y = pk.y;
+  var q = p.subtract(BigInt.ONE).divide(BigInt.TWO);
+  var scalar = function() {
+    return ElGamal.getRandomInteger(q.subtract(BigInt.ONE)).add(BigInt.ONE);
+  };
+  var votes = [], options = [];
+  var total = BigInt.ZERO, at = BigInt.ONE, bt = BigInt.ONE;
+
+  for (var i = 0; i < size; i++) {
+    var m = i === choice ? 1 : 0, f = 1 - m;
+    var r = scalar();
+    var a = g.modPow(r, p);
+    var b = y.modPow(r, p);
+    if (m) {
+      b = b.multiply(g).mod(p);
+    }
+    var c = [], s = [], A = [], B = [];
+    // the other branch is simulated with its challenge and response
+    c[f] = ElGamal.getRandomInteger(q);
+    s[f] = ElGamal.getRandomInteger(q);
+    var fake = f ? b.multiply(g.modInverse(p)).mod(p) : b;
+    A[f] = g.modPow(s[f], p).multiply(a.modPow(c[f], p).modInverse(p)).mod(p);
+    B[f] = y.modPow(s[f], p).multiply(fake.modPow(c[f], p).modInverse(p)).mod(p);
+    var w = scalar();
+    A[m] = g.modPow(w, p);
+    B[m] = y.modPow(w, p);
+    c[m] = ElGamal.challenge(q, [p, g, y, a, b, A[0], B[0], A[1], B[1]])
+      .subtract(c[f]).mod(q);
+    s[m] = w.add(c[m].multiply(r)).mod(q);
+
+    total = total.add(r);
+    at = at.multiply(a).mod(p);
+    bt = bt.multiply(b).mod(p);
+    votes.push({a: a.toString(), b: b.toString()});
+    options.push({
+      A0: A[0].toString(), B0: B[0].toString(),
+      A1: A[1].toString(), B1: B[1].toString(),
+      c0: c[0].toString(), c1: c[1].toString(),
+      s0: s[0].toString(), s1: s[1].toString()
+    });
+  }
+
+  var w = scalar();
+  var sumA = g.modPow(w, p), sumB = y.modPow(w, p);
+  var ch = ElGamal.challenge(q, [p, g, y, at, bt, sumA, sumB]);
+  var sum = {
+    A: sumA.toString(), B: sumB.toString(),
+    s: w.add(ch.multiply(total)).mod(q).toString()
+  };
+  return {votes: votes, proof: {options: options, sum: sum}};
+};
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CensusConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'census'
+
+    def ready(self):
+        import census.signals
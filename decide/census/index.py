@@ -0,0 +1,266 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from base.channels import get_channel, publish_on_commit
+from .models import Census
+
+
+class CensusIndex:
+    """
+    Per-process in-memory index of the voters in the census of each voting.
+
+    The census of a voting is loaded lazily, the first time it's consulted, as a sorted array of 32-bit voter
+    IDs, so checking a voter is a binary search and a census of a million voters takes 4 MB, instead of the
+    ~60 MB of a python set of ints. Once loaded it's updated incrementally: every change of the census is
+    published in the 'census' topic of the channel of base.channels as "<voting>:+<voters>" or
+    "<voting>:-<voters>", and every process applies it to its copy. Saving or deleting a voting drops its
+    census, and while the channel isn't healthy the index is bypassed and the database is queried instead.
+    The changes are published by the signals of census.signals, so every way of changing the census (the API,
+    the xlsx import, the admin...) keeps it up to date. They are published once their transaction is
+    committed, and a census is loaded again after CENSUS_INDEX_TTL seconds anyway, in case a change was lost.
+
+    Attributes:
+        votings (dict): Sorted array of voter IDs by voting ID.
+        loaded (dict): When each census was loaded, by voting ID.
+        hits (int): Number of lookups served from the index.
+        misses (int): Number of lookups that queried the database.
+    """
+
+    TYPECODE = 'i'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.votings = {}
+        self.loaded = {}
+        self.channel = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        channel = get_channel()
+        with self.lock:
+            if channel is not self.channel:
+                self.votings.clear()
+                self.loaded.clear()
+                self.channel = channel
+                channel.subscribe('census', self.receive)
+                channel.subscribe('voting', self.invalidate)
+        return channel
+
+    def load(self, voting_id):
+        """
+        Reads the census of a voting from the database.
+
+        Args:
+            voting_id (int): The ID of the voting.
+
+        Returns:
+            array: The sorted voter IDs, without repetitions.
+        """
+
+        voters = array(self.TYPECODE)
+        last = None
+        qs = (Census.objects.filter(voting_id=voting_id)
+              .order_by('voter_id').values_list('voter_id', flat=True))
+        for voter_id in qs.iterator(chunk_size=10000):
+            if voter_id != last:
+                voters.append(voter_id)
+                last = voter_id
+        return voters
+
+    def get(self, voting_id):
+        """
+        Gets the census of a voting, loading it if it isn't in the index.
+
+        Args:
+            voting_id (int): The ID of the voting.
+
+        Returns:
+            array: The sorted voter IDs, or None if the index can't be used now.
+        """
+
+        channel = self.connect()
+        ttl = getattr(settings, 'CENSUS_INDEX_TTL', 300)
+        with self.lock:
+            voters = self.votings.get(voting_id, None)
+            fresh = time.monotonic() - self.loaded.get(voting_id, 0) < ttl
+            if voters is not None and fresh and channel.healthy:
+                self.hits += 1
+                return voters
+            self.misses += 1
+            generation = self.generation
+
+        if not channel.healthy:
+            return None
+
+        loaded = time.monotonic()
+        voters = self.load(voting_id)
+        with self.lock:
+            # not keeping it if the census changed while loading
+            if generation == self.generation:
+                self.votings[voting_id] = voters
+                self.loaded[voting_id] = loaded
+        return voters
+
+    def contains(self, voting_id, voter_id):
+        """
+        Checks if a voter is in the census of a voting.
+
+        Args:
+            voting_id (int): The ID of the voting.
+            voter_id (int): The ID of the voter.
+
+        Returns:
+            bool: True if the voter is in the census.
+        """
+
+        try:
+            voting_id, voter_id = int(voting_id), int(voter_id)
+        except (TypeError, ValueError):
+            return False
+
+        voters = self.get(voting_id)
+        if voters is None:
+            return Census.objects.filter(voting_id=voting_id,
+                                         voter_id=voter_id).exists()
+        # the arrays are updated in place
+        with self.lock:
+            return self.find(voters, voter_id)
+
+    def members(self, voting_id, voter_ids):
+        """
+        Checks which of some voters are in the census of a voting.
+
+        Args:
+            voting_id (int): The ID of the voting.
+            voter_ids (list): The IDs of the voters.
+
+        Returns:
+            set: The IDs of the voters that are in the census.
+        """
+
+        voting_id, voter_ids = int(voting_id), {int(v) for v in voter_ids}
+        voters = self.get(voting_id)
+        if voters is None:
+            qs = Census.objects.filter(voting_id=voting_id,
+                                       voter_id__in=voter_ids)
+            return set(qs.values_list('voter_id', flat=True))
+        with self.lock:
+            return {v for v in voter_ids if self.find(voters, v)}
+
+    @staticmethod
+    def find(voters, voter_id):
+        i = bisect_left(voters, voter_id)
+        return i < len(voters) and voters[i] == voter_id
+
+    def add(self, voting_id, voters):
+        """
+        Notifies every process that some voters were added to the census of a voting.
+        """
+
+        self.publish(voting_id, '+', voters)
+
+    def remove(self, voting_id, voters):
+        """
+        Notifies every process that some voters were removed from the census of a voting.
+        """
+
+        self.publish(voting_id, '-', voters)
+
+    def reload(self):
+        """
+        Notifies every process that the census could have changed in any way, so it's loaded again.
+        """
+
+        self.connect()
+        publish_on_commit('census', '*')
+
+    def publish(self, voting_id, op, voters):
+        voters = [str(int(v)) for v in voters]
+        if voters:
+            message = '{}:{}{}'.format(int(voting_id), op, ','.join(voters))
+            self.connect()
+            publish_on_commit('census', message)
+
+    def receive(self, message):
+        """
+        Applies a change of the census published in the channel. Called by the channel.
+
+        Args:
+            message (str): The change, or None when changes could have been lost.
+        """
+
+        if message is None or message == '*':
+            self.invalidate(None)
+            return
+
+        voting_id, change = message.split(':', 1)
+        voting_id = int(voting_id)
+        op, voters = change[0], sorted({int(v) for v in change[1:].split(',')})
+        with self.lock:
+            self.generation += 1
+            current = self.votings.get(voting_id, None)
+            if current is None:
+                return
+            if op == '+':
+                self.votings[voting_id] = self.insert(current, voters)
+            else:
+                self.votings[voting_id] = self.delete(current, voters)
+
+    def insert(self, current, voters):
+        if len(voters) > 64:
+            merged = sorted(set(current).union(voters))
+            return array(self.TYPECODE, merged)
+        for voter_id in voters:
+            i = bisect_left(current, voter_id)
+            if i == len(current) or current[i] != voter_id:
+                current.insert(i, voter_id)
+        return current
+
+    def delete(self, current, voters):
+        if len(voters) > 64:
+            removed = set(voters)
+            kept = (v for v in current if v not in removed)
+            return array(self.TYPECODE, kept)
+        for voter_id in voters:
+            i = bisect_left(current, voter_id)
+            if i < len(current) and current[i] == voter_id:
+                del current[i]
+        return current
+
+    def invalidate(self, voting_id):
+        """
+        Drops the census of a voting from the index. Called by the channel.
+
+        Args:
+            voting_id (int): The ID of the voting, or None to drop every census.
+        """
+
+        with self.lock:
+            self.generation += 1
+            if voting_id is None:
+                self.votings.clear()
+                self.loaded.clear()
+            else:
+                self.votings.pop(int(voting_id), None)
+                self.loaded.pop(int(voting_id), None)
+
+    def clear(self):
+        self.invalidate(None)
+
+    def memory(self):
+        """
+        Returns the bytes used by the loaded census arrays.
+        """
+
+        with self.lock:
+            return sum(v.buffer_info()[1] * v.itemsize
+                       for v in self.votings.values())
+
+
+voters = CensusIndex()
@@ -0,0 +1,71 @@
+import random
+import time
+import tracemalloc
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from census.index import CensusIndex
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the memory and lookup time of the census index '
+            'against a python set of voter ids. It runs in memory only')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10000, 100000, 1000000, 10000000],
+                            help='census sizes to measure, in voters')
+        parser.add_argument('--samples', type=int, default=100000,
+                            help='lookups measured for each size')
+
+    def build(self, factory, ids):
+        tracemalloc.start()
+        start = time.perf_counter()
+        voters = factory(ids)
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return voters, elapsed, memory
+
+    def lookups(self, contains, queries):
+        start = time.perf_counter()
+        for q in queries:
+            contains(q)
+        return (time.perf_counter() - start) / len(queries)
+
+    def handle(self, *args, **options):
+        index = CensusIndex()
+        self.stdout.write('{:>10} {:>6} {:>12} {:>14} {:>12} {:>12}'.format(
+            'voters', 'kind', 'build (s)', 'MB/1M voters', 'lookup (us)',
+            'insert (us)'))
+        for size in sorted(options['sizes']):
+            # sparse ids, like the users of a real census
+            ids = sorted(random.sample(range(size * 4), size))
+            queries = [random.randrange(size * 4)
+                       for i in range(options['samples'])]
+
+            voters, elapsed, memory = self.build(
+                lambda ids: array(CensusIndex.TYPECODE, ids), ids)
+            lookup = self.lookups(lambda q: index.find(voters, q), queries)
+            start = time.perf_counter()
+            for q in queries[:100]:
+                index.insert(voters, [q])
+            insert = (time.perf_counter() - start) / 100
+            self.stdout.write(
+                '{:>10} {:>6} {:>12.3f} {:>14.1f} {:>12.2f} {:>12.2f}'.format(
+                    size, 'array', elapsed, memory / size, lookup * 1e6,
+                    insert * 1e6))
+            del voters
+
+            voters, elapsed, memory = self.build(set, ids)
+            lookup = self.lookups(voters.__contains__, queries)
+            start = time.perf_counter()
+            for q in queries[:100]:
+                voters.add(q)
+            insert = (time.perf_counter() - start) / 100
+            self.stdout.write(
+                '{:>10} {:>6} {:>12.3f} {:>14.1f} {:>12.2f} {:>12.2f}'.format(
+                    size, 'set', elapsed, memory / size, lookup * 1e6,
+                    insert * 1e6))
+            del voters
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-17 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('census', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='census',
+            index=models.Index(fields=['voting_id', 'voter_id'],
+                               name='census_voting_voter_idx'),
+        ),
+    ]
@@ -20,6 +20,12 @@ class Census(models.Model):
     voting_id = models.IntegerField()
     voter_id = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['voting_id', 'voter_id'],
+                         name='census_voting_voter_idx'),
+        ]
+
     def clean(self):
         """
         Validates that the referenced Voting and User objects exist.
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .index import voters
+from .models import Census
+
+
+@receiver(post_save, sender=Census)
+def census_index_add(sender, created, instance, **kwargs):
+    """
+    A Django signal receiver that adds the voter of a new Census to the census index of every process, once
+    it's committed.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        created (bool): True if a new record was created.
+        instance (Census): The instance of the Census model that was saved.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    if created:
+        voters.add(instance.voting_id, [instance.voter_id])
+    else:
+        # the voting or the voter could have changed
+        voters.reload()
+
+
+@receiver(post_delete, sender=Census)
+def census_index_remove(sender, instance, **kwargs):
+    """
+    A Django signal receiver that removes the voter of a deleted Census from the census index of every process,
+    once it's committed.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Census): The instance of the Census model that was deleted.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    voters.remove(instance.voting_id, [instance.voter_id])
@@ -7,13 +7,17 @@ from io import BytesIO
 from openpyxl import Workbook
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
+from django.test import override_settings
+from unittest import mock
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
+from .index import voters
 from .models import Census
 from voting.models import Voting, Question, QuestionOption
 from base.models import Auth
+from base import channels
 from base.tests import BaseTestCase
 from datetime import datetime
 
@@ -1210,3 +1214,129 @@ class CensusImportViewTest(BaseTestCase):
         self.assertEqual(len(messages), 1)
         self.assertEqual(str(messages[0]),
                          "You must be an admin to access this page!")
+
+
+@override_settings(CHANNEL_BACKEND='base.channels.LocalChannel')
+class CensusIndexTestCase(BaseTestCase):
+    """
+    Test case for the in-memory census index.
+    """
+
+    def setUp(self):
+        super().setUp()
+        channels.reset()
+        voters.clear()
+        voters.hits = voters.misses = 0
+        q = Question(desc="test question")
+        q.save()
+        self.voting = Voting(name="test voting", question=q)
+        self.voting.save()
+        self.users = [
+            User.objects.create(username="indexvoter{}".format(i))
+            for i in range(5)
+        ]
+        for u in self.users[:3]:
+            Census.objects.create(voting_id=self.voting.id, voter_id=u.id)
+
+    def tearDown(self):
+        voters.clear()
+        channels.reset()
+        super().tearDown()
+
+    def test_lookup(self):
+        vid = self.voting.id
+        self.assertTrue(voters.contains(vid, self.users[0].id))
+        self.assertEqual(voters.misses, 1)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(voters.contains(vid, self.users[2].id))
+            self.assertTrue(voters.contains(str(vid), str(self.users[1].id)))
+            self.assertFalse(voters.contains(vid, self.users[3].id))
+            self.assertFalse(voters.contains(vid, None))
+        self.assertEqual(voters.hits, 3)
+        self.assertEqual(list(voters.get(vid)),
+                         sorted(u.id for u in self.users[:3]))
+        self.assertEqual(voters.memory(), 3 * voters.get(vid).itemsize)
+
+    def test_incremental_updates(self):
+        vid = self.voting.id
+        self.assertFalse(voters.contains(vid, self.users[3].id))
+
+        self.login()
+        with self.captureOnCommitCallbacks(execute=True) as published:
+            data = {"voting_id": vid, "voters": [self.users[3].id]}
+            response = self.client.post("/census/", data, format="json")
+            self.assertEqual(response.status_code, 201)
+            response = self.client.delete(
+                "/census/{}/".format(vid), {"voters": [self.users[0].id]},
+                format="json")
+            self.assertEqual(response.status_code, 204)
+            # not published until committed
+            self.assertFalse(voters.contains(vid, self.users[3].id))
+        self.assertEqual(len(published), 2)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(voters.contains(vid, self.users[3].id))
+            self.assertFalse(voters.contains(vid, self.users[0].id))
+        self.assertEqual(voters.misses, 1)
+
+    def test_import_updates(self):
+        vid = self.voting.id
+        self.assertFalse(voters.contains(vid, self.users[4].id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting.start_date = timezone.now()
+            self.voting.save()
+        # saving the voting drops its census
+        self.assertIsNone(voters.votings.get(vid))
+        self.assertFalse(voters.contains(vid, self.users[4].id))
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["Voter ID"])
+        sheet.append([self.users[4].id])
+        file_buffer = BytesIO()
+        workbook.save(file_buffer)
+        excel_file = SimpleUploadedFile("census.xlsx", file_buffer.getvalue())
+
+        self.client.force_login(User.objects.get(username="admin"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("import_census"),
+                             {"file": excel_file, "voting_id": vid})
+
+        with self.assertNumQueries(0):
+            self.assertTrue(voters.contains(vid, self.users[4].id))
+
+    def test_census_changed_while_loading(self):
+        vid = self.voting.id
+        load = voters.load
+
+        def racing_load(voting_id):
+            census = load(voting_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                Census.objects.create(voting_id=vid,
+                                      voter_id=self.users[3].id)
+            return census
+
+        with mock.patch.object(voters, "load", racing_load):
+            self.assertFalse(voters.contains(vid, self.users[3].id))
+        self.assertTrue(voters.contains(vid, self.users[3].id))
+        self.assertEqual(voters.misses, 2)
+
+    def test_expired_census(self):
+        vid = self.voting.id
+        self.assertTrue(voters.contains(vid, self.users[0].id))
+        # a change that never arrived
+        Census.objects.filter(voting_id=vid,
+                              voter_id=self.users[0].id).delete()
+        self.assertTrue(voters.contains(vid, self.users[0].id))
+
+        with override_settings(CENSUS_INDEX_TTL=0):
+            self.assertFalse(voters.contains(vid, self.users[0].id))
+        self.assertEqual(voters.misses, 2)
+
+    def test_unhealthy_channel(self):
+        vid = self.voting.id
+        with mock.patch.object(channels.LocalChannel, "healthy", False):
+            self.assertTrue(voters.contains(vid, self.users[0].id))
+            self.assertFalse(voters.contains(vid, self.users[3].id))
+        self.assertEqual(voters.votings, {})
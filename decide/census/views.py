@@ -1,5 +1,4 @@
 from django.db.utils import IntegrityError
-from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import render
 from django.views.generic.base import TemplateView
 from django.http import HttpResponse
@@ -20,6 +19,7 @@ from rest_framework.status import (
 
 from base.perms import UserIsStaff
 from .forms import CreationCensusForm
+from .index import voters
 from .models import Census
 from voting.models import Voting
 from openpyxl.styles import Alignment, Font, PatternFill
@@ -134,9 +134,7 @@ class CensusDetail(generics.RetrieveDestroyAPIView):
         """
 
         voter = request.GET.get("voter_id")
-        try:
-            Census.objects.get(voting_id=voting_id, voter_id=voter)
-        except ObjectDoesNotExist:
+        if not voters.contains(voting_id, voter):
             return Response("Invalid voter", status=ST_401)
         return Response("Valid voter")
 
@@ -176,6 +176,70 @@ STATICFILES_DIRS = BASE_DIR + '/' + 'static',
 
 # number of bits for the key, all auths should use the same number of bits
 KEYBITS = 256
+# processes used by the mixnet to re-encrypt and decrypt the votes. Above 1
+# they're a pool of processes started apart from the web workers, each with
+# its own tables of the keys, see mixnet.mixcrypt.get_pool. Off by default
+MIXNET_WORKERS = 1
+# Re-encryption factors of the shuffles precomputed while the votings are
+# open, see mixnet.tasks. It needs a celery worker. MIXNET_FACTORS_BATCH
+# factors are computed every MIXNET_FACTORS_INTERVAL seconds until there is
+# one per voter, up to MIXNET_FACTORS_MAX
+MIXNET_FACTORS_PRECOMPUTE = False
+MIXNET_FACTORS_BATCH = 1000
+MIXNET_FACTORS_INTERVAL = 60
+MIXNET_FACTORS_MAX = 100000
+# key of the factors kept in the database, which must stay secret, see
+# mixnet.models.Factor. SECRET_KEY is used when it's empty
+MIXNET_FACTORS_KEY = os.environ.get('MIXNET_FACTORS_KEY', '')
+# Groups (p, g) of the keys of the new mixnets generated in advance, see
+# mixnet.models.Group, so starting a voting only generates a private key.
+# With MIXNET_GROUPS_PRECOMPUTE a celery task refills the pool up to
+# MIXNET_GROUPS_TARGET when it has less than MIXNET_GROUPS_LOW groups. It
+# can be filled with the keypool command too
+MIXNET_GROUPS_PRECOMPUTE = False
+MIXNET_GROUPS_LOW = 2
+MIXNET_GROUPS_TARGET = 10
+# Each authority keeps its output of every chunk it shuffles or decrypts,
+# addressed by the digest of the input, so a tally that fails is resumed
+# from the last chunk processed by each authority, see mixnet.models
+MIXNET_CHECKPOINTS = True
+
+# Queries between modules, see base.mods and base.client.
+# Modules served by this instance are called in-process
+MODS_LOCAL_DISPATCH = True
+# keep-alive connections per base url and http timeouts, in seconds
+MODS_POOL_SIZE = 10
+MODS_CONNECT_TIMEOUT = 5
+MODS_READ_TIMEOUT = 300
+# retries with backoff for the idempotent GET queries
+MODS_RETRIES = 3
+MODS_RETRY_BACKOFF = 0.5
+# send the votes of the tallies between store, voting and mixnet in the
+# binary format of base.wire instead of JSON. Every module accepts both
+MODS_BINARY_WIRE = False
+
+# Write-behind ingestion of classic votes, see store.buffer. The votes are
+# written in batches of up to STORE_BATCH_SIZE votes, waiting at most
+# STORE_BATCH_WAIT seconds for a batch to fill up. It needs a threaded
+# server (gunicorn --threads) to group the votes of concurrent requests
+STORE_BATCH_INGESTION = False
+STORE_BATCH_SIZE = 500
+STORE_BATCH_WAIT = 0.005
+STORE_BATCH_CAPACITY = 10000
+# max number of ballots of a request to /store/batch/
+STORE_BATCH_MAX_BALLOTS = 10000
+# votes read by each query of the NDJSON export of the store
+STORE_EXPORT_CHUNK_SIZE = 5000
+# votes shuffled and decrypted together by each step of a tally, None to
+# shuffle all the votes together. The votes of a chunk are only mixed among
+# themselves, so it's also the size of the anonymity set of each vote, and
+# the chunks are cut in the order the votes arrived. Only set it when the
+# votes of a voting don't fit in the memory of the authorities
+TALLY_CHUNK_SIZE = None
+# chunks of a tally in flight along the chain of mixnet authorities at the
+# same time. The authorities must be served by threaded or multi-worker
+# servers (gunicorn --workers/--threads) to process them concurrently
+MIXNET_CHAIN_WINDOW = 2
 
 # Versioning
 ALLOWED_VERSIONS = ['v1', 'v2']
@@ -193,6 +257,36 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_DEFAULT_QUEUE = 'default'
+# run the tally jobs in the process that queues them instead of in a celery
+# worker, see voting.tasks.tally_task. For the tests and the deployments
+# without workers, the request that asks for the tally waits for it
+TALLY_EAGER = False
+# token of a staff user with which the workers read the votes of the tallies
+# when the store isn't served by this instance. The tokens of the users that
+# ask for the tallies aren't sent to the workers, they'd stay in the broker
+TALLY_SERVICE_TOKEN = os.environ.get('TALLY_SERVICE_TOKEN', '')
+# a queued or running tally job without news from its worker in
+# TALLY_JOB_TIMEOUT seconds is failed, so the voting can be tallied again.
+# The workers save their jobs every TALLY_HEARTBEAT seconds while they run
+TALLY_JOB_TIMEOUT = 600
+TALLY_HEARTBEAT = 30
+# votings started, stopped or tallied at the same time by the admin
+# actions and the bulkvoting command, see voting.bulk
+VOTING_BULK_CONCURRENCY = 4
+
+# Publish/subscribe channel used to invalidate the caches of every worker,
+# see base.channels. The LocalChannel only works with a single process
+CHANNEL_BACKEND = 'base.channels.RedisChannel'
+CHANNEL_REDIS_URL = os.environ.get('CHANNEL_REDIS_URL', CELERY_BROKER_URL)
+# seconds the votings are cached to validate the votes, see store.cache
+VOTING_CACHE_TTL = 60
+# seconds and number of tokens cached to resolve their users, see
+# authentication.cache
+AUTH_TOKEN_CACHE_TTL = 60
+AUTH_TOKEN_CACHE_SIZE = 10000
+# seconds the census of a voting is kept in the census index before being
+# loaded again, in case a change was lost, see census.index
+CENSUS_INDEX_TTL = 300
 
 try:
     from local_settings import *
@@ -3,4 +3,24 @@ from django.contrib import admin
 from .models import Mixnet
 
 
-admin.site.register(Mixnet)
+class MixnetAdmin(admin.ModelAdmin):
+    """
+    Admin view for the mixnets, with the precomputed re-encryption factors against the census size.
+    """
+
+    list_display = ('voting_id', 'auth_position', 'factors')
+
+    def factors(self, obj):
+        """
+        Returns the size of the pool of factors and of the census of the voting.
+
+        :param obj: The mixnet.
+        :type obj: Mixnet
+        :return: "<pool> / <census>".
+        :rtype: str
+        """
+
+        return '{} / {}'.format(obj.factors.count(), obj.census_size())
+
+
+admin.site.register(Mixnet, MixnetAdmin)
@@ -0,0 +1,282 @@
+import json
+import os
+import random
+import time
+
+from Crypto.Math.Numbers import Integer
+from Crypto.Random import random as crypto_random
+from Crypto.Util.number import getPrime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base import wire
+from base.models import Key
+from mixnet.mixcrypt import KeyTables, MixCrypt, get_dlog
+from mixnet.mixcrypt import get_pool, rand, rng
+from mixnet.models import get_key
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the shuffle and the decryption of the mixnet with '
+            'different numbers of worker processes, the generation of its '
+            'permutations, its re-encryption with fixed-base tables, the '
+            'encoding of its messages in JSON and in the binary format of '
+            'base.wire or the latency of a request to shuffle or decrypt a '
+            'chunk with a key generated and thrown away by MixCrypt, like '
+            'before the lazy keys, and with the cached key of '
+            'mixnet.models.get_key, or the discrete logs of the counts of a '
+            'homomorphic tally. It runs in memory only')
+
+    SIZES = {
+        'shuffle': [10000, 100000],
+        'decrypt': [10000, 100000, 1000000],
+        'perm': [10000, 100000, 1000000],
+        'reencrypt': [1000],
+        'wire': [10000, 100000],
+        'latency': [10, 100, 1000],
+        'dlog': [10000, 1000000, 10000000],
+    }
+
+    def add_arguments(self, parser):
+        cpus = os.cpu_count() or 1
+        workers = sorted({1, 2, 4, 8, cpus})
+        parser.add_argument('--op', choices=sorted(self.SIZES),
+                            default='shuffle', help='operation to measure')
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            help='number of votes, by default 10k and 100k '
+                                 'to shuffle, 10k, 100k and 1M to decrypt '
+                                 'and permute, 1k to re-encrypt, 10k '
+                                 'and 100k to encode, 10, 100 and 1k '
+                                 'for the latency and 10k, 1M and 10M '
+                                 'voters for the discrete logs')
+        parser.add_argument('--workers', type=int, nargs='+',
+                            default=[w for w in workers if w <= cpus],
+                            help='worker processes to measure')
+        parser.add_argument('--bits', type=int, nargs='+',
+                            default=[settings.KEYBITS],
+                            help='bits of the keys, only the first one is '
+                                 'used to shuffle and decrypt')
+        parser.add_argument('--max-pop', type=int, default=100000,
+                            help='biggest permutation generated with '
+                                 'list.pop, it takes quadratic time')
+        parser.add_argument('--options', type=int, default=5,
+                            help='counts recovered by each discrete log '
+                                 'batch')
+        parser.add_argument('--max-linear', type=int, default=1000000,
+                            help='most voters of the discrete logs with the '
+                                 'linear search, it takes linear time')
+
+    def measure(self, func, workers):
+        if workers > 1:
+            # not measuring the start of the processes
+            get_pool(workers).submit(int).result()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    def row(self, size, name, elapsed, base):
+        self.stdout.write('{:>10} {:>8} {:>12.3f} {:>14.0f} {:>10.2f}'.format(
+            size, name, elapsed, size / elapsed, base / elapsed))
+
+    def pop_perm(self, n):
+        # how shuffle_decrypt permuted the votes before the RandomPool
+        items = list(range(n))
+        perm = []
+        while items:
+            i = crypto_random.StrongRandom().randint(0, len(items) - 1)
+            perm.append(items.pop(i))
+        return perm
+
+    def perms(self, sizes, max_pop):
+        self.stdout.write('{:>10} {:>8} {:>12} {:>14} {:>12}'.format(
+            'votes', 'method', 'perm (s)', 'votes/s', 'us/vote'))
+        for size in sorted(sizes):
+            methods = [('rng', rng.permutation)]
+            if size <= max_pop:
+                methods.insert(0, ('pop', self.pop_perm))
+            for name, func in methods:
+                elapsed = self.measure(lambda: func(size), 1)
+                self.stdout.write(
+                    '{:>10} {:>8} {:>12.3f} {:>14.0f} {:>12.2f}'.format(
+                        size, name, elapsed, size / elapsed,
+                        elapsed / size * 1e6))
+
+    def reencryptions(self, sizes, bits_list):
+        self.stdout.write('{:>6} {:>10} {:>8} {:>10} {:>12} {:>10}'.format(
+            'bits', 'votes', 'method', 'build (s)', 'us/vote', 'speedup'))
+        for bits in bits_list:
+            # any prime is as slow as the safe primes of the real keys
+            p = getPrime(bits)
+            g, y = random.randrange(2, p), random.randrange(2, p)
+            P, G, Y = Integer(p), Integer(g), Integer(y)
+            for size in sorted(sizes):
+                rs = [rand(p) for i in range(size)]
+                # what ElGamal._encrypt does
+                base = self.measure(
+                    lambda: [(pow(G, r, P), pow(Y, r, P) % P) for r in rs], 1)
+                start = time.perf_counter()
+                tables = KeyTables(p, g, y)
+                build = time.perf_counter() - start
+                elapsed = self.measure(
+                    lambda: [tables.encrypt(1, r) for r in rs], 1)
+                for name, t, b in (('elgamal', base, 0), ('tables', elapsed,
+                                                          build)):
+                    self.stdout.write(
+                        '{:>6} {:>10} {:>8} {:>10.3f} {:>12.1f} {:>10.2f}'
+                        .format(bits, size, name, b, t / size * 1e6,
+                                base / t))
+
+    def wire_formats(self, sizes, bits_list):
+        self.stdout.write('{:>6} {:>10} {:>8} {:>10} {:>10} {:>10} {:>8}'
+                          .format('bits', 'votes', 'format', 'MB', 'dump (s)',
+                                  'load (s)', 'speedup'))
+        formats = (('json', lambda d: json.dumps(d).encode(), json.loads),
+                   ('binary', wire.dumps, wire.loads))
+        for bits in bits_list:
+            for size in sorted(sizes):
+                p = 2 ** bits
+                data = {'seq': 1, 'msgs': [[random.randrange(p),
+                                            random.randrange(p)]
+                                           for i in range(size)]}
+                base = None
+                for name, dumps, loads in formats:
+                    body = None
+
+                    def dump():
+                        nonlocal body
+                        body = dumps(data)
+
+                    dumped = self.measure(dump, 1)
+                    loaded = self.measure(lambda: loads(body), 1)
+                    base = base or dumped + loaded
+                    self.stdout.write(
+                        '{:>6} {:>10} {:>8} {:>10.2f} {:>10.3f} {:>10.3f} '
+                        '{:>8.2f}'.format(bits, size, name, len(body) / 1e6,
+                                          dumped, loaded,
+                                          base / (dumped + loaded)))
+
+    def latencies(self, sizes, bits, workers, repeat=5):
+        self.stdout.write('{:>10} {:>8} {:>8} {:>12} {:>10}'.format(
+            'votes', 'op', 'key', 'latency (ms)', 'speedup'))
+        k = MixCrypt(bits=bits).k
+        # a row that isn't saved, the id of the cache
+        key = Key(id=0, p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
+        pk = (key.p, key.g, key.y)
+
+        def eager():
+            # what Mixnet.shuffle and decrypt did: the constructor generated
+            # a key and setk replaced it
+            crypt = MixCrypt(bits=bits, workers=workers)
+            crypt.genk()
+            crypt.setk(key.p, key.g, key.y, key.x)
+            return crypt
+
+        def cached():
+            crypt = MixCrypt(bits=bits, workers=workers)
+            crypt.k = get_key(key)
+            return crypt
+
+        ops = (('shuffle', lambda c, msgs: c.shuffle(msgs, pk)),
+               ('decrypt', lambda c, msgs: c.shuffle_decrypt(msgs)))
+        for size in sorted(sizes):
+            msgs = [cached().encrypt(random.randrange(2, 1000))
+                    for i in range(size)]
+            for op, func in ops:
+                base = None
+                for name, crypt in (('eager', eager), ('cached', cached)):
+                    elapsed = min(
+                        self.measure(lambda: func(crypt(), msgs), workers)
+                        for i in range(repeat))
+                    base = base or elapsed
+                    self.stdout.write(
+                        '{:>10} {:>8} {:>8} {:>12.1f} {:>10.2f}'.format(
+                            size, op, name, elapsed * 1000, base / elapsed))
+
+    def dlogs(self, sizes, bits, options, max_linear):
+        self.stdout.write('{:>10} {:>8} {:>10} {:>10} {:>10}'.format(
+            'voters', 'method', 'build (s)', 'logs (s)', 'speedup'))
+        k = MixCrypt(bits=bits).k
+        p, g = int(k.p), int(k.g)
+
+        def linear(hs):
+            # what the tally did before the tables
+            found = []
+            for h in hs:
+                x, m = 1, 0
+                while x != h:
+                    x, m = x * g % p, m + 1
+                found.append(m)
+            return found
+
+        for size in sorted(sizes):
+            # the worst case, every count near the number of voters
+            ms = [size - i for i in range(options)]
+            hs = [pow(g, m, p) for m in ms]
+            base = None
+            if size <= max_linear:
+                base = self.measure(lambda: linear(hs), 1)
+                self.stdout.write('{:>10} {:>8} {:>10.3f} {:>10.3f} {:>10.2f}'
+                                  .format(size, 'linear', 0, base, 1))
+            # the sizes are sorted, so every table is bigger than the cached
+            build = self.measure(lambda: get_dlog(g, p, size, options), 1)
+            table = get_dlog(g, p, size, options)
+            elapsed = self.measure(lambda: table.logs(hs, size), 1)
+            self.stdout.write('{:>10} {:>8} {:>10.3f} {:>10.3f} {:>10}'.format(
+                size, 'bsgs', build, elapsed,
+                '{:.2f}'.format(base / (build + elapsed)) if base else '-'))
+
+    def handle(self, *args, **options):
+        op = options['op']
+        if op == 'dlog':
+            self.dlogs(options['sizes'] or self.SIZES[op], options['bits'][0],
+                       options['options'], options['max_linear'])
+            return
+        if op == 'latency':
+            self.latencies(options['sizes'] or self.SIZES[op],
+                           options['bits'][0], min(options['workers']))
+            return
+        if op == 'wire':
+            self.wire_formats(options['sizes'] or self.SIZES[op],
+                              options['bits'])
+            return
+        if op == 'perm':
+            self.perms(options['sizes'] or self.SIZES[op], options['max_pop'])
+            return
+        if op == 'reencrypt':
+            self.reencryptions(options['sizes'] or self.SIZES[op],
+                               options['bits'])
+            return
+
+        crypt = MixCrypt(bits=options['bits'][0])
+        k = crypt.k
+        pk = (k.p, k.g, k.y)
+        self.stdout.write('cpus: {}'.format(os.cpu_count()))
+        self.stdout.write('{:>10} {:>8} {:>12} {:>14} {:>10}'.format(
+            'votes', 'workers', op + ' (s)', 'votes/s', 'speedup'))
+        for size in sorted(options['sizes'] or self.SIZES[op]):
+            if op == 'shuffle':
+                msgs = [crypt.encrypt(random.randrange(2, 1000))
+                        for i in range(size)]
+            else:
+                # any pair of numbers is decrypted in the same time
+                p = int(k.p)
+                msgs = [(random.randrange(2, p), random.randrange(2, p))
+                        for i in range(size)]
+
+            base = None
+            if op == 'decrypt':
+                # one message at a time, like before the batch decryption
+                base = self.measure(
+                    lambda: [k._decrypt(m) for m in msgs], 1)
+                self.row(size, 'single', base, base)
+
+            for workers in sorted(options['workers']):
+                crypt.workers = workers
+                if op == 'shuffle':
+                    elapsed = self.measure(
+                        lambda: crypt.shuffle(msgs, pk), workers)
+                else:
+                    elapsed = self.measure(
+                        lambda: crypt.shuffle_decrypt(msgs), workers)
+                base = base or elapsed
+                self.row(size, workers, elapsed, base)
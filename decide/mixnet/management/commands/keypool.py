@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mixnet.models import Group, Mixnet
+
+
+class Command(BaseCommand):
+    help = ('Fills the pool of groups (p, g) of the ElGamal keys of the new '
+            'mixnets and shows its metrics, or measures the generation of '
+            'the keys with and without the pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fill', type=int, metavar='N',
+                            help='generate groups until there are N in the '
+                                 'pool')
+        parser.add_argument('--bits', type=int, default=settings.KEYBITS,
+                            help='bits of the groups')
+        parser.add_argument('--bench', type=int, metavar='N',
+                            help='generate N keys of KEYBITS without and '
+                                 'N keys with the pool, which is filled '
+                                 'first, and delete them')
+
+    def show(self, stats):
+        for name in ('bits', 'pool', 'low', 'target', 'generated',
+                     'rejected', 'taken', 'misses'):
+            self.stdout.write('{:>10}: {}'.format(name, stats[name]))
+
+    def gen_keys(self, n):
+        start = time.perf_counter()
+        for i in range(n):
+            mn = Mixnet.objects.create(voting_id=0)
+            mn.gen_key()
+            mn.key.delete()
+            mn.delete()
+        return (time.perf_counter() - start) / n
+
+    def bench(self, n):
+        # the keys of the mixnets always have KEYBITS
+        bits = settings.KEYBITS
+        Group.fill(bits, n)
+        groups = list(Group.objects.filter(bits=bits))
+        Group.objects.filter(bits=bits).delete()
+        generated = self.gen_keys(n)
+        Group.objects.bulk_create(groups)
+        pooled = self.gen_keys(n)
+        self.stdout.write('{:>8} {:>12} {:>10}'.format('pool', 'ms/key',
+                                                       'speedup'))
+        self.stdout.write('{:>8} {:>12.1f} {:>10.2f}'.format(
+            'no', generated * 1000, 1))
+        self.stdout.write('{:>8} {:>12.1f} {:>10.2f}'.format(
+            'yes', pooled * 1000, generated / pooled))
+
+    def handle(self, *args, **options):
+        bits = options['bits']
+        if options['bench']:
+            self.bench(options['bench'])
+            return
+        if options['fill'] is not None:
+            self.show(Group.fill(bits, options['fill']))
+        else:
+            self.show(Group.stats(bits))
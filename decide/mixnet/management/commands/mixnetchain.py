@@ -0,0 +1,129 @@
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base import mods
+from mixnet.mixcrypt import encrypt
+
+
+SETTINGS = '''from decide.settings import *
+
+BASEURL = {url!r}
+APIS = {{}}
+DATABASES = {{
+    'default': {{
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': {db!r},
+    }}
+}}
+MIXNET_FACTORS_PRECOMPUTE = False
+'''
+
+
+class Command(BaseCommand):
+    help = ('Starts a chain of mixnet authorities in local processes, each '
+            'one with its own port and database, and sends them chunks of '
+            'votes to shuffle and decrypt with different windows of chunks '
+            'in flight, checking the acknowledgements and the decrypted '
+            'votes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--auths', type=int, default=3,
+                            help='number of authorities')
+        parser.add_argument('--port', type=int, default=9000,
+                            help='port of the first authority, the next '
+                                 'ones use the following ports')
+        parser.add_argument('--chunks', type=int, default=8,
+                            help='chunks of votes')
+        parser.add_argument('--size', type=int, default=1000,
+                            help='votes of each chunk')
+        parser.add_argument('--windows', type=int, nargs='+', default=[1, 2],
+                            help='chunks in flight to measure')
+        parser.add_argument('--voting', type=int, default=1,
+                            help='id of the voting of the mixnet')
+
+    def start(self, tmp, i, url):
+        # every authority has its own settings module and database
+        name = 'chain_auth{}'.format(i)
+        with open(os.path.join(tmp, name + '.py'), 'w') as f:
+            f.write(SETTINGS.format(
+                url=url, db=os.path.join(tmp, name + '.sqlite3')))
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=name,
+                   PYTHONPATH=os.pathsep.join([tmp, settings.BASE_DIR]))
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        log = open(os.path.join(tmp, name + '.log'), 'w')
+        subprocess.run([sys.executable, manage, 'migrate'], env=env,
+                       stdout=log, stderr=log, check=True)
+        return subprocess.Popen(
+            [sys.executable, manage, 'runserver', '--noreload',
+             url.split('//')[1]], env=env, stdout=log, stderr=log)
+
+    def wait(self, url, timeout=60):
+        limit = time.monotonic() + timeout
+        while time.monotonic() < limit:
+            try:
+                requests.get(url + '/mixnet/', timeout=1)
+                return
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.2)
+        raise CommandError('{} did not start'.format(url))
+
+    def mix(self, first, voting, pk, seq, clear):
+        msgs = [encrypt(m, pk) for m in clear]
+        for path in ('/shuffle/{}/', '/decrypt/{}/'):
+            data = {'seq': seq, 'msgs': msgs}
+            r = mods.post('mixnet', entry_point=path.format(voting),
+                          baseurl=first, json=data)
+            msgs = mods.read_chunk(r, seq, len(clear))
+        return msgs
+
+    def chain(self, urls, options):
+        voting = options['voting']
+        auths = [{'name': 'auth{}'.format(i), 'url': url}
+                 for i, url in enumerate(urls)]
+        key = mods.post('mixnet', baseurl=urls[0],
+                        json={'voting': voting, 'auths': auths})
+        pk = (key['p'], key['g'], key['y'])
+
+        chunks = [[random.randrange(2, 1000) for i in range(options['size'])]
+                  for c in range(options['chunks'])]
+        votes = options['size'] * options['chunks']
+        self.stdout.write('{:>6} {:>8} {:>10} {:>10}'.format(
+            'auths', 'window', 'tally (s)', 'votes/s'))
+        for window in options['windows']:
+            start = time.perf_counter()
+            results = mods.pipeline(
+                lambda seq, clear: self.mix(urls[0], voting, pk, seq, clear),
+                enumerate(chunks), window)
+            for seq, (clear, decrypted) in enumerate(zip(chunks, results)):
+                if sorted(decrypted) != sorted(clear):
+                    raise CommandError('Chunk {} was not decrypted'
+                                       .format(seq))
+            elapsed = time.perf_counter() - start
+            self.stdout.write('{:>6} {:>8} {:>10.3f} {:>10.0f}'.format(
+                len(urls), window, elapsed, votes / elapsed))
+
+    def handle(self, *args, **options):
+        urls = ['http://127.0.0.1:{}'.format(options['port'] + i)
+                for i in range(options['auths'])]
+        procs = []
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                for i, url in enumerate(urls):
+                    procs.append(self.start(tmp, i, url))
+                for url in urls:
+                    self.wait(url)
+                self.chain(urls, options)
+            finally:
+                for p in procs:
+                    p.terminate()
+                for p in procs:
+                    p.wait()
@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-17 01:51
+
+import base.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Factor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('a', base.models.BigBigField()),
+                ('b', base.models.BigBigField()),
+                ('mixnet', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='factors', to='mixnet.mixnet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='factor',
+            index=models.Index(fields=['mixnet', 'key'],
+                               name='mixnet_factor_key_idx'),
+        ),
+    ]
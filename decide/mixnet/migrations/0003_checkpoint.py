@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-17 02:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0002_factor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=16)),
+                ('digest', models.CharField(max_length=64)),
+                ('count', models.PositiveIntegerField()),
+                ('output', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('mixnet', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='checkpoints', to='mixnet.mixnet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='checkpoint',
+            constraint=models.UniqueConstraint(
+                fields=('mixnet', 'stage', 'digest'),
+                name='mixnet_checkpoint_unique'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1 on 2026-10-17 02:52
+
+import base.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0003_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Group',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('bits', models.PositiveIntegerField()),
+                ('p', base.models.BigBigField()),
+                ('g', base.models.BigBigField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['bits'],
+                               name='mixnet_group_bits_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def delete_factors(apps, schema_editor):
+    # the factors kept in the clear are dropped, the pool is filled again
+    apps.get_model('mixnet', 'Factor').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0004_group'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_factors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='factor',
+            name='a',
+        ),
+        migrations.RemoveField(
+            model_name='factor',
+            name='b',
+        ),
+        migrations.AddField(
+            model_name='factor',
+            name='sealed',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+    ]
@@ -34,15 +34,114 @@ True
 '''
 
 
+import hashlib
+import math
+import multiprocessing
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pprint import pprint
 
+from Crypto.Math.Numbers import Integer
 from Crypto.PublicKey import ElGamal
 from Crypto.Random import random
 from Crypto import Random
-from Crypto.Util.number import GCD
+from Crypto.Util.number import GCD, isPrime
 from Crypto.Cipher import AES
 
 
+class RandomPool:
+    """
+    Cryptographically secure random numbers for the mixnet, read from the OS in blocks of BLOCK bytes.
+
+    A single instance, rng, is shared by the whole module instead of creating a new StrongRandom for every
+    number. The block is dropped after a fork, so the worker processes of the pool never reuse the bytes of
+    their parent.
+    """
+
+    BLOCK = 1 << 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffer = b''
+        self.pos = 0
+        self.pid = None
+
+    def read(self, n):
+        """
+        Returns n random bytes.
+
+        :param n: Number of bytes.
+        :type n: int
+        :return: The random bytes.
+        :rtype: bytes
+        """
+
+        with self.lock:
+            if self.pid != os.getpid() or self.pos + n > len(self.buffer):
+                self.buffer = Random.get_random_bytes(max(self.BLOCK, n))
+                self.pos = 0
+                self.pid = os.getpid()
+            data = self.buffer[self.pos:self.pos + n]
+            self.pos += n
+            return data
+
+    def randbelow(self, n):
+        """
+        Returns a uniform random integer in [0, n), without modulo bias.
+
+        :param n: Upper bound, not included.
+        :type n: int
+        :return: The random integer.
+        :rtype: int
+        """
+
+        bits = n.bit_length()
+        size = (bits + 7) // 8
+        while True:
+            r = int.from_bytes(self.read(size), 'big') >> (size * 8 - bits)
+            if r < n:
+                return r
+
+    def randint(self, a, b):
+        """
+        Returns a uniform random integer in [a, b].
+        """
+
+        return a + self.randbelow(b - a + 1)
+
+    def permutation(self, n):
+        """
+        Generates a uniform random permutation of range(n) with the Fisher-Yates shuffle, in O(n).
+
+        The random numbers are 64-bit words read in a single block, rejecting the few values that would
+        introduce modulo bias.
+
+        :param n: The length of the permutation.
+        :type n: int
+        :return: The permuted indices.
+        :rtype: array
+        """
+
+        perm = array('q', range(n))
+        words = array('Q', self.read(8 * n))
+        for i in range(n - 1, 0, -1):
+            m = i + 1
+            w = words[i]
+            limit = (1 << 64) - (1 << 64) % m
+            while w >= limit:
+                w = int.from_bytes(self.read(8), 'big')
+            j = w % m
+            perm[i], perm[j] = perm[j], perm[i]
+        return perm
+
+
+rng = RandomPool()
+
+
 def rand(p):
     """
     Generates a random integer k where GCD(k, p-1) == 1.
@@ -53,13 +152,661 @@ def rand(p):
     :rtype: int
     """
 
+    p = int(p)
     while True:
-        k = random.StrongRandom().randint(1, int(p) - 1)
-        if GCD(k, int(p) - 1) == 1:
+        k = rng.randint(1, p - 1)
+        if GCD(k, p - 1) == 1:
             break
     return k
 
 
+# min number of messages to use the process pool, below it the cost of
+# sending them to the workers is bigger than the gain
+PARALLEL_MIN = 1000
+
+# the worker processes are started by a server process, or from scratch,
+# instead of forking the threaded process that uses the pool, as a fork
+# keeps the locks held by its other threads
+POOL_START_METHOD = ('forkserver'
+                     if 'forkserver' in multiprocessing.get_all_start_methods()
+                     else 'spawn')
+
+_pool = None
+_pool_pid = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+# fixed-base tables of the last public keys used, by fingerprint, in this
+# process and in each worker of the pool, a few MB each with the big keys
+TABLES_CACHE_SIZE = 4
+WORKER_TABLES_CACHE_SIZE = 1
+# keys of more bits use the GMP integers of pycryptodome in the tables, the
+# python ones are faster for the small keys
+TABLES_GMP_BITS = 1024
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+# baby-step giant-step tables of the last groups used, by (p, g)
+DLOG_CACHE_SIZE = 4
+
+_dlogs = OrderedDict()
+_dlogs_lock = threading.Lock()
+
+
+def init_worker():
+    """
+    Initializes a worker process of the pool, which keeps the tables of fewer keys.
+    """
+
+    global TABLES_CACHE_SIZE
+    TABLES_CACHE_SIZE = WORKER_TABLES_CACHE_SIZE
+
+
+def get_pool(workers):
+    """
+    Returns the process pool of this process, creating it if needed. Its processes are started with
+    POOL_START_METHOD.
+
+    :param workers: Number of worker processes.
+    :type workers: int
+    :return: The process pool.
+    :rtype: ProcessPoolExecutor
+    """
+
+    global _pool, _pool_pid, _pool_workers
+
+    with _pool_lock:
+        if _pool_pid != os.getpid() or _pool_workers != workers:
+            if _pool and _pool_pid == os.getpid():
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                initializer=init_worker)
+            _pool_pid = os.getpid()
+            _pool_workers = workers
+        return _pool
+
+
+def to_gmp(n):
+    """
+    Converts a non-negative python int to a GMP Integer, through its bytes, much faster than Integer(n).
+
+    :param n: The number.
+    :type n: int
+    :return: The number.
+    :rtype: Integer
+    """
+
+    size = (n.bit_length() + 7) // 8 or 1
+    return Integer.from_bytes(n.to_bytes(size, 'big'))
+
+
+def from_gmp(n):
+    """
+    Converts a GMP Integer to a python int, through its bytes, much faster than int(n).
+
+    :param n: The number.
+    :type n: Integer
+    :return: The number.
+    :rtype: int
+    """
+
+    return int.from_bytes(n.to_bytes(), 'big')
+
+
+class FixedBase:
+    """
+    Table of the powers of a fixed base modulo p, to compute base^e with a multiplication for every byte of e
+    and no squarings.
+
+    Row i holds base^(j * 256^i) mod p for j in [0, 256), so base^e is the product of the entries selected by
+    the bytes of e. It takes 256 numbers of the size of p for every byte of p: 0.5 MB for a key of 256 bits,
+    ~30 MB for one of 2048 bits.
+
+    :param base: The base.
+    :type base: int
+    :param p: The modulus.
+    :type p: int
+    """
+
+    def __init__(self, base, p):
+        base, p = int(base), int(p)
+        self.base = base
+        self.p = p
+        self.size = (p.bit_length() + 7) // 8
+        self.gmp = p.bit_length() > TABLES_GMP_BITS
+        self.P = Integer(p)
+        self.rows = []
+        for i in range(self.size):
+            row = [1] * 256
+            acc = 1
+            for j in range(1, 256):
+                acc = acc * base % p
+                row[j] = acc
+            base = acc * base % p
+            if self.gmp:
+                row = [to_gmp(x) for x in row]
+            self.rows.append(row)
+
+    def pow(self, e):
+        """
+        Computes base^e mod p.
+
+        :param e: The exponent.
+        :type e: int
+        :return: The power.
+        :rtype: int
+        """
+
+        e = int(e)
+        if e < 0 or e.bit_length() > self.size * 8:
+            return pow(self.base, e, self.p)
+
+        digits = e.to_bytes(self.size, 'little')
+        if self.gmp:
+            acc = Integer(1)
+            for row, d in zip(self.rows, digits):
+                if d:
+                    acc *= row[d]
+                    acc %= self.P
+            return from_gmp(acc)
+
+        p = self.p
+        acc = 1
+        for row, d in zip(self.rows, digits):
+            if d:
+                acc = acc * row[d] % p
+        return acc
+
+
+class DiscreteLog:
+    """
+    Baby-step giant-step solver of h = g^m mod p for small m, to recover the counts of the exponential
+    ElGamal tallies.
+
+    The table holds g^j for j in [0, steps), by value, so the m of h is found by multiplying h by g^-steps
+    until it's in the table, in at most bound / steps giant steps. Solving n logs up to bound takes about
+    steps + n * bound / steps multiplications, the least with steps = sqrt(n * bound) (see get_dlog): for
+    10M voters and 5 options, a table of ~7k entries and ~1.4k giant steps per option, instead of up to
+    10M multiplications per option of the linear search.
+
+    :param g: Generator number.
+    :type g: int
+    :param p: Prime number.
+    :type p: int
+    :param steps: Number of baby steps.
+    :type steps: int
+    """
+
+    def __init__(self, g, p, steps):
+        g, p = int(g), int(p)
+        self.g = g
+        self.p = p
+        self.steps = max(1, int(steps))
+        self.table = {}
+        x = 1
+        for j in range(self.steps):
+            # the first j if the order of g is smaller than steps
+            self.table.setdefault(x, j)
+            x = x * g % p
+        self.giant = pow(x, -1, p)
+
+    def logs(self, hs, bound):
+        """
+        Finds the m of h = g^m mod p with 0 <= m <= bound of each h, with the giant steps of all of them
+        in the same loop.
+
+        :param hs: The decrypted messages.
+        :type hs: list
+        :param bound: The max m.
+        :type bound: int
+        :return: The m of each message, in the same order.
+        :rtype: list
+        :raises ValueError: If there isn't such m for some message.
+        """
+
+        table, giant, p, steps = self.table, self.giant, self.p, self.steps
+        found = [None] * len(hs)
+        pending = {i: int(h) % p for i, h in enumerate(hs)}
+        for i in range(bound // steps + 1):
+            for k, h in list(pending.items()):
+                j = table.get(h, None)
+                if j is None:
+                    pending[k] = h * giant % p
+                    continue
+                if i * steps + j > bound:
+                    raise ValueError('No discrete log up to {}'.format(bound))
+                found[k] = i * steps + j
+                del pending[k]
+            if not pending:
+                return found
+        raise ValueError('No discrete log up to {}'.format(bound))
+
+
+class KeyTables:
+    """
+    Fixed-base tables of g and y of an ElGamal public key, to encrypt with it many times.
+
+    :param p: Prime number.
+    :type p: int
+    :param g: Generator number.
+    :type g: int
+    :param y: Public key component.
+    :type y: int
+    """
+
+    def __init__(self, p, g, y):
+        self.p = int(p)
+        self.g = FixedBase(g, p)
+        self.y = FixedBase(y, p)
+
+    def encrypt(self, m, r):
+        """
+        Encrypts a message with the random number r, like ElGamal._encrypt.
+
+        :param m: The message.
+        :type m: int
+        :param r: The random number.
+        :type r: int
+        :return: The encrypted message.
+        :rtype: tuple
+        """
+
+        return self.g.pow(r), (int(m) * self.y.pow(r)) % self.p
+
+
+def fingerprint(pubkey):
+    """
+    Returns the fingerprint of a public key, the SHA-256 of "p:g:y".
+
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :return: The hex digest.
+    :rtype: str
+    """
+
+    data = ':'.join(str(int(i)) for i in pubkey)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def gen_group(bits):
+    """
+    Generates the group of a new ElGamal key: a safe prime p of the given bits and a generator g of the
+    subgroup of order (p - 1) / 2. It's the slow part of the generation of a key.
+
+    :param bits: Bits of p.
+    :type bits: int
+    :return: The group (p, g).
+    :rtype: tuple
+    """
+
+    k = ElGamal.generate(bits, Random.new().read)
+    return int(k.p), int(k.g)
+
+
+def check_group(p, g, bits):
+    """
+    Checks a group generated by gen_group: p is a safe prime of the given bits and g generates the
+    subgroup of order q = (p - 1) / 2, with the same restrictions on g of ElGamal.generate.
+
+    :param p: Prime number.
+    :type p: int
+    :param g: Generator number.
+    :type g: int
+    :param bits: Bits of p.
+    :type bits: int
+    :return: If the group is valid.
+    :rtype: bool
+    """
+
+    q = (p - 1) // 2
+    if p.bit_length() != bits or not isPrime(p) or not isPrime(q):
+        return False
+    if not 2 < g < p - 1 or pow(g, q, p) != 1:
+        return False
+    return (p - 1) % g != 0 and (p - 1) % pow(g, -1, p) != 0
+
+
+def get_tables(pubkey):
+    """
+    Returns the fixed-base tables of a public key, building them the first time. The tables of the last
+    TABLES_CACHE_SIZE keys are kept in each process, and of WORKER_TABLES_CACHE_SIZE keys in the workers of
+    the pool.
+
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :return: The tables of the key.
+    :rtype: KeyTables
+    """
+
+    key = fingerprint(pubkey)
+    with _tables_lock:
+        tables = _tables.get(key, None)
+        if tables is not None:
+            _tables.move_to_end(key)
+            return tables
+
+    tables = KeyTables(*pubkey)
+    with _tables_lock:
+        _tables[key] = tables
+        while len(_tables) > TABLES_CACHE_SIZE:
+            _tables.popitem(last=False)
+    return tables
+
+
+def encrypt(m, pubkey):
+    """
+    Encrypts a message with a public key, using the fixed-base tables of the key.
+
+    :param m: The message to encrypt.
+    :type m: int
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :return: The encrypted message.
+    :rtype: tuple
+    """
+
+    return get_tables(pubkey).encrypt(m, rand(pubkey[0]))
+
+
+def encrypt_exponent(m, pubkey):
+    """
+    Encrypts g^m, the exponential ElGamal encoding of m. The component-wise product of two of these
+    ciphertexts is the encryption of the sum of their numbers, so the votes can be added up without
+    decrypting them, and the sum is found with dlog.
+
+    :param m: The number to encrypt, small and not negative.
+    :type m: int
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :return: The encrypted message.
+    :rtype: tuple
+    """
+
+    p, g, y = pubkey
+    return encrypt(pow(g, m, p), pubkey)
+
+
+def challenge(q, *values):
+    """
+    Returns the Fiat-Shamir challenge of a proof, the SHA-256 of the decimal values joined by commas,
+    modulo q. The booth computes it the same way.
+
+    :param q: Order of the group of g, (p - 1) / 2.
+    :type q: int
+    :param values: The public values of the proof.
+    :type values: int
+    :return: The challenge.
+    :rtype: int
+    """
+
+    data = ','.join(str(int(v)) for v in values)
+    return int(hashlib.sha256(data.encode()).hexdigest(), 16) % q
+
+
+def prove_ballot(choice, size, pubkey):
+    """
+    Encrypts a ballot of the homomorphic tally, g for the option at the index choice and 1 (g^0) for the
+    rest of the size options, with the proofs checked by verify_ballot: a disjunctive Chaum-Pedersen proof
+    that every ciphertext is the one of 0 or 1, and a Chaum-Pedersen proof that their product is the one
+    of 1, so the ballot has a single vote. It's what the booth does, for the tests and the clients in
+    python.
+
+    :param choice: Index of the option voted.
+    :type choice: int
+    :param size: Number of options.
+    :type size: int
+    :param pubkey: Public key (p, g, y), g of prime order (p - 1) / 2.
+    :type pubkey: tuple
+    :return: The ciphertexts, a list of (a, b), and the proof, {"options": list, "sum": dict}.
+    :rtype: tuple
+    """
+
+    p, g, y = (int(i) for i in pubkey)
+    q = (p - 1) // 2
+    ciphertexts, proofs = [], []
+    total = 0
+    for i in range(size):
+        m = int(i == choice)
+        r = rng.randint(1, q - 1)
+        total += r
+        a, b = pow(g, r, p), pow(y, r, p) * pow(g, m, p) % p
+        # the other branch is simulated with its challenge and response
+        c, s, commit = [0, 0], [0, 0], [None, None]
+        c[1 - m], s[1 - m] = rng.randint(0, q - 1), rng.randint(0, q - 1)
+        fake = b * pow(g, -(1 - m), p) % p
+        commit[1 - m] = (pow(g, s[1 - m], p) * pow(a, -c[1 - m], p) % p,
+                         pow(y, s[1 - m], p) * pow(fake, -c[1 - m], p) % p)
+        w = rng.randint(1, q - 1)
+        commit[m] = (pow(g, w, p), pow(y, w, p))
+        c[m] = (challenge(q, p, g, y, a, b, *commit[0], *commit[1]) -
+                c[1 - m]) % q
+        s[m] = (w + c[m] * r) % q
+        ciphertexts.append((a, b))
+        proofs.append({'A0': commit[0][0], 'B0': commit[0][1],
+                       'A1': commit[1][0], 'B1': commit[1][1],
+                       'c0': c[0], 'c1': c[1], 's0': s[0], 's1': s[1]})
+
+    a = b = 1
+    for x, z in ciphertexts:
+        a, b = a * x % p, b * z % p
+    w = rng.randint(1, q - 1)
+    A, B = pow(g, w, p), pow(y, w, p)
+    c = challenge(q, p, g, y, a, b, A, B)
+    return ciphertexts, {'options': proofs,
+                         'sum': {'A': A, 'B': B, 's': (w + c * total) % q}}
+
+
+def verify_ballot(ciphertexts, proof, pubkey):
+    """
+    Checks the proofs of a ballot of the homomorphic tally made by prove_ballot: every ciphertext (a, b) is
+    in the group of g and is the encryption of 0 or 1, and their product is the encryption of 1.
+
+    For each ciphertext and i in {0, 1} it checks g^si = Ai * a^ci and y^si = Bi * (b / g^i)^ci, with
+    c0 + c1 the challenge of (p, g, y, a, b, A0, B0, A1, B1), and for the product (a, b) of the ciphertexts
+    g^s = A * a^c and y^s = B * (b / g)^c, with c the challenge of (p, g, y, a, b, A, B).
+
+    :param ciphertexts: The ciphertexts, a list of (a, b).
+    :type ciphertexts: list
+    :param proof: The proof, {"options": list, "sum": dict}, with numbers or decimal strings.
+    :type proof: dict
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :return: True if the proofs are valid, False if they aren't or are malformed.
+    :rtype: bool
+    """
+
+    p, g, y = (int(i) for i in pubkey)
+    q = (p - 1) // 2
+    try:
+        options = proof['options']
+        if len(options) != len(ciphertexts):
+            return False
+        a_t = b_t = 1
+        for (a, b), pr in zip(ciphertexts, options):
+            a, b = int(a), int(b)
+            if not (0 < a < p and 0 < b < p and pow(a, q, p) == 1 and
+                    pow(b, q, p) == 1):
+                return False
+            A0, B0, A1, B1 = (int(pr[k]) % p for k in ('A0', 'B0', 'A1', 'B1'))
+            c0, c1, s0, s1 = (int(pr[k]) % q for k in ('c0', 'c1', 's0', 's1'))
+            if (c0 + c1) % q != challenge(q, p, g, y, a, b, A0, B0, A1, B1):
+                return False
+            for i, A, B, c, s in ((0, A0, B0, c0, s0), (1, A1, B1, c1, s1)):
+                m = b * pow(g, -i, p) % p
+                if pow(g, s, p) != A * pow(a, c, p) % p:
+                    return False
+                if pow(y, s, p) != B * pow(m, c, p) % p:
+                    return False
+            a_t, b_t = a_t * a % p, b_t * b % p
+
+        A, B, s = (int(proof['sum'][k]) for k in ('A', 'B', 's'))
+        A, B, s = A % p, B % p, s % q
+        c = challenge(q, p, g, y, a_t, b_t, A, B)
+        return (pow(g, s, p) == A * pow(a_t, c, p) % p and
+                pow(y, s, p) == B * pow(b_t * pow(g, -1, p) % p, c, p) % p)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+
+def get_dlog(g, p, bound, count=1):
+    """
+    Returns the baby-step giant-step table of the group (p, g) to find count discrete logs up to bound, of
+    sqrt(count * bound) entries, building it the first time. A cached table is reused while it's big
+    enough, so the next tallies with the same group don't build it again, and the tables of the last
+    DLOG_CACHE_SIZE groups are kept in each process.
+
+    :param g: Generator number.
+    :type g: int
+    :param p: Prime number.
+    :type p: int
+    :param bound: The max m of the logs, like the number of voters.
+    :type bound: int
+    :param count: The number of logs to find, like the number of options.
+    :type count: int
+    :return: The table.
+    :rtype: DiscreteLog
+    """
+
+    steps = math.isqrt(max(bound, 1) * max(count, 1)) + 1
+    key = (int(p), int(g))
+    with _dlogs_lock:
+        table = _dlogs.get(key, None)
+        if table is not None and table.steps >= steps:
+            _dlogs.move_to_end(key)
+            return table
+
+    table = DiscreteLog(g, p, steps)
+    with _dlogs_lock:
+        _dlogs[key] = table
+        _dlogs.move_to_end(key)
+        while len(_dlogs) > DLOG_CACHE_SIZE:
+            _dlogs.popitem(last=False)
+    return table
+
+
+def dlogs(hs, g, p, bound):
+    """
+    Finds the m of h = g^m mod p with 0 <= m <= bound of each h, with the cached table of get_dlog.
+
+    :param hs: The decrypted messages.
+    :type hs: list
+    :param g: Generator number.
+    :type g: int
+    :param p: Prime number.
+    :type p: int
+    :param bound: The max m.
+    :type bound: int
+    :return: The m of each message, in the same order.
+    :rtype: list
+    :raises ValueError: If there isn't such m for some message.
+    """
+
+    return get_dlog(g, p, bound, len(hs)).logs(hs, bound)
+
+
+def dlog(h, g, p, bound):
+    """
+    Finds the m of h = g^m mod p with 0 <= m <= bound, see dlogs.
+
+    :param h: The decrypted message.
+    :type h: int
+    :param g: Generator number.
+    :type g: int
+    :param p: Prime number.
+    :type p: int
+    :param bound: The max m.
+    :type bound: int
+    :return: m.
+    :rtype: int
+    :raises ValueError: If there isn't such m.
+    """
+
+    return dlogs([h], g, p, bound)[0]
+
+
+def reencrypt_chunk(pubkey, msgs):
+    """
+    Re-encrypts a chunk of messages with a public key. Runs in the worker processes of the pool, which build
+    the tables of the key once.
+
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :param msgs: The encrypted messages.
+    :type msgs: list
+    :return: The re-encrypted messages, in the same order.
+    :rtype: list
+    """
+
+    tables = get_tables(pubkey)
+    p = pubkey[0]
+    msgs2 = []
+    for a, b in msgs:
+        a1, b1 = tables.encrypt(1, rand(p))
+        msgs2.append(((int(a) * a1) % p, (int(b) * b1) % p))
+    return msgs2
+
+
+def gen_factors(pubkey, n):
+    """
+    Generates re-encryption factors (g^r, y^r) of a public key, with a new random r each. They don't depend on
+    the messages, so they can be computed in advance, and every factor must be used only once.
+
+    :param pubkey: Public key (p, g, y).
+    :type pubkey: tuple
+    :param n: Number of factors.
+    :type n: int
+    :return: The factors.
+    :rtype: list
+    """
+
+    tables = get_tables(pubkey)
+    p = pubkey[0]
+    return [tables.encrypt(1, rand(p)) for i in range(n)]
+
+
+def apply_factors(p, msgs, factors):
+    """
+    Re-encrypts messages with precomputed factors, one multiplication per component.
+
+    :param p: Prime number of the key.
+    :type p: int
+    :param msgs: The encrypted messages.
+    :type msgs: list
+    :param factors: The factors (g^r, y^r), one per message.
+    :type factors: list
+    :return: The re-encrypted messages, in the same order.
+    :rtype: list
+    """
+
+    return [((int(a) * fa) % p, (int(b) * fb) % p)
+            for (a, b), (fa, fb) in zip(msgs, factors)]
+
+
+def decrypt_chunk(privkey, a, b):
+    """
+    Decrypts a chunk of messages with a private key. Runs in the worker processes of the pool.
+
+    Every message is decrypted as b * a^(p-1-x) mod p, with a single modular exponentiation done by GMP
+    and without building the tuples of the messages.
+
+    :param privkey: Private key (p, x).
+    :type privkey: tuple
+    :param a: The first component of the encrypted messages.
+    :type a: list
+    :param b: The second component of the encrypted messages.
+    :type b: list
+    :return: The decrypted messages, in the same order.
+    :rtype: list
+    """
+
+    p, x = privkey
+    P, E = Integer(p), Integer(p - 1 - x)
+    return [(bi * from_gmp(pow(to_gmp(ai), E, P))) % p for ai, bi in zip(a, b)]
+
+
 def gen_multiple_key(*crypts):
     """
     Generates a combined MixCrypt object from multiple MixCrypt objects.
@@ -167,14 +914,34 @@ class MixCrypt:
     :type k: ElGamal key, optional
     :param bits: Bit size for the key generation.
     :type bits: int
+    :param workers: Number of processes used to shuffle and decrypt, 1 by default, without the pool.
+    :type workers: int, optional
     """
 
-    def __init__(self, k=None, bits=256):
+    def __init__(self, k=None, bits=256, workers=None):
         self.bits = bits
+        self.workers = workers or 1
+        self._k = None
         if k:
             self.k = self.getk(k.p, k.g)
-        else:
-            self.k = self.genk()
+
+    @property
+    def k(self):
+        """
+        The ElGamal key. When it isn't given, set or constructed, a new one is generated the first time it's
+        used, so the instances whose key is set right away don't generate one to throw it away.
+
+        :return: The ElGamal key.
+        :rtype: ElGamal key
+        """
+
+        if self._k is None:
+            self.genk()
+        return self._k
+
+    @k.setter
+    def k(self, k):
+        self._k = k
 
     def genk(self):
         """
@@ -225,7 +992,7 @@ class MixCrypt:
 
     def encrypt(self, m, k=None):
         """
-        Encrypts a message using ElGamal encryption.
+        Encrypts a message using ElGamal encryption, with the cached fixed-base tables of the key.
 
         :param m: The message to encrypt.
         :type m: int
@@ -235,11 +1002,9 @@ class MixCrypt:
         :rtype: tuple
         """
 
-        r = rand(self.k.p)
         if not k:
             k = self.k
-        a, b = k._encrypt(m, r)
-        return a, b
+        return encrypt(m, (int(k.p), int(k.g), int(k.y)))
 
     def decrypt(self, c):
         """
@@ -266,15 +1031,13 @@ class MixCrypt:
         :rtype: list
         """
 
-        msgs2 = []
-        for a, b in msgs:
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs2.append(msg)
-        return msgs2
+        a = [int(m[0]) for m in msgs]
+        b = [int(m[1]) for m in msgs]
+        privkey = (int(self.k.p), int(self.k.x))
+        clears = self.pool_map(decrypt_chunk, privkey, a, b)
+        if last:
+            return clears
+        return list(zip(a, clears))
 
     def shuffle_decrypt(self, msgs, last=True):
         """
@@ -288,19 +1051,10 @@ class MixCrypt:
         :rtype: list
         """
 
-        msgs2 = msgs.copy()
-        msgs3 = []
-        while msgs2:
-            n = random.StrongRandom().randint(0, len(msgs2) - 1)
-            a, b = msgs2.pop(n)
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs3.append(msg)
-
-        return msgs3
+        # permuted here, the workers only get the messages already shuffled
+        perm = self.gen_perm(len(msgs))
+        msgs2 = [msgs[p] for p in perm]
+        return self.multiple_decrypt(msgs2, last)
 
     def reencrypt(self, cipher, pubkey=None):
         """
@@ -329,14 +1083,13 @@ class MixCrypt:
         '''
 
         if pubkey:
-            p, g, y = pubkey
-            k = ElGamal.construct((p, g, y))
+            pubkey = tuple(int(i) for i in pubkey)
         else:
-            k = self.k
+            pubkey = (int(self.k.p), int(self.k.g), int(self.k.y))
 
         a, b = map(int, cipher)
-        a1, b1 = map(int, self.encrypt(1, k=k))
-        p = int(k.p)
+        a1, b1 = encrypt(1, pubkey)
+        p = pubkey[0]
 
         return ((a * a1) % p, (b * b1) % p)
 
@@ -346,19 +1099,13 @@ class MixCrypt:
 
         :param l: The length of the list to generate a permutation for.
         :type l: int
-        :return: A list of permuted indices.
-        :rtype: list
+        :return: The permuted indices.
+        :rtype: array
         """
 
-        x = list(range(l))
-        for i in range(l):
-            d = random.StrongRandom().randint(0, i)
-            if i != d:
-                x[i] = x[d]
-                x[d] = i
-        return x
+        return rng.permutation(l)
 
-    def shuffle(self, msgs, pubkey=None):
+    def shuffle(self, msgs, pubkey=None, factors=None):
         """
         Re-encrypts and shuffles a list of messages.
 
@@ -366,18 +1113,75 @@ class MixCrypt:
         :type msgs: list
         :param pubkey: Optional public key for re-encryption. If not provided, the instance's key is used.
         :type pubkey: tuple, optional
+        :param factors: Optional precomputed factors of the public key, see gen_factors. They're used for the
+            first messages and the rest are re-encrypted as usual.
+        :type factors: list, optional
         :return: The shuffled and re-encrypted list of messages.
         :rtype: list
         """
 
-        msgs2 = msgs.copy()
         perm = self.gen_perm(len(msgs))
-        for i, p in enumerate(perm):
-            m = msgs[p]
-            nm = self.reencrypt(m, pubkey)
-            msgs2[i] = nm
+        msgs2 = [msgs[p] for p in perm]
+        if not factors:
+            return self.parallel_reencrypt(msgs2, pubkey)
+
+        p = int(pubkey[0]) if pubkey else int(self.k.p)
+        n = min(len(factors), len(msgs2))
+        msgs3 = apply_factors(p, msgs2[:n], factors[:n])
+        msgs3.extend(self.parallel_reencrypt(msgs2[n:], pubkey))
+        return msgs3
+
+    def parallel_reencrypt(self, msgs, pubkey=None):
+        """
+        Re-encrypts a list of messages with a pool of self.workers processes.
+
+        The list is split in chunks, a few per worker, and the re-encrypted chunks are joined in the same
+        order, so the result only depends on the order of msgs. Every worker constructs the key once and
+        draws its own random factors. Short lists, or a single worker, are re-encrypted in this process.
+
+        :param msgs: The list of messages to re-encrypt.
+        :type msgs: list
+        :param pubkey: Optional public key for re-encryption. If not provided, the instance's key is used.
+        :type pubkey: tuple, optional
+        :return: The re-encrypted messages, in the same order.
+        :rtype: list
+        """
+
+        if pubkey:
+            pubkey = tuple(int(i) for i in pubkey)
+        else:
+            pubkey = (int(self.k.p), int(self.k.g), int(self.k.y))
+
+        return self.pool_map(reencrypt_chunk, pubkey, msgs)
+
+    def pool_map(self, func, key, *columns):
+        """
+        Applies a chunk function, like reencrypt_chunk or decrypt_chunk, to some lists of the same length.
+
+        The lists are split in chunks, a few per worker, that are processed by the pool of self.workers
+        processes and joined in the same order. Short lists, or a single worker, are processed in this process.
+
+        :param func: The function, called as func(key, *chunks) and returning a list.
+        :type func: function
+        :param key: The key passed to func.
+        :type key: tuple
+        :param columns: The lists to split.
+        :type columns: list
+        :return: The joined results of func.
+        :rtype: list
+        """
 
-        return msgs2
+        n = len(columns[0])
+        if self.workers < 2 or n < PARALLEL_MIN:
+            return func(key, *columns)
+
+        size = -(-n // (self.workers * 4))
+        chunks = [[c[i:i + size] for i in range(0, n, size)] for c in columns]
+        pool = get_pool(self.workers)
+        result = []
+        for chunk in pool.map(func, repeat(key), *chunks):
+            result.extend(chunk)
+        return result
 
 
 if __name__ == "__main__":
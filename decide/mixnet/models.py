@@ -1,14 +1,65 @@
-from django.db import models
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 
-from .mixcrypt import MixCrypt
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from django.db import models, transaction
 
-from base import mods
-from base.models import Auth, Key
+from .mixcrypt import ElGamal, MixCrypt, check_group, fingerprint, gen_factors, gen_group
+
+from base import mods, wire
+from base.models import Auth, BigBigField, Key
 from base.serializers import AuthSerializer
 from django.conf import settings
 
 # number of bits for the key, all auths should use the same number of bits
 B = settings.KEYBITS
+# processes used to re-encrypt and decrypt, 1 by default, without the pool
+WORKERS = getattr(settings, 'MIXNET_WORKERS', 1)
+# factors precomputed by each run of mixnet.tasks.fill_factors_task, and max
+# factors kept, also used as the census size when the census isn't local
+FACTORS_BATCH = getattr(settings, 'MIXNET_FACTORS_BATCH', 1000)
+FACTORS_MAX = getattr(settings, 'MIXNET_FACTORS_MAX', 100000)
+# groups of the keys of new mixnets generated in advance, see Group: the
+# pool is refilled up to GROUPS_TARGET when it has less than GROUPS_LOW
+GROUPS_LOW = getattr(settings, 'MIXNET_GROUPS_LOW', 2)
+GROUPS_TARGET = getattr(settings, 'MIXNET_GROUPS_TARGET', 10)
+# if the output of each shuffle and decryption is kept, see Checkpoint
+CHECKPOINTS = getattr(settings, 'MIXNET_CHECKPOINTS', True)
+# ElGamal keys constructed from the Key rows kept in each process
+KEY_CACHE_SIZE = getattr(settings, 'MIXNET_KEY_CACHE_SIZE', 16)
+
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+def get_key(key):
+    """
+    Returns the ElGamal key of a Key row, constructing it the first time. The keys of the last
+    KEY_CACHE_SIZE rows are kept in each process, by the row and its numbers, so a row that is changed is
+    constructed again.
+
+    :param key: The Key row, with its private key.
+    :type key: Key
+    :return: The ElGamal key.
+    :rtype: ElGamal key
+    """
+
+    entry = (key.pk, int(key.p), int(key.g), int(key.y), int(key.x))
+    with _keys_lock:
+        k = _keys.get(entry, None)
+        if k is not None:
+            _keys.move_to_end(entry)
+            return k
+
+    k = ElGamal.construct(entry[1:])
+    with _keys_lock:
+        _keys[entry] = k
+        while len(_keys) > KEY_CACHE_SIZE:
+            _keys.popitem(last=False)
+    return k
 
 
 class Mixnet(models.Model):
@@ -47,7 +98,8 @@ class Mixnet(models.Model):
 
     def shuffle(self, msgs, pk):
         """
-        Shuffles the provided messages using the mixnet's cryptographic settings.
+        Shuffles the provided messages using the mixnet's cryptographic settings, and the precomputed
+        re-encryption factors of pk while there are any left.
 
         :param msgs: The messages to shuffle.
         :type msgs: list
@@ -57,14 +109,13 @@ class Mixnet(models.Model):
         :rtype: list
         """
 
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-
-        return crypt.shuffle(msgs, pk)
+        factors = self.take_factors(pk, len(msgs))
+        return self.crypt().shuffle(msgs, pk, factors=factors)
 
-    def decrypt(self, msgs, pk, last=False):
+    def decrypt(self, msgs, pk, last=False, shuffle=True):
         """
-        Decrypts the provided messages using the mixnet's cryptographic settings.
+        Decrypts the provided messages using the mixnet's cryptographic settings, shuffling them unless
+        shuffle is false.
 
         :param msgs: The messages to decrypt.
         :type msgs: list
@@ -72,17 +123,33 @@ class Mixnet(models.Model):
         :type pk: Key
         :param last: Indicates if this is the last decryption step.
         :type last: bool
+        :param shuffle: If the messages are shuffled too.
+        :type shuffle: bool
         :return: Decrypted messages.
         :rtype: list
         """
 
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        return crypt.shuffle_decrypt(msgs, last)
+        if not shuffle:
+            return self.crypt().multiple_decrypt(msgs, last)
+        return self.crypt().shuffle_decrypt(msgs, last)
+
+    def crypt(self):
+        """
+        Returns a MixCrypt with the key of the mixnet, constructed once per process (see get_key), so the
+        chunks of the chain of a voting reuse it.
+
+        :return: The MixCrypt.
+        :rtype: MixCrypt
+        """
+
+        crypt = MixCrypt(bits=B, workers=WORKERS)
+        crypt.k = get_key(self.key)
+        return crypt
 
     def gen_key(self, p=0, g=0):
         """
-        Generates a cryptographic key for the mixnet.
+        Generates a cryptographic key for the mixnet. The first authority takes the group (p, g) out of the
+        pool of Group, so only the private key is generated, and the next ones get it in p and g.
 
         :param p: Prime number, part of the cryptographic key.
         :type p: int, optional
@@ -90,25 +157,167 @@ class Mixnet(models.Model):
         :type g: int, optional
         """
 
-        crypt = MixCrypt(bits=B)
         if self.key:
-            k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        elif (not g or not p):
-            k = crypt.genk()
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
-
-            self.key = key
-            self.save()
+            return
+
+        # the key is only generated when there is no group
+        crypt = MixCrypt(bits=B)
+        if not g or not p:
+            # a group of the pool and a new private key, or a new key when
+            # the pool is empty
+            group = Group.take(B)
+            k = crypt.getk(*group) if group else crypt.genk()
         else:
             k = crypt.getk(p, g)
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
+        key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
+        key.save()
 
-            self.key = key
-            self.save()
+        self.key = key
+        self.save()
 
-    def chain_call(self, path, data):
+    def checkpointed(self, stage, msgs, pk, compute, last=False):
+        """
+        Returns the output of a stage for a chunk of messages, computing it only if it isn't checkpointed yet.
+        The output is checkpointed with the digest of the messages, the public key and last as address, so a
+        tally that is retried gets the same output of this authority for every chunk it already processed,
+        and the shuffles and decryptions of the failed one are not lost.
+
+        :param stage: 'shuffle', 'decrypt' or 'aggregate', a decryption without shuffle.
+        :type stage: str
+        :param msgs: The messages of the chunk.
+        :type msgs: list
+        :param pk: Public key (p, g, y) of the stage.
+        :type pk: tuple
+        :param compute: Called without arguments to get the output when it isn't checkpointed.
+        :type compute: callable
+        :param last: If it's the last decryption.
+        :type last: bool
+        :return: The output of the stage.
+        :rtype: list
+        """
+
+        if not CHECKPOINTS:
+            return compute()
+
+        digest = Checkpoint.address(stage, msgs, pk, last)
+        checkpoints = self.checkpoints.filter(stage=stage, digest=digest)
+        checkpoint = checkpoints.first()
+        if checkpoint:
+            return wire.loads(checkpoint.output)
+
+        output = compute()
+        checkpoint, created = Checkpoint.objects.get_or_create(
+            mixnet=self, stage=stage, digest=digest,
+            defaults={'count': len(output), 'output': wire.dumps(output)})
+        if not created:
+            # the same chunk was processed at the same time, only one output
+            # of each chunk is given
+            return wire.loads(checkpoint.output)
+        return output
+
+    def purge_checkpoints(self, token):
+        """
+        Deletes the checkpoints of the mixnet and asks the next authority to delete its ones.
+
+        :param token: Authorization token of a staff user, sent to the next authority.
+        :type token: str
+        :return: The number of checkpoints deleted by every authority, this one first.
+        :rtype: list
+        :raises ValueError: If the next authority doesn't purge its checkpoints.
+        """
+
+        deleted, _ = self.checkpoints.all().delete()
+        resp = self.chain_call("/purge/{}/".format(self.voting_id), {},
+                               token=token)
+        if resp is not None and not isinstance(resp, list):
+            raise ValueError(
+                'The next authority did not purge its checkpoints')
+        return [deleted] + (resp or [])
+
+    def voting_key(self):
+        """
+        Gets the public key of the voting of the mixnet, while it's open.
+
+        :return: The public key (p, g, y), or None if the voting has no key yet or it's stopped.
+        :rtype: tuple or None
+        """
+
+        votings = mods.get('voting', params={'id': self.voting_id})
+        voting = votings[0] if votings else None
+        if not voting or not voting.get('pub_key') or voting.get('end_date'):
+            return None
+        pk = voting['pub_key']
+        return (int(pk['p']), int(pk['g']), int(pk['y']))
+
+    def census_size(self):
+        """
+        Gets the number of voters of the voting, the number of factors that the shuffles will need. It's
+        FACTORS_MAX when the census isn't served by this instance.
+
+        :return: The census size.
+        :rtype: int
+        """
+
+        if not mods.is_local('census'):
+            return FACTORS_MAX
+        from census.index import voters
+        census = voters.get(self.voting_id)
+        if census is None:
+            from census.models import Census
+            return Census.objects.filter(voting_id=self.voting_id).count()
+        return min(len(census), FACTORS_MAX)
+
+    def fill_factors(self, batch=None):
+        """
+        Precomputes up to batch re-encryption factors of the public key of the voting, while it's open,
+        until there is one for every voter. The factors of other keys are deleted.
+
+        :param batch: Max number of factors to compute, FACTORS_BATCH by default.
+        :type batch: int, optional
+        :return: If the voting is open, and the size of the pool and of the census.
+        :rtype: dict
+        """
+
+        pk = self.voting_key()
+        if not pk:
+            return {'open': False, 'pool': self.factors.count(), 'census': 0}
+
+        key = fingerprint(pk)
+        self.factors.exclude(key=key).delete()
+        pool = self.factors.filter(key=key).count()
+        census = self.census_size()
+        n = min(batch or FACTORS_BATCH, census - pool)
+        if n > 0:
+            Factor.objects.bulk_create(
+                (Factor.seal(self, key, a, b) for a, b in gen_factors(pk, n)),
+                batch_size=500)
+            pool += n
+        return {'open': True, 'pool': pool, 'census': census}
+
+    def take_factors(self, pk, n):
+        """
+        Takes up to n precomputed re-encryption factors of a public key out of the pool, so they're used only
+        once.
+
+        :param pk: Public key (p, g, y).
+        :type pk: tuple
+        :param n: Number of factors.
+        :type n: int
+        :return: The factors (g^r, y^r), maybe less than n, without the ones that can't be unsealed.
+        :rtype: list
+        """
+
+        key = fingerprint(pk)
+        with transaction.atomic():
+            qs = (self.factors.select_for_update().filter(key=key)
+                  .order_by('id')[:n])
+            rows = list(qs)
+            if rows:
+                self.factors.filter(key=key, id__lte=rows[-1].id).delete()
+        factors = (f.unseal() for f in rows)
+        return [f for f in factors if f is not None]
+
+    def chain_call(self, path, data, binary=False, token=None):
         """
         Makes a chained API call to the next authorization in the mixnet.
 
@@ -116,6 +325,10 @@ class Mixnet(models.Model):
         :type path: str
         :param data: Data to be sent in the API call.
         :type data: dict
+        :param binary: If the data is sent in the binary format of base.wire.
+        :type binary: bool
+        :param token: Authorization token sent with the call, if any.
+        :type token: str, optional
         :return: The response from the API call or None.
         :rtype: Response or None
         """
@@ -130,8 +343,11 @@ class Mixnet(models.Model):
 
         if next_auths:
             auth = next_auths.first().url
+            headers = {}
+            if token:
+                headers['HTTP_AUTHORIZATION'] = 'Token ' + token
             r = mods.post('mixnet', entry_point=path,
-                          baseurl=auth, json=data)
+                          baseurl=auth, json=data, binary=binary, **headers)
             return r
 
         return None
@@ -149,3 +365,250 @@ class Mixnet(models.Model):
             next_auths = next_auths[1:]
 
         return next_auths
+
+
+class Factor(models.Model):
+    """
+    Re-encryption factor (g^r, y^r) precomputed for the shuffles of a mixnet. It's deleted when it's used.
+
+    The factors are secret: whoever knows the factors of a shuffle can link each of its outputs to its input,
+    which undoes the shuffle of this authority. So they are sealed with AES-GCM, bound to their mixnet and
+    public key, with a key derived from MIXNET_FACTORS_KEY, or from SECRET_KEY when it isn't set, that is
+    never stored in the database. A dump of the database, a backup or a read access to it don't reveal
+    them, the settings or the environment of the authority are needed too. They're only in the clear in
+    memory, while they're generated and used. The factors sealed with another key, like the ones left after
+    changing it, are discarded when they're taken.
+
+    Attributes:
+        mixnet (ForeignKey): The mixnet that uses it.
+        key (CharField): Fingerprint of the public key of the factor.
+        sealed (BinaryField): The nonce, the tag and the encrypted g^r mod p and y^r mod p.
+    """
+
+    mixnet = models.ForeignKey(Mixnet, related_name="factors",
+                               on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    sealed = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['mixnet', 'key'],
+                         name='mixnet_factor_key_idx'),
+        ]
+
+    @staticmethod
+    def cipher_key():
+        secret = (getattr(settings, 'MIXNET_FACTORS_KEY', '')
+                  or settings.SECRET_KEY)
+        return hashlib.sha256(b'mixnet factors:' + secret.encode()).digest()
+
+    def header(self):
+        # authenticated with the factor, so it can't be moved to another mixnet
+        return '{}:{}'.format(self.mixnet_id, self.key).encode()
+
+    @classmethod
+    def seal(cls, mixnet, key, a, b):
+        """
+        Creates a factor with (a, b) encrypted, without saving it.
+
+        :param mixnet: The mixnet that uses it.
+        :type mixnet: Mixnet
+        :param key: Fingerprint of the public key.
+        :type key: str
+        :param a: g^r mod p.
+        :type a: int
+        :param b: y^r mod p.
+        :type b: int
+        :return: The factor.
+        :rtype: Factor
+        """
+
+        factor = cls(mixnet=mixnet, key=key)
+        nonce = get_random_bytes(12)
+        cipher = AES.new(cls.cipher_key(), AES.MODE_GCM, nonce=nonce)
+        cipher.update(factor.header())
+        data, tag = cipher.encrypt_and_digest(
+            '{:x},{:x}'.format(a, b).encode())
+        factor.sealed = nonce + tag + data
+        return factor
+
+    def unseal(self):
+        """
+        Decrypts the factor.
+
+        :return: The factor (a, b), or None if it was sealed with another key or changed.
+        :rtype: tuple or None
+        """
+
+        sealed = bytes(self.sealed)
+        cipher = AES.new(self.cipher_key(), AES.MODE_GCM, nonce=sealed[:12])
+        cipher.update(self.header())
+        try:
+            data = cipher.decrypt_and_verify(sealed[28:], sealed[12:28])
+        except ValueError:
+            return None
+        a, b = data.decode().split(',')
+        return int(a, 16), int(b, 16)
+
+
+class Group(models.Model):
+    """
+    Group (p, g) of the ElGamal keys generated and checked in advance, as searching for the safe prime p is
+    slow. Each group is used by one mixnet only, it's deleted when it's taken. The pool is filled with
+    Group.fill, by mixnet.tasks.fill_groups_task when MIXNET_GROUPS_PRECOMPUTE is set or by the keypool
+    command.
+
+    Attributes:
+        bits (PositiveIntegerField): Bits of p.
+        p (BigBigField): Safe prime.
+        g (BigBigField): Generator of the subgroup of order (p - 1) / 2.
+        created_at (DateTimeField): When it was generated.
+    """
+
+    bits = models.PositiveIntegerField()
+    p = BigBigField()
+    g = BigBigField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # counters of this process
+    lock = threading.Lock()
+    metrics = {'generated': 0, 'rejected': 0, 'taken': 0, 'misses': 0}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bits'], name='mixnet_group_bits_idx'),
+        ]
+
+    @classmethod
+    def count(cls, bits=B):
+        """
+        Returns the number of groups of the pool with the given bits.
+        """
+
+        return cls.objects.filter(bits=bits).count()
+
+    @classmethod
+    def count_metric(cls, name):
+        with cls.lock:
+            cls.metrics[name] += 1
+
+    @classmethod
+    def take(cls, bits=B):
+        """
+        Takes a group out of the pool, so it's used only once.
+
+        :param bits: Bits of p.
+        :type bits: int
+        :return: The group (p, g), or None if the pool is empty.
+        :rtype: tuple or None
+        """
+
+        with transaction.atomic():
+            group = (cls.objects.select_for_update().filter(bits=bits)
+                     .order_by('id').first())
+            if group:
+                group.delete()
+        cls.count_metric('taken' if group else 'misses')
+        return (group.p, group.g) if group else None
+
+    @classmethod
+    def low(cls, bits=B):
+        """
+        Returns if the pool needs to be refilled, it has less than GROUPS_LOW groups.
+        """
+
+        return cls.count(bits) < GROUPS_LOW
+
+    @classmethod
+    def fill(cls, bits=B, target=None):
+        """
+        Generates groups until the pool has target of them. Every group is checked before it's saved.
+
+        :param bits: Bits of p.
+        :type bits: int
+        :param target: Size of the pool, GROUPS_TARGET by default.
+        :type target: int, optional
+        :return: The metrics of the pool, see stats.
+        :rtype: dict
+        """
+
+        target = GROUPS_TARGET if target is None else target
+        while cls.count(bits) < target:
+            p, g = gen_group(bits)
+            if not check_group(p, g, bits):
+                cls.count_metric('rejected')
+                continue
+            cls.objects.create(bits=bits, p=p, g=g)
+            cls.count_metric('generated')
+        return cls.stats(bits)
+
+    @classmethod
+    def stats(cls, bits=B):
+        """
+        Returns the metrics of the pool: its size, its low-water mark and target, and the groups generated,
+        rejected by the check and taken, and the keys generated because the pool was empty (the misses) in
+        this process.
+
+        :param bits: Bits of p.
+        :type bits: int
+        :return: The metrics.
+        :rtype: dict
+        """
+
+        with cls.lock:
+            metrics = dict(cls.metrics)
+        metrics.update({'bits': bits, 'pool': cls.count(bits),
+                        'low': GROUPS_LOW, 'target': GROUPS_TARGET})
+        return metrics
+
+
+class Checkpoint(models.Model):
+    """
+    Output of a shuffle or a decryption of a chunk of messages by an authority, in the binary format of
+    base.wire. It's content-addressed: the digest is the SHA-256 of the input of the stage, so the same chunk
+    is never processed twice by a mixnet, the one of a voting and a position in the chain.
+
+    Attributes:
+        mixnet (ForeignKey): The mixnet that processed the chunk.
+        stage (CharField): 'shuffle', 'decrypt' or 'aggregate', a decryption without shuffle.
+        digest (CharField): Digest of the messages, the public key and the last flag of the chunk.
+        count (PositiveIntegerField): Number of messages of the output.
+        output (BinaryField): The output messages.
+        created_at (DateTimeField): When the chunk was processed.
+    """
+
+    mixnet = models.ForeignKey(Mixnet, related_name="checkpoints",
+                               on_delete=models.CASCADE)
+    stage = models.CharField(max_length=16)
+    digest = models.CharField(max_length=64)
+    count = models.PositiveIntegerField()
+    output = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mixnet', 'stage', 'digest'],
+                                    name='mixnet_checkpoint_unique'),
+        ]
+
+    @staticmethod
+    def address(stage, msgs, pk, last=False):
+        """
+        Computes the digest of the input of a stage.
+
+        :param stage: 'shuffle', 'decrypt' or 'aggregate'.
+        :type stage: str
+        :param msgs: The messages of the chunk.
+        :type msgs: list
+        :param pk: Public key (p, g, y).
+        :type pk: tuple
+        :param last: If it's the last decryption.
+        :type last: bool
+        :return: The hexadecimal SHA-256.
+        :rtype: str
+        """
+
+        head = json.dumps([stage, [int(n) for n in pk], bool(last)])
+        h = hashlib.sha256(head.encode())
+        h.update(wire.pack_batch(msgs))
+        return h.hexdigest()
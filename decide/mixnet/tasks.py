@@ -0,0 +1,60 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from .models import Group, Mixnet
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task()
+def fill_factors_task(mixnet_id):
+    """
+    A Celery task that precomputes the re-encryption factors of a mixnet while its voting is open.
+
+    Every run computes a batch of factors with Mixnet.fill_factors and schedules the next one, right away
+    while the pool is smaller than the census and MIXNET_FACTORS_INTERVAL seconds later when it's full, in
+    case the census grows. It stops when the voting is stopped or the mixnet is deleted.
+
+    Args:
+        mixnet_id (int): The ID of the mixnet.
+
+    Returns:
+        dict: If the voting is open, and the size of the pool and of the census, or None if the mixnet
+        doesn't exist.
+    """
+
+    mn = Mixnet.objects.filter(id=mixnet_id).first()
+    if not mn:
+        return None
+
+    stats = mn.fill_factors()
+    logger.info('Mixnet %s of voting %s: %s/%s factors', mn.id,
+                mn.voting_id, stats['pool'], stats['census'])
+    if stats['open']:
+        countdown = 0
+        if stats['pool'] >= stats['census']:
+            countdown = getattr(settings, 'MIXNET_FACTORS_INTERVAL', 60)
+        fill_factors_task.apply_async(args=[mixnet_id], countdown=countdown)
+    return stats
+
+
+@shared_task()
+def fill_groups_task():
+    """
+    A Celery task that refills the pool of groups of the ElGamal keys of the new mixnets, see Group.
+
+    It's run when a mixnet takes a group and the pool has less than MIXNET_GROUPS_LOW of them, and
+    generates groups until there are MIXNET_GROUPS_TARGET.
+
+    Returns:
+        dict: The metrics of the pool.
+    """
+
+    stats = Group.fill()
+    logger.info('Groups of %s bits: %s in the pool, %s generated, %s taken, '
+                '%s misses', stats['bits'], stats['pool'], stats['generated'],
+                stats['taken'], stats['misses'])
+    return stats
@@ -1,12 +1,22 @@
+from unittest import mock
+
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
+from rest_framework.test import APILiveServerTestCase
 from rest_framework.test import APITestCase
 from nose.tools import nottest
 
-from mixnet.mixcrypt import MixCrypt
-from mixnet.mixcrypt import ElGamal
+from mixnet.mixcrypt import MixCrypt, RandomPool, FixedBase
+from mixnet.mixcrypt import encrypt, get_pool, get_tables, rand
+from mixnet.mixcrypt import dlog, dlogs, encrypt_exponent, get_dlog
+from mixnet.mixcrypt import ElGamal, check_group, fingerprint
+from mixnet.models import Checkpoint, Factor, Group, Mixnet
 
 from base import mods
+from base.wire import MEDIA_TYPE
 
 
 @nottest
@@ -247,3 +257,527 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(clear, clear1)
         self.assertEqual(sorted(clear), sorted(clear1))
+
+
+class MixCryptTestCase(TestCase):
+    """
+    Test case class for the operations of MixCrypt that don't need the API.
+    """
+
+    def setUp(self):
+        self.crypt = MixCrypt(bits=settings.KEYBITS, workers=2)
+        self.clear = list(range(2, 22))
+        self.msgs = [self.crypt.encrypt(i) for i in self.clear]
+
+    def decrypt(self, msgs):
+        return [self.crypt.decrypt(m) for m in msgs]
+
+    def test_parallel_reencrypt(self):
+        """
+        The messages re-encrypted by the process pool are new ciphers of the same messages, in the same order.
+        """
+
+        k = self.crypt.k
+        pk = (k.p, k.g, k.y)
+        with mock.patch("mixnet.mixcrypt.PARALLEL_MIN", 10):
+            msgs = self.crypt.parallel_reencrypt(self.msgs)
+            msgs2 = self.crypt.parallel_reencrypt(self.msgs, pk)
+        self.assertEqual(len(msgs), len(self.msgs))
+        self.assertTrue(all(a != b for a, b in zip(msgs, self.msgs)))
+        self.assertEqual(self.decrypt(msgs), self.clear)
+        self.assertEqual(self.decrypt(msgs2), self.clear)
+
+        # short lists aren't sent to the pool
+        msgs = self.crypt.parallel_reencrypt(self.msgs)
+        self.assertEqual(self.decrypt(msgs), self.clear)
+
+        # the workers aren't forked from this threaded process
+        context = get_pool(2)._mp_context
+        self.assertIn(context.get_start_method(), ('forkserver', 'spawn'))
+
+    def test_parallel_shuffle(self):
+        """
+        The shuffle with the process pool keeps every message.
+        """
+
+        with mock.patch("mixnet.mixcrypt.PARALLEL_MIN", 10):
+            shuffled = self.crypt.shuffle(self.msgs)
+        self.assertNotEqual(shuffled, self.msgs)
+        self.assertEqual(sorted(self.decrypt(shuffled)), self.clear)
+
+        self.crypt.workers = 1
+        shuffled = self.crypt.shuffle(self.msgs)
+        self.assertEqual(sorted(self.decrypt(shuffled)), self.clear)
+
+    def test_batch_decrypt(self):
+        """
+        The batch decryption gives the same messages as ElGamal, with and without the process pool.
+        """
+
+        k = self.crypt.k
+        a = [int(m[0]) for m in self.msgs]
+        expected = [int(k._decrypt(m)) for m in self.msgs]
+        self.assertEqual(expected, self.clear)
+
+        with mock.patch("mixnet.mixcrypt.PARALLEL_MIN", 10):
+            msgs = self.crypt.multiple_decrypt(self.msgs)
+            self.assertEqual(msgs, self.clear)
+            msgs = self.crypt.multiple_decrypt(self.msgs, last=False)
+            self.assertEqual(msgs, list(zip(a, self.clear)))
+            shuffled = self.crypt.shuffle_decrypt(self.msgs)
+
+        self.assertEqual(self.crypt.multiple_decrypt(self.msgs), self.clear)
+        self.assertNotEqual(shuffled, self.clear)
+        self.assertEqual(sorted(shuffled), self.clear)
+
+        msgs = self.crypt.shuffle_decrypt(self.msgs, last=False)
+        self.assertEqual(sorted(msgs), sorted(zip(a, self.clear)))
+
+    def test_random_pool(self):
+        """
+        The permutations of the RandomPool contain every index once and its numbers are in range.
+        """
+
+        pool = RandomPool()
+        perm = pool.permutation(1000)
+        self.assertEqual(sorted(perm), list(range(1000)))
+        self.assertNotEqual(list(perm), list(range(1000)))
+        self.assertEqual(list(pool.permutation(0)), [])
+        self.assertEqual(list(pool.permutation(1)), [0])
+
+        numbers = [pool.randint(3, 7) for i in range(1000)]
+        self.assertEqual(set(numbers), {3, 4, 5, 6, 7})
+
+        # the block of a forked process isn't reused
+        data = pool.read(16)
+        pool.pos -= 16
+        pool.pid = None
+        self.assertNotEqual(pool.read(16), data)
+
+    def test_fixed_base(self):
+        """
+        The fixed-base tables give the same powers as pow, with python and with GMP integers.
+        """
+
+        k = self.crypt.k
+        p, g = int(k.p), int(k.g)
+        exponents = [0, 1, 255, 256, p - 1, p + 5, 2 ** 300]
+        exponents += [rand(p) for i in range(20)]
+        for gmp_bits in (settings.KEYBITS, 0):
+            with mock.patch("mixnet.mixcrypt.TABLES_GMP_BITS", gmp_bits):
+                table = FixedBase(g, p)
+            self.assertEqual(table.gmp, gmp_bits == 0)
+            for e in exponents:
+                self.assertEqual(table.pow(e), pow(g, e, p))
+
+    def test_lazy_key(self):
+        """
+        The key is generated the first time it's used, and never when it's set first.
+        """
+
+        k = self.crypt.k
+        with mock.patch.object(MixCrypt, 'genk', autospec=True,
+                               side_effect=MixCrypt.genk) as genk:
+            crypt = MixCrypt(bits=settings.KEYBITS)
+            crypt.setk(k.p, k.g, k.y, k.x)
+            self.assertEqual(self.decrypt([crypt.encrypt(7)]), [7])
+            genk.assert_not_called()
+
+            crypt = MixCrypt(bits=settings.KEYBITS)
+            self.assertEqual(crypt.decrypt(crypt.encrypt(7)), 7)
+            genk.assert_called_once()
+
+    def test_key_tables(self):
+        """
+        The tables of a key are built once and the messages encrypted with them are decrypted.
+        """
+
+        k = self.crypt.k
+        pk = (int(k.p), int(k.g), int(k.y))
+        tables = get_tables(pk)
+        self.assertIs(get_tables(pk), tables)
+        p, g, y = pk
+        self.assertEqual(tables.encrypt(7, 12345),
+                         (pow(g, 12345, p), 7 * pow(y, 12345, p) % p))
+        clear = [self.crypt.decrypt(encrypt(i, pk)) for i in self.clear]
+        self.assertEqual(clear, self.clear)
+        msgs = [self.crypt.reencrypt(m, pk) for m in self.msgs]
+        self.assertEqual(self.decrypt(msgs), self.clear)
+
+    def test_exponent_sum(self):
+        """
+        The product of the exponential ciphers is decrypted to g to the sum of their messages.
+        """
+
+        k = self.crypt.k
+        p, g = int(k.p), int(k.g)
+        pk = (p, g, int(k.y))
+        a, b = 1, 1
+        for m in (0, 1, 1, 0, 1):
+            c = encrypt_exponent(m, pk)
+            a, b = a * c[0] % p, b * c[1] % p
+        h = self.crypt.decrypt((a, b))
+        self.assertEqual(dlog(h, g, p, 5), 3)
+        self.assertEqual(dlog(1, g, p, 0), 0)
+        with self.assertRaises(ValueError):
+            dlog(h, g, p, 2)
+
+    def test_discrete_logs(self):
+        """
+        The baby-step giant-step table finds the logs of a batch, and it's reused while it's big enough.
+        """
+
+        k = self.crypt.k
+        p, g = int(k.p), int(k.g)
+        bound = 10 ** 7
+        ms = [0, 1, 4321, bound // 2, bound]
+        hs = [pow(g, m, p) for m in ms]
+        self.assertEqual(dlogs(hs, g, p, bound), ms)
+
+        table = get_dlog(g, p, bound, len(ms))
+        self.assertLess(table.steps, 10 ** 4)
+        self.assertIs(get_dlog(g, p, 1000), table)
+        self.assertEqual(dlogs(hs[:3], g, p, 5000), ms[:3])
+        self.assertIsNot(get_dlog(g, p, bound * 10, len(ms)), table)
+
+        with self.assertRaises(ValueError):
+            dlogs(hs, g, p, bound - 1)
+
+
+class MixnetFactorsTestCase(TestCase):
+    """
+    Test case class for the pool of precomputed re-encryption factors of the mixnets.
+    """
+
+    def setUp(self):
+        self.mn = Mixnet(voting_id=1)
+        self.mn.save()
+        self.mn.gen_key()
+        k = self.mn.key
+        self.pk = (k.p, k.g, k.y)
+
+    def fill(self, census=30, batch=20, pk=None):
+        with mock.patch.object(Mixnet, 'voting_key', return_value=pk or self.pk), \
+                mock.patch.object(Mixnet, 'census_size', return_value=census):
+            return self.mn.fill_factors(batch)
+
+    def test_fill_factors(self):
+        """
+        The pool is filled in batches until there is a factor for every voter.
+        """
+
+        self.assertEqual(self.fill(), {'open': True, 'pool': 20, 'census': 30})
+        self.assertEqual(self.fill(), {'open': True, 'pool': 30, 'census': 30})
+        self.assertEqual(self.fill(), {'open': True, 'pool': 30, 'census': 30})
+        self.assertEqual(Factor.objects.filter(mixnet=self.mn).count(), 30)
+
+        p, g, y = self.pk
+        x = self.mn.key.x
+        for f in Factor.objects.filter(mixnet=self.mn):
+            self.assertEqual(f.key, fingerprint(self.pk))
+            a, b = f.unseal()
+            self.assertEqual(pow(a, x, p), b)
+
+        # the factors of other keys are dropped
+        self.fill(pk=(p, g, (y * g) % p))
+        self.assertEqual(Factor.objects.filter(mixnet=self.mn).count(), 20)
+
+        with mock.patch.object(Mixnet, 'voting_key', return_value=None):
+            self.assertFalse(self.mn.fill_factors()['open'])
+        self.assertEqual(Factor.objects.filter(mixnet=self.mn).count(), 20)
+
+    def test_take_factors(self):
+        """
+        The factors are taken out of the pool and never used twice.
+        """
+
+        self.fill()
+        factors = self.mn.take_factors(self.pk, 12)
+        self.assertEqual(len(factors), 12)
+        self.assertEqual(self.mn.factors.count(), 8)
+        factors2 = self.mn.take_factors(self.pk, 12)
+        self.assertEqual(len(factors2), 8)
+        self.assertFalse(set(factors) & set(factors2))
+        self.assertEqual(self.mn.take_factors(self.pk, 12), [])
+
+    def test_sealed_factors(self):
+        """
+        The factors aren't kept in the clear, and the ones sealed with another key or moved to another mixnet
+        are discarded.
+        """
+
+        self.fill(census=10, batch=10)
+        f = Factor.objects.filter(mixnet=self.mn).first()
+        a, b = f.unseal()
+        self.assertNotIn('{:x}'.format(a).encode(), bytes(f.sealed))
+
+        other = Mixnet.objects.create(voting_id=2)
+        Factor.objects.filter(pk=f.pk).update(mixnet=other)
+        self.assertIsNone(Factor.objects.get(pk=f.pk).unseal())
+
+        with self.settings(MIXNET_FACTORS_KEY='another key'):
+            self.assertEqual(self.mn.take_factors(self.pk, 5), [])
+        self.assertEqual(self.mn.factors.count(), 4)
+        self.assertEqual(len(self.mn.take_factors(self.pk, 5)), 4)
+
+    def test_shuffle_with_factors(self):
+        """
+        The shuffle uses the factors while there are any and re-encrypts the rest of the messages.
+        """
+
+        self.fill(batch=10)
+        crypt = MixCrypt(bits=settings.KEYBITS)
+        crypt.setk(self.mn.key.p, self.mn.key.g, self.mn.key.y, self.mn.key.x)
+        clear = list(range(2, 16))
+        msgs = [crypt.encrypt(i) for i in clear]
+
+        shuffled = self.mn.shuffle(msgs, self.pk)
+        self.assertEqual(self.mn.factors.count(), 0)
+        self.assertFalse(set(shuffled) & set(msgs))
+        self.assertEqual(sorted(crypt.decrypt(m) for m in shuffled), clear)
+
+
+class MixnetGroupTestCase(APITestCase):
+    """
+    Test case class for the keys of the mixnets: the pool of groups of the new ones and the cache of the
+    constructed keys.
+    """
+
+    def test_fill_groups(self):
+        """
+        The pool is filled with checked groups, and the new mixnets take them while there are any left.
+        """
+
+        bits = settings.KEYBITS
+        stats = Group.fill(bits, 2)
+        self.assertEqual(stats['pool'], 2)
+        groups = list(Group.objects.values_list('p', 'g'))
+        for p, g in groups:
+            self.assertTrue(check_group(p, g, bits))
+        self.assertFalse(check_group(groups[0][0], 2, bits))
+        self.assertFalse(check_group(groups[0][0] + 2, groups[0][1], bits))
+
+        taken = []
+        for i in range(3):
+            mn = Mixnet.objects.create(voting_id=i + 1)
+            mn.gen_key()
+            k = mn.key
+            self.assertEqual(pow(k.g, k.x, k.p), k.y)
+            taken.append((k.p, k.g))
+        self.assertEqual(taken[:2], groups)
+        self.assertNotIn(taken[2], groups)
+        self.assertEqual(Group.count(bits), 0)
+        self.assertEqual(Group.stats(bits)['misses'] - stats['misses'], 1)
+
+    def test_key_cache(self):
+        """
+        The key of a mixnet is constructed once, and again when its row changes.
+        """
+
+        mn = Mixnet.objects.create(voting_id=1)
+        mn.gen_key()
+        with mock.patch('mixnet.models.ElGamal.construct',
+                        side_effect=ElGamal.construct) as construct:
+            k = mn.crypt().k
+            self.assertIs(Mixnet.objects.get(pk=mn.pk).crypt().k, k)
+            self.assertEqual(construct.call_count, 1)
+
+            key = mn.key
+            key.x = key.x + 1
+            key.y = pow(key.g, key.x, key.p)
+            key.save()
+            self.assertEqual(int(mn.crypt().k.x), key.x)
+            self.assertEqual(construct.call_count, 2)
+
+    def test_refill(self):
+        """
+        Creating a mixnet refills the pool when it's below the low-water mark.
+        """
+
+        data = {"voting": 1,
+                "auths": [{"name": "auth1", "url": "http://localhost:8000"}]}
+        with mock.patch('mixnet.views.fill_groups_task') as task:
+            self.client.post('/mixnet/', data, format='json')
+            task.delay.assert_not_called()
+            with self.settings(MIXNET_GROUPS_PRECOMPUTE=True):
+                data["voting"] = 2
+                self.client.post('/mixnet/', data, format='json')
+            task.delay.assert_called_once_with()
+
+
+class MixnetCheckpointTestCase(APITestCase):
+    """
+    Test case class for the checkpoints of the shuffles and decryptions of the chunks of a mixnet.
+    """
+
+    def setUp(self):
+        self.mn = Mixnet(voting_id=1)
+        self.mn.save()
+        self.mn.gen_key()
+        k = self.mn.key
+        self.pk = (k.p, k.g, k.y)
+        self.clear = [2, 3, 4, 5]
+
+    def post(self, path, msgs):
+        response = self.client.post(path, {"msgs": msgs}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_checkpoints(self):
+        """
+        The same chunk gets the same output without shuffling it again, and another chunk gets its own one.
+        """
+
+        msgs = [encrypt(m, self.pk) for m in self.clear]
+        with mock.patch.object(Mixnet, 'shuffle', autospec=True,
+                               side_effect=Mixnet.shuffle) as shuffle:
+            shuffled = self.post('/mixnet/shuffle/1/', msgs)
+            self.assertEqual(self.post('/mixnet/shuffle/1/', msgs), shuffled)
+            self.assertEqual(shuffle.call_count, 1)
+
+            other = [encrypt(m, self.pk) for m in self.clear]
+            self.assertNotEqual(self.post('/mixnet/shuffle/1/', other),
+                                shuffled)
+            self.assertEqual(shuffle.call_count, 2)
+
+        with mock.patch.object(Mixnet, 'decrypt', autospec=True,
+                               side_effect=Mixnet.decrypt) as decrypt:
+            clear = self.post('/mixnet/decrypt/1/', shuffled)
+            self.assertEqual(self.post('/mixnet/decrypt/1/', shuffled), clear)
+            self.assertEqual(decrypt.call_count, 1)
+        self.assertEqual(sorted(clear), self.clear)
+
+        stages = self.mn.checkpoints.values_list('stage', 'count')
+        self.assertEqual(sorted(stages),
+                         [('decrypt', 4), ('shuffle', 4), ('shuffle', 4)])
+        checkpoint = self.mn.checkpoints.get(stage='decrypt')
+        digest = Checkpoint.address('decrypt', shuffled, self.pk, True)
+        self.assertEqual(checkpoint.digest, digest)
+
+        with mock.patch('mixnet.models.CHECKPOINTS', False):
+            self.post('/mixnet/decrypt/1/', shuffled)
+        self.assertEqual(self.mn.checkpoints.count(), 3)
+
+
+class MixnetChainTestCase(APILiveServerTestCase):
+    """
+    Test case class for the chunks sent along a chain of two authorities through http.
+
+    Both authorities are served by the live server, the first one as our own BASEURL and the second one with
+    another host name, so the chained calls go through the network.
+    """
+
+    def setUp(self):
+        mods.unmock_query()
+        self.settings = override_settings(BASEURL=self.live_server_url,
+                                          APIS={})
+        self.settings.enable()
+        self.auth = self.live_server_url
+        self.auth2 = self.live_server_url.replace('localhost', '127.0.0.1')
+
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": self.auth},
+                {"name": "auth2", "url": self.auth2},
+            ]
+        }
+        key = mods.post('mixnet', baseurl=self.auth, json=data)
+        self.pk = (key["p"], key["g"], key["y"])
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def post(self, path, seq, msgs):
+        data = {"msgs": msgs}
+        if seq is not None:
+            data["seq"] = seq
+        return mods.post('mixnet', entry_point=path, baseurl=self.auth,
+                         json=data, response=True)
+
+    def test_chunks(self):
+        """
+        The chunks are acknowledged by the chain and several of them can be in flight at the same time.
+        """
+
+        self.assertEqual(Mixnet.objects.filter(voting_id=1).count(), 2)
+        chunks = [list(range(2 + i * 10, 12 + i * 10)) for i in range(4)]
+
+        def mix(seq, clear):
+            msgs = [encrypt(m, self.pk) for m in clear]
+            response = self.post('/shuffle/1/', seq, msgs)
+            self.assertEqual(response.status_code, 200)
+            msgs = mods.read_chunk(response.json(), seq, len(clear))
+            response = self.post('/decrypt/1/', seq, msgs)
+            self.assertEqual(response.status_code, 200)
+            return mods.read_chunk(response.json(), seq, len(clear))
+
+        results = mods.pipeline(mix, enumerate(chunks), window=2)
+        for clear, decrypted in zip(chunks, results):
+            self.assertEqual(sorted(decrypted), clear)
+
+        # without the chunk number the answer is the bare list
+        msgs = [encrypt(m, self.pk) for m in chunks[0]]
+        response = self.post('/shuffle/1/', None, msgs)
+        self.assertEqual(len(response.json()), len(msgs))
+
+    def test_binary(self):
+        """
+        The chunks can be sent along the chain in the binary format of base.wire.
+        """
+
+        clear = list(range(2, 12))
+        msgs = [encrypt(m, self.pk) for m in clear]
+        for path in ('/shuffle/1/', '/decrypt/1/'):
+            response = mods.post('mixnet', entry_point=path,
+                                 baseurl=self.auth, response=True,
+                                 binary=True, json={"seq": 1, "msgs": msgs})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Type'], MEDIA_TYPE)
+            msgs = mods.read_chunk(mods.read_body(response), 1, len(clear))
+        self.assertEqual(sorted(msgs), clear)
+
+        # json is still the default
+        response = self.post('/shuffle/1/', 1, [encrypt(2, self.pk)])
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+
+    def test_purge(self):
+        """
+        The checkpoints of the voting are purged by every authority of the chain.
+        """
+
+        msgs = [encrypt(m, self.pk) for m in range(2, 6)]
+        response = self.post('/shuffle/1/', 1, msgs)
+        msgs = mods.read_chunk(response.json(), 1, len(msgs))
+        self.post('/decrypt/1/', 1, msgs)
+        self.assertEqual(Checkpoint.objects.count(), 4)
+
+        def purge(user=None):
+            headers = {}
+            if user:
+                token = Token.objects.get_or_create(user=user)[0].key
+                headers['HTTP_AUTHORIZATION'] = 'Token ' + token
+            return mods.post('mixnet', entry_point='/purge/1/',
+                             baseurl=self.auth, json={}, response=True,
+                             **headers)
+
+        # only the staff, like the voting service, can purge them
+        self.assertEqual(purge().status_code, 401)
+        voter = User.objects.create(username='voter')
+        self.assertEqual(purge(voter).status_code, 403)
+        self.assertEqual(Checkpoint.objects.count(), 4)
+
+        staff = User.objects.create(username='staff', is_staff=True)
+        response = purge(staff)
+        self.assertEqual(response.json(), [2, 2])
+        self.assertEqual(Checkpoint.objects.count(), 0)
+
+    def test_missing_ack(self):
+        """
+        A chunk that the next authority doesn't acknowledge is a 502.
+        """
+
+        Mixnet.objects.filter(voting_id=1, auth_position=1).delete()
+        msgs = [encrypt(m, self.pk) for m in range(2, 6)]
+        response = self.post('/shuffle/1/', 1, msgs)
+        self.assertEqual(response.status_code, 502)
@@ -8,5 +8,6 @@ router.register(r'', views.MixnetViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('shuffle/<int:voting_id>/', views.Shuffle.as_view(), name='shuffle'),
-    path('decrypt/<int:voting_id>/', views.Decrypt.as_view(), name='decrypt')
+    path('decrypt/<int:voting_id>/', views.Decrypt.as_view(), name='decrypt'),
+    path('purge/<int:voting_id>/', views.Purge.as_view(), name='purge'),
 ]
@@ -1,12 +1,51 @@
 from django.conf import settings
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from .serializers import MixnetSerializer
-from .models import Auth, Mixnet, Key
+from .models import Auth, Group, Mixnet, Key
+from .tasks import fill_factors_task, fill_groups_task
+from base import mods
+from base.perms import UserIsStaff
 from base.serializers import KeySerializer, AuthSerializer
+from base.wire import BatchParser, BatchRenderer, MEDIA_TYPE
+
+
+def chain_chunk(mn, path, msgs, pk, seq, binary=False, extra=None):
+    """
+    Sends the messages processed by this authority to the next one and
+    returns the response of the view. With binary, they're sent in the
+    binary format of base.wire, like they were received. The extra fields
+    are sent too.
+
+    When the request carries a chunk number (seq), it's forwarded to the
+    next authority, whose answer must acknowledge that chunk with the same
+    number of messages, and the answer is {"seq", "count", "msgs"} instead of
+    the bare list, so the caller can check it too. A missing or wrong
+    acknowledgement is a 502.
+    """
+
+    data = dict(extra or {}, msgs=msgs, pk=pk)
+    if seq is not None:
+        data["seq"] = seq
+
+    # chained call to the next auth
+    resp = mn.chain_call(path, data, binary=binary)
+    if resp is not None:
+        if seq is None:
+            msgs = resp
+        else:
+            try:
+                msgs = mods.read_chunk(resp, seq, len(msgs))
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_502_BAD_GATEWAY)
+
+    if seq is None:
+        return Response(msgs)
+    return Response({"seq": seq, "count": len(msgs), "msgs": msgs})
 
 
 class MixnetViewSet(viewsets.ModelViewSet):
@@ -47,6 +86,9 @@ class MixnetViewSet(viewsets.ModelViewSet):
             mn.auths.add(a)
 
         mn.gen_key(p, g)
+        if (not p and getattr(settings, 'MIXNET_GROUPS_PRECOMPUTE', False)
+                and Group.low()):
+            fill_groups_task.delay()
 
         data = {"key": {"p": mn.key.p, "g": mn.key.g}}
         # chained call to the next auth to gen the key
@@ -61,10 +103,31 @@ class MixnetViewSet(viewsets.ModelViewSet):
         mn.pubkey = pubkey
         mn.save()
 
+        # the voting has its key once every auth has answered
+        if getattr(settings, 'MIXNET_FACTORS_PRECOMPUTE', False):
+            fill_factors_task.apply_async(
+                args=[mn.id],
+                countdown=getattr(settings, 'MIXNET_FACTORS_INTERVAL', 60))
+
         return Response(KeySerializer(pubkey, many=False).data)
 
 
-class Shuffle(APIView):
+class ChunkView(APIView):
+    """
+    Base of the views that receive the messages of the votes, in JSON or in
+    the binary format of base.wire, negotiated with the Content-Type and
+    Accept headers.
+    """
+
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [BatchParser]
+    renderer_classes = (list(api_settings.DEFAULT_RENDERER_CLASSES) +
+                        [BatchRenderer])
+
+    def is_binary(self, request):
+        return request.content_type.startswith(MEDIA_TYPE)
+
+
+class Shuffle(ChunkView):
 
     def post(self, request, voting_id):
         """
@@ -72,6 +135,7 @@ class Shuffle(APIView):
          * msgs: [ [int, int] ]
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * seq: int / nullable, number of the chunk to acknowledge
         """
 
         position = request.data.get("position", 0)
@@ -85,23 +149,20 @@ class Shuffle(APIView):
         if pk:
             p, g, y = pk["p"], pk["g"], pk["y"]
         else:
-            p, g, y = mn.key.p, mn.key.g, mn.key.y
-
-        msgs = mn.shuffle(msgs, (p, g, y))
+            # the key of the voting, combined with the next auths
+            key = mn.pubkey or mn.key
+            p, g, y = key.p, key.g, key.y
 
-        data = {
-            "msgs": msgs,
-            "pk": {"p": p, "g": g, "y": y},
-        }
-        # chained call to the next auth to gen the key
-        resp = mn.chain_call("/shuffle/{}/".format(voting_id), data)
-        if resp:
-            msgs = resp
+        msgs = mn.checkpointed('shuffle', msgs, (p, g, y),
+                               lambda: mn.shuffle(msgs, (p, g, y)))
 
-        return Response(msgs)
+        return chain_chunk(mn, "/shuffle/{}/".format(voting_id), msgs,
+                           {"p": p, "g": g, "y": y},
+                           request.data.get("seq", None),
+                           self.is_binary(request))
 
 
-class Decrypt(APIView):
+class Decrypt(ChunkView):
 
     def post(self, request, voting_id):
         """
@@ -109,6 +170,9 @@ class Decrypt(APIView):
          * msgs: [ [int, int] ]
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * seq: int / nullable, number of the chunk to acknowledge
+         * shuffle: bool / nullable, false to keep the order of the
+           messages, like the aggregates of the homomorphic tallies
         """
 
         position = request.data.get("position", 0)
@@ -122,7 +186,10 @@ class Decrypt(APIView):
         if pk:
             p, g, y = pk["p"], pk["g"], pk["y"]
         else:
-            p, g, y = mn.key.p, mn.key.g, mn.key.y
+            # the key of the voting, combined with the next auths
+            key = mn.pubkey or mn.key
+            p, g, y = key.p, key.g, key.y
+        shuffle = request.data.get("shuffle", True) is not False
 
         next_auths = mn.next_auths()
         last = next_auths.count() == 0
@@ -130,15 +197,39 @@ class Decrypt(APIView):
         # useful for tests only, to override the last value
         last = request.data.get("force-last", last)
 
-        msgs = mn.decrypt(msgs, (p, g, y), last=last)
+        msgs = mn.checkpointed(
+            'decrypt' if shuffle else 'aggregate', msgs, (p, g, y),
+            lambda: mn.decrypt(msgs, (p, g, y), last=last, shuffle=shuffle),
+            last=last)
 
-        data = {
-            "msgs": msgs,
-            "pk": {"p": p, "g": g, "y": y},
-        }
-        # chained call to the next auth to gen the key
-        resp = mn.chain_call("/decrypt/{}/".format(voting_id), data)
-        if resp:
-            msgs = resp
+        return chain_chunk(mn, "/decrypt/{}/".format(voting_id), msgs,
+                           {"p": p, "g": g, "y": y},
+                           request.data.get("seq", None),
+                           self.is_binary(request),
+                           None if shuffle else {"shuffle": False})
 
-        return Response(msgs)
+
+class Purge(APIView):
+    permission_classes = (UserIsStaff,)
+
+    def post(self, request, voting_id):
+        """
+        Deletes the checkpoints of the voting of every authority, once its
+        tally is saved. The answer is the number deleted by each of them.
+        Only for the staff, like the voting service that tallies it, as a
+        running tally is resumed from them.
+
+         * voting_id: id
+         * position: int / nullable
+        """
+
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(
+            Mixnet,
+            voting_id=voting_id,
+            auth_position=position)
+        try:
+            deleted = mn.purge_checkpoints(request.auth.key)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_502_BAD_GATEWAY)
+        return Response(deleted)
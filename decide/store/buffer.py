@@ -0,0 +1,146 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Vote
+
+
+class Entry:
+    """
+    A vote waiting in the buffer to be written.
+
+    Attributes:
+        vote (tuple): (voting_id, voter_id, a, b) of the vote.
+        event (Event): Set when the batch of the vote is committed, or when this entry becomes the flusher of the next batch.
+        lead (bool): True when the thread that owns this entry must flush the next batch.
+        error (Exception): The error raised while writing the batch of the vote, if any.
+    """
+
+    def __init__(self, vote):
+        self.vote = vote
+        self.event = threading.Event()
+        self.lead = False
+        self.error = None
+
+
+def write_votes(votes):
+    """
+    Writes a batch of votes with a single multi-row upsert, replacing the previous vote of each voter.
+
+    Args:
+        votes (list): A list of (voting_id, voter_id, a, b) tuples. If a voter appears more than once, the last vote wins.
+    """
+
+    Vote.objects.upsert([
+        Vote(voting_id=voting_id, voter_id=voter_id, a=a, b=b)
+        for voting_id, voter_id, a, b in votes
+    ])
+
+
+class VoteBuffer:
+    """
+    Bounded in-process buffer of accepted votes, written to the database in batches (group commit).
+
+    There isn't a background thread: the first caller that finds the buffer idle becomes the flusher. It waits
+    up to STORE_BATCH_WAIT seconds for the batch to reach STORE_BATCH_SIZE votes, writes it with write_votes
+    and then wakes up every caller of the batch and hands the flusher role to the next pending vote, if any.
+    Callers block when STORE_BATCH_CAPACITY votes are already pending.
+
+    Attributes:
+        pending (list): Entries waiting to be written.
+        flushing (bool): True while some caller is acting as flusher.
+        flushes (int): Number of batches written.
+        written (int): Number of votes written.
+    """
+
+    def __init__(self, write=write_votes):
+        self.write = write
+        self.cond = threading.Condition()
+        self.pending = []
+        self.flushing = False
+        self.flushes = 0
+        self.written = 0
+
+    @property
+    def size(self):
+        return getattr(settings, 'STORE_BATCH_SIZE', 500)
+
+    @property
+    def wait(self):
+        return getattr(settings, 'STORE_BATCH_WAIT', 0.005)
+
+    @property
+    def capacity(self):
+        return getattr(settings, 'STORE_BATCH_CAPACITY', 10000)
+
+    def put(self, voting_id, voter_id, a, b):
+        """
+        Adds a vote to the buffer and blocks until its batch is committed.
+
+        Raises:
+            Exception: The error raised while writing the batch, if any.
+        """
+
+        entry = Entry((voting_id, voter_id, a, b))
+        with self.cond:
+            while len(self.pending) >= self.capacity:
+                self.cond.wait()
+            self.pending.append(entry)
+            if not self.flushing:
+                self.flushing = True
+                entry.lead = True
+            elif len(self.pending) >= self.size:
+                self.cond.notify_all()
+
+        while True:
+            if entry.lead:
+                entry.lead = False
+                self.flush()
+            entry.event.wait()
+            if not entry.lead:
+                break
+            entry.event.clear()
+
+        if entry.error:
+            raise entry.error
+
+    def flush(self):
+        """
+        Waits for the batch to fill up or for the time limit and writes it. Only called by the flusher.
+        """
+
+        deadline = time.monotonic() + self.wait
+        with self.cond:
+            while len(self.pending) < self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.pending[:self.size]
+            del self.pending[:self.size]
+            self.cond.notify_all()
+
+        error = None
+        try:
+            self.write([entry.vote for entry in batch])
+        except Exception as e:
+            error = e
+
+        with self.cond:
+            if not error:
+                self.flushes += 1
+                self.written += len(batch)
+            if self.pending:
+                leader = self.pending[0]
+                leader.lead = True
+                leader.event.set()
+            else:
+                self.flushing = False
+
+        for entry in batch:
+            entry.error = error
+            entry.event.set()
+
+
+buffer = VoteBuffer()
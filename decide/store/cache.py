@@ -0,0 +1,209 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from base import mods
+from base.channels import get_channel
+from mixnet.mixcrypt import verify_ballot
+
+
+class VotingMeta:
+    """
+    The data of a voting needed to validate its votes.
+
+    Attributes:
+        id (int): The ID of the voting.
+        start_date (datetime): When the voting was started, None if it's not started.
+        end_date (datetime): When the voting was stopped, None if it's not stopped.
+        type (str): The type of the question of the voting.
+        key (str): Fingerprint of the public key of the voting, None if it doesn't have one.
+        mode (str): The tally mode of the voting, 'mixnet' or 'homomorphic'.
+        options (int): The number of options of the question.
+        pubkey (tuple): The public key (p, g, y) of the voting, None if it doesn't have one.
+    """
+
+    def __init__(self, id, start_date, end_date, type, key, mode='mixnet',
+                 options=0, pubkey=None):
+        self.id = id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.type = type
+        self.key = key
+        self.mode = mode
+        self.options = options
+        self.pubkey = pubkey
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Builds the VotingMeta from the data returned by the voting module.
+
+        Args:
+            data (dict): The serialized voting.
+
+        Returns:
+            VotingMeta: The voting metadata.
+        """
+
+        start_date = data.get('start_date', None)
+        end_date = data.get('end_date', None)
+        pub_key = data.get('pub_key', None)
+        key, pubkey = None, None
+        if pub_key:
+            pk = '{p},{g},{y}'.format(**pub_key)
+            key = hashlib.sha256(pk.encode()).hexdigest()[:16]
+            pubkey = (int(pub_key['p']), int(pub_key['g']), int(pub_key['y']))
+        return cls(
+            id=data['id'],
+            start_date=parse_datetime(start_date) if start_date else None,
+            end_date=parse_datetime(end_date) if end_date else None,
+            type=data.get('question', {}).get('type', None),
+            key=key,
+            mode=data.get('tally_mode', 'mixnet'),
+            options=len(data.get('question', {}).get('options', None) or []),
+            pubkey=pubkey,
+        )
+
+    def accepts(self, ciphertexts, multiple, proof=None):
+        """
+        Checks if a ballot is valid for the tally of the voting. The mixnet tally takes any ballot, as the
+        malformed votes are decrypted to invalid options and left out. The homomorphic tally adds up the
+        ciphertexts without decrypting them, so it needs one ciphertext per option, sent as a multiple
+        vote, and a valid proof that they are the encryptions of 0 or 1 adding up to 1 (see
+        mixnet.mixcrypt.verify_ballot).
+
+        Args:
+            ciphertexts (list): The (a, b) ciphertexts of the ballot.
+            multiple (bool): If it was sent as a multiple vote, with 'votes' instead of 'vote'.
+            proof (dict): The proof of the ballot, for the homomorphic tally.
+
+        Returns:
+            bool: True if the ballot can be stored.
+        """
+
+        if self.mode != 'homomorphic':
+            return True
+        if not multiple or len(ciphertexts) != self.options or not self.pubkey:
+            return False
+        return verify_ballot(ciphertexts, proof, self.pubkey)
+
+    def is_open(self, now=None):
+        """
+        Checks if the voting accepts votes.
+
+        Args:
+            now (datetime): The moment to check, by default the current time.
+
+        Returns:
+            bool: True if the voting is started and not closed.
+        """
+
+        now = now or timezone.now()
+        if not self.start_date or now < self.start_date:
+            return False
+        return not (self.end_date and self.end_date < now)
+
+
+class VotingCache:
+    """
+    Per-process cache of the VotingMeta of the votings, to validate the votes without querying the voting module.
+
+    The entries are fetched lazily from the voting module and invalidated through the 'voting' topic of the
+    channel of base.channels, where the voting module publishes the id of every saved voting. The cache is
+    bypassed while the channel isn't healthy, and the entries expire after VOTING_CACHE_TTL seconds anyway.
+
+    Attributes:
+        entries (dict): VotingMeta and expiration time by voting ID.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that queried the voting module.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.channel = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, voting_id):
+        """
+        Gets the voting from the voting module.
+
+        Args:
+            voting_id (int): The ID of the voting.
+
+        Returns:
+            VotingMeta: The voting metadata, or None if it doesn't exist.
+        """
+
+        voting = mods.get('voting', params={'id': voting_id})
+        if not voting or not isinstance(voting, list):
+            return None
+        return VotingMeta.from_data(voting[0])
+
+    def get(self, voting_id):
+        """
+        Gets the metadata of a voting.
+
+        Args:
+            voting_id (int): The ID of the voting.
+
+        Returns:
+            VotingMeta: The voting metadata, or None if it doesn't exist.
+        """
+
+        try:
+            voting_id = int(voting_id)
+        except (TypeError, ValueError):
+            return None
+
+        channel = get_channel()
+        with self.lock:
+            if channel is not self.channel:
+                self.entries.clear()
+                self.channel = channel
+                channel.subscribe('voting', self.invalidate)
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(voting_id, None)
+            if entry and entry[1] > now and channel.healthy:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+
+        meta = self.fetch(voting_id)
+        if meta and channel.healthy:
+            ttl = getattr(settings, 'VOTING_CACHE_TTL', 60)
+            with self.lock:
+                # not caching it if it was invalidated while fetching
+                if generation == self.generation:
+                    self.entries[voting_id] = (meta, now + ttl)
+        return meta
+
+    def invalidate(self, voting_id):
+        """
+        Removes a voting from the cache. Called by the channel.
+
+        Args:
+            voting_id (int): The ID of the voting, or None to remove every voting.
+        """
+
+        with self.lock:
+            self.generation += 1
+            if voting_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(int(voting_id), None)
+
+    def clear(self):
+        self.invalidate(None)
+
+
+votings = VotingCache()
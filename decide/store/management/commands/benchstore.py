@@ -0,0 +1,71 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.models import Vote
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the time to store a vote as the votes table grows. '
+            'It writes in the configured database, use a disposable one')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10000, 100000, 1000000, 10000000],
+                            help='table sizes to measure, in votes')
+        parser.add_argument('--samples', type=int, default=1000,
+                            help='votes stored for each size')
+        parser.add_argument('--voting', type=int, default=0,
+                            help='voting id used for the generated votes')
+        parser.add_argument('--keep', action='store_true',
+                            help="don't delete the generated votes")
+
+    def fill(self, voting, start, end, chunk=10000):
+        for i in range(start, end, chunk):
+            Vote.objects.bulk_create([
+                Vote(voting_id=voting, voter_id=voter,
+                     a=random.getrandbits(256), b=random.getrandbits(256))
+                for voter in range(i, min(i + chunk, end))
+            ])
+
+    def measure(self, voting, size, samples):
+        times = []
+        for i in range(samples):
+            # half of them are new voters, the other half are re-votes
+            if i % 2:
+                voter = random.randrange(size)
+            else:
+                voter = size + i
+            vote = Vote(voting_id=voting, voter_id=voter,
+                        a=random.getrandbits(256), b=random.getrandbits(256))
+            start = time.perf_counter()
+            Vote.objects.upsert([vote])
+            times.append(time.perf_counter() - start)
+        return sorted(times)
+
+    def handle(self, *args, **options):
+        voting = options['voting']
+        samples = options['samples']
+        Vote.objects.filter(voting_id=voting).delete()
+
+        self.stdout.write('{:>12} {:>12} {:>12} {:>12}'.format(
+            'votes', 'mean (us)', 'p50 (us)', 'p99 (us)'))
+        filled = 0
+        try:
+            for size in sorted(options['sizes']):
+                # removing the new voters of the previous measure
+                Vote.objects.filter(voting_id=voting,
+                                    voter_id__gte=filled).delete()
+                self.fill(voting, filled, size)
+                filled = size
+
+                times = self.measure(voting, size, samples)
+                self.stdout.write('{:>12} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+                    size,
+                    sum(times) / len(times) * 1e6,
+                    times[len(times) // 2] * 1e6,
+                    times[int(len(times) * 0.99)] * 1e6))
+        finally:
+            if not options['keep']:
+                Vote.objects.filter(voting_id=voting).delete()
@@ -0,0 +1,65 @@
+# Generated by Django 4.1 on 2026-10-17 00:24
+
+from django.apps import apps as global_apps
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_votes(apps, schema_editor):
+    """
+    Removes the repeated votes of a voter before adding the unique constraint.
+
+    For multiple choice votings every ciphertext of the voter is kept and
+    numbered with its position. For the rest of them only the last vote of
+    the voter is kept. Votes of votings unknown to this instance are kept.
+    """
+
+    Vote = apps.get_model('store', 'Vote')
+    repeated = (Vote.objects.values('voting_id', 'voter_id')
+                .annotate(n=Count('id')).filter(n__gt=1))
+    if not repeated.exists():
+        return
+
+    known, multiple = set(), set()
+    try:
+        Voting = apps.get_model('voting', 'Voting')
+        known = set(Voting.objects.values_list('id', flat=True))
+        multiple = set(Voting.objects.filter(question__type='M')
+                       .values_list('id', flat=True))
+    except LookupError:
+        pass
+
+    for key in repeated.iterator():
+        votes = Vote.objects.filter(voting_id=key['voting_id'],
+                                    voter_id=key['voter_id']).order_by('id')
+        if key['voting_id'] in known and key['voting_id'] not in multiple:
+            last = votes.last()
+            votes.exclude(pk=last.pk).delete()
+        else:
+            for position, vote in enumerate(votes):
+                vote.position = position
+                vote.save(update_fields=['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+    if global_apps.is_installed('voting'):
+        dependencies.append(('voting', '0001_initial'))
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(dedupe_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(
+                fields=('voting_id', 'voter_id', 'position'),
+                name='store_vote_unique_voter'),
+        ),
+    ]
@@ -1,7 +1,153 @@
-from django.db import models
+from django.db import connection, models, transaction
 from base.models import BigBigField
 
 
+class VoteManager(models.Manager):
+    """
+    Manager for the Vote model, adding the upsert of votes.
+    """
+
+    def upsert(self, votes):
+        """
+        Inserts the votes or, if the voter already has a vote in that position, replaces its ciphertext.
+
+        It's a single INSERT ... ON CONFLICT DO UPDATE statement in PostgreSQL and SQLite. In the backends
+        without support for it, every vote is updated or created inside one transaction.
+
+        Args:
+            votes (list): A list of Vote instances. If there are repeated (voting_id, voter_id, position)
+                keys, the last vote wins.
+        """
+
+        last = {}
+        for v in votes:
+            last[(v.voting_id, v.voter_id, v.position)] = v
+        votes = list(last.values())
+        if not votes:
+            return
+
+        if connection.features.supports_update_conflicts_with_target:
+            self.bulk_create(
+                votes,
+                update_conflicts=True,
+                unique_fields=['voting_id', 'voter_id', 'position'],
+                update_fields=['a', 'b', 'voted'])
+            return
+
+        with transaction.atomic():
+            for v in votes:
+                self.update_or_create(
+                    voting_id=v.voting_id, voter_id=v.voter_id,
+                    position=v.position, defaults={'a': v.a, 'b': v.b})
+
+    def replace_ballot(self, voting_id, voter_id, ciphertexts):
+        """
+        Replaces every ciphertext of the voter in the voting with the new ones, in one transaction.
+
+        The new ciphertexts are upserted in their positions and the remaining ones of the previous ballot are
+        deleted, so it takes the same queries whatever the number of ciphertexts. Concurrent submissions of
+        the same voter are serialized by the row locks of the upsert on the position 0, and the last one wins.
+
+        Args:
+            voting_id (int): The ID of the voting.
+            voter_id (int): The ID of the voter.
+            ciphertexts (list): A list of (a, b) tuples.
+        """
+
+        self.replace_ballots([(voting_id, voter_id, ciphertexts)])
+
+    def replace_ballots(self, ballots):
+        """
+        Replaces the ballots of many voters at once, like replace_ballot, in one transaction.
+
+        Every ciphertext is written by a single upsert, and the positions left over from the previous ballots
+        are deleted with one query for each voting and ballot length.
+
+        Args:
+            ballots (list): A list of (voting_id, voter_id, ciphertexts) tuples, where ciphertexts is a list
+                of (a, b) tuples. If a voter appears more than once in a voting, the last ballot wins.
+        """
+
+        last = {}
+        for voting_id, voter_id, ciphertexts in ballots:
+            last[(voting_id, voter_id)] = ciphertexts
+
+        lengths = {}
+        for (voting_id, voter_id), ciphertexts in last.items():
+            key = (voting_id, len(ciphertexts))
+            lengths.setdefault(key, []).append(voter_id)
+
+        with transaction.atomic():
+            self.upsert([
+                Vote(voting_id=voting_id, voter_id=voter_id, position=position,
+                     a=a, b=b)
+                for (voting_id, voter_id), ciphertexts in last.items()
+                for position, (a, b) in enumerate(ciphertexts)
+            ])
+            for (voting_id, length), voters in lengths.items():
+                self.filter(voting_id=voting_id, voter_id__in=voters,
+                            position__gte=length).delete()
+
+    def stream(self, after=0, limit=None, chunk_size=5000, **filters):
+        """
+        Iterates over the votes in id order, reading them in pages of chunk_size with keyset pagination on the
+        id, so the memory used doesn't depend on the number of votes.
+
+        Args:
+            after (int): Only the votes with a greater id are returned.
+            limit (int): Max number of votes returned, all of them by default.
+            chunk_size (int): Number of votes read by each query.
+            **filters: Lookups to filter the votes, like voting_id.
+
+        Yields:
+            tuple: (id, voting_id, voter_id, a, b) of each vote.
+        """
+
+        qs = self.filter(**filters).order_by('id').values_list(
+            'id', 'voting_id', 'voter_id', 'a', 'b')
+        sent = 0
+        while limit is None or sent < limit:
+            size = chunk_size
+            if limit is not None:
+                size = min(chunk_size, limit - sent)
+            n = 0
+            for vote in qs.filter(id__gt=after)[:size].iterator():
+                n += 1
+                after = vote[0]
+                yield vote
+            sent += n
+            if n < size:
+                return
+
+    def aggregate(self, voting_id, p, size, chunk_size=5000):
+        """
+        Multiplies, component-wise modulo p, the ciphertexts of each position of every ballot of a voting.
+        With exponential ElGamal the product of each position is the encryption of the sum of its votes,
+        which is how the homomorphic tally decrypts one ciphertext per option.
+
+        Args:
+            voting_id (int): The ID of the voting.
+            p (int): The prime of the public key of the voting.
+            size (int): The number of positions of the ballots, one per option.
+            chunk_size (int): Number of votes read at a time.
+
+        Returns:
+            tuple: (msgs, ballots), where msgs is a list with the [a, b] product of each position and ballots
+            is the number of ballots multiplied.
+        """
+
+        a_s, b_s = [1] * size, [1] * size
+        ballots = 0
+        votes = (self.filter(voting_id=voting_id, position__lt=size)
+                 .values_list('position', 'a', 'b'))
+        for position, a, b in votes.iterator(chunk_size=chunk_size):
+            a_s[position] = a_s[position] * a % p
+            b_s[position] = b_s[position] * b % p
+            if position == 0:
+                ballots += 1
+        return [[a, b] for a, b in zip(a_s, b_s)], ballots
+
+
 class Vote(models.Model):
     """
     A model representing a vote in a voting system.
@@ -9,6 +155,8 @@ class Vote(models.Model):
     Attributes:
         voting_id (PositiveIntegerField): The ID of the voting session this vote is associated with.
         voter_id (PositiveIntegerField): The ID of the voter who cast this vote.
+        position (PositiveSmallIntegerField): The position of the ciphertext in the ballot, 0 except for
+            the multiple choice votes, that store one ciphertext per option selected.
         a (BigBigField): Encrypted data part A representing the vote.
         b (BigBigField): Encrypted data part B representing the vote.
         voted (DateTimeField): The timestamp of when the vote was cast.
@@ -16,12 +164,22 @@ class Vote(models.Model):
 
     voting_id = models.PositiveIntegerField()
     voter_id = models.PositiveIntegerField()
+    position = models.PositiveSmallIntegerField(default=0)
 
     a = BigBigField()
     b = BigBigField()
 
     voted = models.DateTimeField(auto_now=True)
 
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['voting_id', 'voter_id', 'position'],
+                name='store_vote_unique_voter'),
+        ]
+
     def __str__(self):
         """
         Returns a string representation of the Vote instance.
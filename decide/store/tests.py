@@ -1,17 +1,30 @@
 import datetime
+import json
 import random
+import threading
+from unittest import mock
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
+from .buffer import VoteBuffer, buffer
+from .cache import VotingCache
 from .models import Vote
 from .serializers import VoteSerializer
+from base import channels
 from base import mods
 from base.models import Auth
 from base.tests import BaseTestCase
 from census.models import Census
+from mixnet.mixcrypt import MixCrypt, prove_ballot
 from mixnet.models import Key
 from voting.models import Question, QuestionOption
 from voting.models import Voting
@@ -200,6 +213,37 @@ class StoreChoiceCase(BaseTestCase):
         self.assertEqual(Vote.objects.first().a, CTE_A)
         self.assertEqual(Vote.objects.first().b, CTE_B)
 
+    @override_settings(STORE_BATCH_INGESTION=True)
+    def test_store_vote_batch_ingestion(self):
+        """
+        Test case for storing a vote through the write-behind buffer.
+
+        The vote is stored twice by the same voter and the second one must replace the first one once the
+        request returns.
+        """
+
+        user = self.get_or_create_user(1)
+        census = Census(voting_id=self.voting.id, voter_id=1)
+        census.save()
+        self.login(user=user.username)
+        flushes = buffer.flushes
+
+        for a, b in ((96, 184), (97, 185)):
+            data = {
+                "voting": self.voting.id,
+                "voter": 1,
+                "vote": {"a": a, "b": b},
+                "voting_type": 'classic',
+            }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(buffer.flushes, flushes + 2)
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(Vote.objects.first().voter_id, 1)
+        self.assertEqual(Vote.objects.first().a, 97)
+        self.assertEqual(Vote.objects.first().b, 185)
+
     def test_store_vote_choices(self):
         """
         Test case for storing multiple choice votes.
@@ -238,6 +282,40 @@ class StoreChoiceCase(BaseTestCase):
         self.assertEqual(Vote.objects.filter(
             b=CTE_B + 1).values()[0]['b'], CTE_B + 1)
 
+    def test_store_vote_choices_query_count(self):
+        """
+        Test case for replacing multiple choice ballots.
+
+        Every new ballot replaces the previous one of the voter, and the number of queries of each request is
+        the same whatever the number of options selected.
+        """
+
+        user = self.get_or_create_user(1)
+        census = Census(voting_id=self.voting_choices.id, voter_id=1)
+        census.save()
+        self.login(user=user.username)
+
+        queries = []
+        for n in (3, 1, 5, 10, 2):
+            data = {
+                "voting": self.voting_choices.id,
+                "voter": 1,
+                "votes": [{"a": n, "b": i} for i in range(n)],
+                'voting_type': 'choices'
+            }
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+            queries.append(len(ctx.captured_queries))
+
+            votes = Vote.objects.filter(voting_id=self.voting_choices.id,
+                                        voter_id=1).order_by('position')
+            self.assertEqual([(v.a, v.b) for v in votes],
+                             [(n, i) for i in range(n)])
+
+        # the first one is a warm up
+        self.assertEqual(len(set(queries[1:])), 1)
+
     def test_voting_invalid_type(self):
         """
         Test case for storing a vote with an invalid voting type.
@@ -712,3 +790,502 @@ class StorePreferenceCase(BaseTestCase):
         self.login(user=user.username)
         response = self.client.post('/store/', data, format='json')
         self.assertEqual(response.status_code, 400)
+
+
+class StoreExportCase(BaseTestCase):
+    """
+    Test case for the NDJSON export of the votes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        Vote.objects.bulk_create([
+            Vote(voting_id=voting, voter_id=i, a=i * 10**70, b=i)
+            for i in range(1, 26) for voting in (1, 2)
+        ])
+
+    def export(self, **params):
+        params['export'] = 'ndjson'
+        response = self.client.get('/store/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_export(self):
+        self.login()
+        with self.settings(STORE_EXPORT_CHUNK_SIZE=7):
+            votes = self.export(voting_id=1)
+
+        expected = Vote.objects.filter(voting_id=1).order_by('id')
+        self.assertEqual(votes, [
+            {'id': v.id, 'voting_id': 1, 'voter_id': v.voter_id,
+             'a': v.a, 'b': v.b}
+            for v in expected
+        ])
+        self.assertEqual(len(self.export()), 50)
+        self.assertEqual([v['voting_id'] for v in self.export(voter_id=3)],
+                         [1, 2])
+
+    def test_export_cursor(self):
+        self.login()
+        with self.settings(STORE_EXPORT_CHUNK_SIZE=4):
+            first = self.export(voting_id=2, limit=10)
+            rest = self.export(voting_id=2, after=first[-1]['id'])
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(rest), 15)
+        self.assertEqual([v['voter_id'] for v in first + rest],
+                         list(range(1, 26)))
+        self.assertEqual(self.export(voting_id=2, after=rest[-1]['id']), [])
+
+    def test_export_pages(self):
+        self.login()
+        with self.settings(STORE_EXPORT_CHUNK_SIZE=10):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(
+                    '/store/', {'voting_id': 1, 'export': 'ndjson'})
+                before = len(ctx.captured_queries)
+                list(response.streaming_content)
+        # the votes are read while streaming, one query per page
+        pages = [q for q in ctx.captured_queries[before:]
+                 if 'store_vote' in q['sql']]
+        self.assertEqual(len(pages), 3)
+
+    def test_export_invalid(self):
+        response = self.client.get('/store/', {'export': 'ndjson'})
+        self.assertEqual(response.status_code, 401)
+
+        self.login()
+        response = self.client.get('/store/', {'export': 'ndjson',
+                                               'voting_id': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/store/', {'export': 'ndjson',
+                                               'after': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StoreBatchCase(BaseTestCase):
+    """
+    Test case for storing batches of ballots of many voters.
+    """
+
+    def setUp(self):
+        super().setUp()
+        question = Question(desc='qwerty', type='C')
+        question.save()
+        question_choices = Question(desc='qwerty', type='M')
+        question_choices.save()
+        self.voting = Voting(name='classic', question=question,
+                             start_date=timezone.now())
+        self.voting.save()
+        self.voting_choices = Voting(name='choices', question=question_choices,
+                                     start_date=timezone.now())
+        self.voting_choices.save()
+        self.closed = Voting(name='closed', question=question,
+                             start_date=timezone.now(),
+                             end_date=timezone.now())
+        self.closed.save()
+
+    def tearDown(self):
+        self.voting = None
+        self.voting_choices = None
+        self.closed = None
+        super().tearDown()
+
+    def gen_voters(self, n, votings):
+        """
+        Creates n voters, with their tokens, in the census of the votings.
+
+        Returns:
+            list: (user ID, token) of each voter.
+        """
+
+        voters = []
+        first = User.objects.count()
+        for i in range(first, first + n):
+            user = User.objects.create(username='batch{}'.format(i))
+            voters.append((user.id, Token.objects.create(user=user).key))
+        Census.objects.bulk_create([
+            Census(voting_id=v.id, voter_id=uid)
+            for v in votings for uid, token in voters
+        ])
+        return voters
+
+    def ballot(self, voting, voter, a=1, b=2):
+        uid, token = voter
+        return {'voting': voting.id, 'voter': uid, 'token': token,
+                'vote': {'a': a, 'b': b}, 'voting_type': 'classic'}
+
+    def test_batch(self):
+        voters = self.gen_voters(4, [self.voting, self.voting_choices,
+                                     self.closed])
+        outsider = self.gen_voters(1, [])[0]
+        choices = {'voting': self.voting_choices.id, 'voter': voters[1][0],
+                   'token': voters[1][1], 'voting_type': 'choices',
+                   'votes': [{'a': 5, 'b': 6}, {'a': 7, 'b': 8}]}
+        ballots = [
+            self.ballot(self.voting, voters[0]),
+            choices,
+            self.ballot(self.voting, (voters[2][0], voters[3][1])),
+            self.ballot(self.voting, outsider),
+            self.ballot(self.closed, voters[0]),
+            dict(self.ballot(self.voting, voters[2]), voting_type='invalid'),
+            {'voting': self.voting.id, 'voter': voters[2][0]},
+            'invalid',
+            self.ballot(self.voting, voters[3]),
+            self.ballot(self.voting, voters[0], 3, 4),
+        ]
+
+        self.login()
+        response = self.client.post('/store/batch/', {'ballots': ballots},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'],
+                         [200, 200, 401, 401, 401, 400, 400, 400, 200, 200])
+
+        votes = Vote.objects.order_by('voting_id', 'voter_id', 'position')
+        self.assertEqual(
+            [(v.voting_id, v.voter_id, v.position, v.a, v.b) for v in votes],
+            [(self.voting.id, voters[0][0], 0, 3, 4),
+             (self.voting.id, voters[3][0], 0, 1, 2),
+             (self.voting_choices.id, voters[1][0], 0, 5, 6),
+             (self.voting_choices.id, voters[1][0], 1, 7, 8)])
+
+    def test_batch_replaces_ballots(self):
+        voter = self.gen_voters(1, [self.voting_choices])[0]
+        Vote.objects.replace_ballot(self.voting_choices.id, voter[0],
+                                    [(1, 1), (2, 2), (3, 3)])
+        ballot = {'voting': self.voting_choices.id, 'voter': voter[0],
+                  'token': voter[1], 'voting_type': 'choices',
+                  'votes': [{'a': 9, 'b': 9}]}
+
+        self.login()
+        response = self.client.post('/store/batch/', {'ballots': [ballot]},
+                                    format='json')
+        self.assertEqual(response.json()['results'], [200])
+        self.assertEqual(
+            list(Vote.objects.values_list('position', 'a')), [(0, 9)])
+
+    @override_settings(CHANNEL_BACKEND='base.channels.LocalChannel')
+    def test_batch_query_count(self):
+        channels.reset()
+        voters = self.gen_voters(150, [self.voting])
+        self.login()
+
+        queries = []
+        for n in (10, 50, 150):
+            ballots = [self.ballot(self.voting, v) for v in voters[:n]]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(
+                    '/store/batch/', {'ballots': ballots}, format='json')
+            self.assertEqual(response.json()['results'], [200] * n)
+            queries.append(len(ctx.captured_queries))
+        channels.reset()
+
+        self.assertEqual(Vote.objects.count(), 150)
+        # the first one is a warm up
+        self.assertEqual(queries[1], queries[2])
+
+    def test_batch_permissions(self):
+        voter = self.gen_voters(1, [self.voting])[0]
+        data = {'ballots': [self.ballot(self.voting, voter)]}
+
+        response = self.client.post('/store/batch/', data, format='json')
+        self.assertEqual(response.status_code, 401)
+
+        self.login(user='noadmin')
+        response = self.client.post('/store/batch/', data, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.login()
+        with self.settings(STORE_BATCH_MAX_BALLOTS=0):
+            response = self.client.post('/store/batch/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/store/batch/', {'ballots': 'invalid'},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Vote.objects.count(), 0)
+
+
+class StoreHomomorphicCase(BaseTestCase):
+    """
+    Test case for the ballots of the votings with the homomorphic tally, one ciphertext per option.
+    """
+
+    def setUp(self):
+        super().setUp()
+        question = Question(desc='qwerty', type='C')
+        question.save()
+        for i in range(3):
+            QuestionOption(question=question,
+                           option='option {}'.format(i)).save()
+        k = MixCrypt(bits=settings.KEYBITS).k
+        self.pubkey = (int(k.p), int(k.g), int(k.y))
+        key = Key.objects.create(p=k.p, g=k.g, y=k.y)
+        self.voting = Voting(name='homomorphic', question=question,
+                             start_date=timezone.now(), pub_key=key,
+                             tally_mode=Voting.HOMOMORPHIC)
+        self.voting.save()
+
+    def tearDown(self):
+        self.voting = None
+        super().tearDown()
+
+    def ballot(self, voter, votes, proof=None, voting_type='homomorphic'):
+        user = User.objects.create(username='homomorphic{}'.format(voter))
+        Census.objects.create(voting_id=self.voting.id, voter_id=user.id)
+        token = Token.objects.create(user=user).key
+        ballot = {'voting': self.voting.id, 'voter': user.id, 'token': token,
+                  'voting_type': voting_type}
+        if votes is None:
+            ballot['vote'] = {'a': 2, 'b': 3}
+        else:
+            ballot['votes'] = [{'a': a, 'b': b} for a, b in votes]
+        if proof is not None:
+            ballot['proof'] = json.loads(json.dumps(proof, default=str))
+        return ballot
+
+    def test_store_ballots(self):
+        p, g, y = self.pubkey
+        votes, proof = prove_ballot(1, 3, self.pubkey)
+        short, short_proof = prove_ballot(1, 2, self.pubkey)
+        # the encryption of 2 instead of 1, with the proof of the real ballot
+        forged = [votes[0], (votes[1][0], votes[1][1] * g % p), votes[2]]
+        # two votes, every ciphertext is the one of 0 or 1
+        double, double_proof = prove_ballot(0, 3, self.pubkey)
+        double = [double[0]] + votes[1:]
+        double_proof = {'options': double_proof['options'][:1] +
+                        proof['options'][1:], 'sum': proof['sum']}
+        ballots = [
+            self.ballot(0, votes, proof),
+            self.ballot(1, short, short_proof),
+            self.ballot(2, None, voting_type='classic'),
+            self.ballot(3, votes, proof, 'choices'),
+            self.ballot(4, votes),
+            self.ballot(5, forged, proof),
+            self.ballot(6, double, double_proof),
+        ]
+
+        self.login()
+        response = self.client.post('/store/batch/', {'ballots': ballots},
+                                    format='json')
+        self.assertEqual(response.json()['results'],
+                         [200, 400, 400, 200, 400, 400, 400])
+
+        for i, ballot in enumerate(ballots):
+            token = ballot.pop('token')
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+            response = self.client.post('/store/', ballot, format='json')
+            self.assertEqual(response.status_code, 200 if i in (0, 3) else 400)
+        self.assertEqual(Vote.objects.count(), 6)
+
+    def test_aggregate(self):
+        p = 101
+        ballots = [[(2, 3), (5, 7), (11, 13)], [(4, 9), (6, 8), (10, 12)]]
+        for voter, votes in enumerate(ballots):
+            Vote.objects.replace_ballot(self.voting.id, voter, votes)
+        Vote.objects.replace_ballot(self.voting.id + 1, 0, [(3, 3)] * 3)
+        expected = [[2 * 4 % p, 3 * 9 % p], [5 * 6 % p, 7 * 8 % p],
+                    [11 * 10 % p, 13 * 12 % p]]
+
+        self.assertEqual(Vote.objects.aggregate(self.voting.id, p, 3),
+                         (expected, 2))
+        self.assertEqual(Vote.objects.aggregate(self.voting.id + 2, p, 3),
+                         ([[1, 1]] * 3, 0))
+
+        params = {'voting_id': self.voting.id, 'p': p, 'size': 3}
+        response = self.client.get('/store/aggregate/', params)
+        self.assertEqual(response.status_code, 401)
+        self.login()
+        response = self.client.get('/store/aggregate/', params)
+        self.assertEqual(response.json(), {'msgs': expected, 'ballots': 2})
+        response = self.client.get('/store/aggregate/', dict(params, size='x'))
+        self.assertEqual(response.status_code, 400)
+
+
+class VoteBufferCase(TransactionTestCase):
+    """
+    Test case for the write-behind vote buffer.
+
+    Votes are put from several threads at the same time, so they must be grouped in fewer batches than votes.
+    """
+
+    def put_votes(self, buf, votes):
+        """
+        Puts every vote in the buffer from its own thread and waits for all of them.
+
+        Args:
+            buf (VoteBuffer): The buffer.
+            votes (list): A list of (voting_id, voter_id, a, b) tuples.
+
+        Returns:
+            list: The errors raised by the threads.
+        """
+
+        errors = []
+
+        def put(vote):
+            try:
+                buf.put(*vote)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=put, args=(v,)) for v in votes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+
+    @override_settings(STORE_BATCH_SIZE=10, STORE_BATCH_WAIT=0.5)
+    def test_group_commit(self):
+        N = 30
+        buf = VoteBuffer()
+        votes = [(1, i, i + 10, i + 20) for i in range(N)]
+        errors = self.put_votes(buf, votes)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(buf.written, N)
+        self.assertLess(buf.flushes, N)
+        self.assertEqual(buf.pending, [])
+        self.assertFalse(buf.flushing)
+        self.assertEqual(Vote.objects.filter(voting_id=1).count(), N)
+        for v in Vote.objects.all():
+            self.assertEqual(v.a, v.voter_id + 10)
+            self.assertEqual(v.b, v.voter_id + 20)
+
+    @override_settings(STORE_BATCH_SIZE=10, STORE_BATCH_WAIT=0.1)
+    def test_write_error(self):
+        def write(votes):
+            raise ValueError('write error')
+
+        buf = VoteBuffer(write=write)
+        errors = self.put_votes(buf, [(1, i, 1, 1) for i in range(5)])
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(buf.written, 0)
+        self.assertFalse(buf.flushing)
+
+
+class VoteUpsertCase(TestCase):
+    """
+    Test case for the unique voter constraint and the upsert of votes.
+    """
+
+    def test_upsert(self):
+        Vote.objects.upsert([Vote(voting_id=1, voter_id=1, a=1, b=2)])
+        Vote.objects.upsert([Vote(voting_id=1, voter_id=1, a=3, b=4),
+                             Vote(voting_id=1, voter_id=2, a=5, b=6)])
+
+        self.assertEqual(Vote.objects.count(), 2)
+        v = Vote.objects.get(voting_id=1, voter_id=1)
+        self.assertEqual((v.a, v.b), (3, 4))
+
+    def test_upsert_last_wins(self):
+        Vote.objects.upsert([Vote(voting_id=1, voter_id=1, a=1, b=2),
+                             Vote(voting_id=1, voter_id=1, a=3, b=4)])
+
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(Vote.objects.first().a, 3)
+
+    def test_upsert_single_statement(self):
+        if not connection.features.supports_update_conflicts_with_target:
+            self.skipTest('database without INSERT ... ON CONFLICT')
+
+        Vote.objects.upsert([
+            Vote(voting_id=1, voter_id=i, a=1, b=1) for i in range(50)])
+        with self.assertNumQueries(1):
+            Vote.objects.upsert([
+                Vote(voting_id=1, voter_id=i, a=2, b=2) for i in range(100)])
+        self.assertEqual(Vote.objects.count(), 100)
+        self.assertEqual(Vote.objects.filter(a=2).count(), 100)
+
+    def test_upsert_fallback(self):
+        features = connection.features
+        with mock.patch.object(features,
+                               'supports_update_conflicts_with_target', False):
+            Vote.objects.upsert([Vote(voting_id=1, voter_id=1, a=1, b=2)])
+            Vote.objects.upsert([Vote(voting_id=1, voter_id=1, a=3, b=4)])
+
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(Vote.objects.first().a, 3)
+
+    def test_unique_voter(self):
+        Vote.objects.create(voting_id=1, voter_id=1, a=1, b=1)
+        Vote.objects.create(voting_id=1, voter_id=1, position=1, a=1, b=1)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Vote.objects.create(voting_id=1, voter_id=1, a=2, b=2)
+
+
+@override_settings(CHANNEL_BACKEND='base.channels.LocalChannel')
+class VotingCacheCase(BaseTestCase):
+    """
+    Test case for the cache of votings used to validate the votes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        channels.reset()
+        self.cache = VotingCache()
+        question = Question(desc='qwerty', type='C')
+        question.save()
+        self.voting = Voting(name='voting example', question=question,
+                             start_date=timezone.now())
+        self.voting.save()
+
+    def tearDown(self):
+        channels.reset()
+        self.cache = None
+        self.voting = None
+        super().tearDown()
+
+    def test_hit(self):
+        meta = self.cache.get(self.voting.id)
+        self.assertEqual(meta.id, self.voting.id)
+        self.assertEqual(meta.type, 'C')
+        self.assertTrue(meta.is_open())
+        self.assertEqual(self.cache.misses, 1)
+
+        with self.assertNumQueries(0):
+            self.assertIs(self.cache.get(self.voting.id), meta)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_unknown(self):
+        self.assertIsNone(self.cache.get(None))
+        self.assertIsNone(self.cache.get('invalid'))
+        self.assertIsNone(self.cache.get(self.voting.id + 1))
+
+    def test_invalidation(self):
+        self.assertTrue(self.cache.get(self.voting.id).is_open())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting.end_date = timezone.now()
+            self.voting.save()
+            # dropped in this process right away
+            meta = self.cache.get(self.voting.id)
+            self.assertFalse(meta.is_open())
+            self.assertEqual(self.cache.misses, 2)
+        # and in every process once committed
+        self.cache.get(self.voting.id)
+        self.assertEqual(self.cache.misses, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting.delete()
+        self.assertIsNone(self.cache.get(meta.id))
+
+    def test_unhealthy_channel(self):
+        self.cache.get(self.voting.id)
+        with mock.patch.object(channels.LocalChannel, 'healthy', False):
+            self.cache.get(self.voting.id)
+            self.cache.get(self.voting.id)
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_ttl(self):
+        with override_settings(VOTING_CACHE_TTL=0):
+            self.cache.get(self.voting.id)
+            self.cache.get(self.voting.id)
+        self.assertEqual(self.cache.misses, 2)
@@ -4,4 +4,7 @@ from . import views
 
 urlpatterns = [
     path('', views.StoreView.as_view(), name='store'),
+    path('batch/', views.StoreBatchView.as_view(), name='store_batch'),
+    path('aggregate/', views.StoreAggregateView.as_view(),
+         name='store_aggregate'),
 ]
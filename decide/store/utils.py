@@ -1,10 +1,62 @@
-from django.utils import timezone
-from django.utils.dateparse import parse_datetime
+from django.conf import settings
+from django.db import transaction
 from rest_framework import status
 from rest_framework.response import Response
 
+from .buffer import buffer
+from .cache import votings
 from .models import Vote
 from base import mods
+from base.perms import get_user, get_users
+
+
+def in_census(vid, uid):
+    """
+    Checks if a voter is in the census of a voting.
+
+    When the census module runs in this process its in-memory index is consulted directly, otherwise the
+    census module is queried.
+
+    Args:
+        vid (int): The ID of the voting.
+        uid (int): The ID of the voter.
+
+    Returns:
+        bool: True if the voter is in the census.
+    """
+
+    if mods.is_local('census'):
+        from census.index import voters
+        return voters.contains(vid, uid)
+
+    perms = mods.get(
+        'census/{}'.format(vid),
+        params={
+            'voter_id': uid},
+        response=True)
+    return perms.status_code != 401
+
+
+def census_members(vid, uids):
+    """
+    Checks which of some voters are in the census of a voting, like in_census.
+
+    When the census module runs in this process its in-memory index is consulted once for all of them,
+    otherwise the census module is queried for each voter.
+
+    Args:
+        vid (int): The ID of the voting.
+        uids (list): The IDs of the voters.
+
+    Returns:
+        set: The IDs of the voters that are in the census.
+    """
+
+    if mods.is_local('census'):
+        from census.index import voters
+        return voters.members(vid, uids)
+
+    return {uid for uid in set(uids) if in_census(vid, uid)}
 
 
 def classic_store(request):
@@ -25,18 +77,13 @@ def classic_store(request):
 
     Raises:
         HTTP_401_UNAUTHORIZED: If the voting is not found, or has not started, or is closed.
-        HTTP_400_BAD_REQUEST: If the voting ID, voter ID, or vote data is missing or invalid.
+        HTTP_400_BAD_REQUEST: If the voting ID, voter ID, or vote data is missing or invalid, or the ballot
+            doesn't have the shape expected by the tally mode of the voting (see VotingMeta.accepts).
     """
 
     vid = request.data.get('voting')
-    voting = mods.get('voting', params={'id': vid})
-    if not voting or not isinstance(voting, list):
-        return status.HTTP_401_UNAUTHORIZED
-    start_date = voting[0].get('start_date', None)
-    end_date = voting[0].get('end_date', None)
-    not_started = not start_date or timezone.now() < parse_datetime(start_date)
-    is_closed = end_date and parse_datetime(end_date) < timezone.now()
-    if not_started or is_closed:
+    voting = votings.get(vid)
+    if not voting or not voting.is_open():
         return status.HTTP_401_UNAUTHORIZED
 
     uid = request.data.get('voter')
@@ -44,40 +91,31 @@ def classic_store(request):
 
     if not vid or not uid or not vote:
         return status.HTTP_400_BAD_REQUEST
+    if not voting.accepts([(vote.get("a"), vote.get("b"))], False):
+        return status.HTTP_400_BAD_REQUEST
 
     # validating voter
     if request.auth:
         token = request.auth.key
     else:
         token = "NO-AUTH-VOTE"
-    voter = mods.post(
-        'authentication',
-        entry_point='/getuser/',
-        json={
-            'token': token})
-    voter_id = voter.get('id', None)
+    voter_id = get_user(token).get('id', None)
     if not voter_id or voter_id != uid:
         return status.HTTP_401_UNAUTHORIZED
 
     # the user is in the census
-    perms = mods.get(
-        'census/{}'.format(vid),
-        params={
-            'voter_id': uid},
-        response=True)
-    if perms.status_code == 401:
+    if not in_census(vid, uid):
         return status.HTTP_401_UNAUTHORIZED
 
     a = vote.get("a")
     b = vote.get("b")
 
-    defs = {"a": a, "b": b}
-    v, _ = Vote.objects.get_or_create(voting_id=vid, voter_id=uid,
-                                      defaults=defs)
-    v.a = a
-    v.b = b
+    if getattr(settings, 'STORE_BATCH_INGESTION', False):
+        # group commit, returns once the batch of this vote is written
+        buffer.put(vid, uid, a, b)
+        return status.HTTP_200_OK
 
-    v.save()
+    Vote.objects.upsert([Vote(voting_id=vid, voter_id=uid, a=a, b=b)])
 
     return status.HTTP_200_OK
 
@@ -93,25 +131,21 @@ def choices_store(request):
         - voting (int): The ID of the voting.
         - voter (int): The ID of the voter.
         - votes (list): A list of dictionaries, each containing the 'a' and 'b' keys representing individual encrypted votes.
-        - voting_type (str): A string representing the type of voting ('choices').
+        - proof (dict): The proof of the ballot, only for the votings with the homomorphic tally.
+        - voting_type (str): A string representing the type of voting ('choices', 'homomorphic').
 
     Returns:
         HTTP status code indicating the result of the operation.
 
     Raises:
         HTTP_401_UNAUTHORIZED: If the voting is not found, or has not started, or is closed.
-        HTTP_400_BAD_REQUEST: If the voting ID, voter ID, or votes data is missing or invalid.
+        HTTP_400_BAD_REQUEST: If the voting ID, voter ID, or votes data is missing or invalid, or the ballot
+            doesn't have the shape expected by the tally mode of the voting (see VotingMeta.accepts).
     """
 
     vid = request.data.get('voting')
-    voting = mods.get('voting', params={'id': vid})
-    if not voting or not isinstance(voting, list):
-        return status.HTTP_401_UNAUTHORIZED
-    start_date = voting[0].get('start_date', None)
-    end_date = voting[0].get('end_date', None)
-    not_started = not start_date or timezone.now() < parse_datetime(start_date)
-    is_closed = end_date and parse_datetime(end_date) < timezone.now()
-    if not_started or is_closed:
+    voting = votings.get(vid)
+    if not voting or not voting.is_open():
         return status.HTTP_401_UNAUTHORIZED
 
     uid = request.data.get('voter')
@@ -119,45 +153,124 @@ def choices_store(request):
 
     if not vid or not uid or not votes:
         return status.HTTP_400_BAD_REQUEST
+    ciphertexts = [(v.get("a"), v.get("b")) for v in votes]
+    if not voting.accepts(ciphertexts, True, request.data.get('proof')):
+        return status.HTTP_400_BAD_REQUEST
 
     # validating voter
     if request.auth:
         token = request.auth.key
     else:
         token = "NO-AUTH-VOTE"
-    voter = mods.post(
-        'authentication',
-        entry_point='/getuser/',
-        json={
-            'token': token})
-    voter_id = voter.get('id', None)
+    voter_id = get_user(token).get('id', None)
     if not voter_id or voter_id != uid:
         return status.HTTP_401_UNAUTHORIZED
 
     # the user is in the census
-    perms = mods.get(
-        'census/{}'.format(vid),
-        params={
-            'voter_id': uid},
-        response=True)
-    if perms.status_code == 401:
+    if not in_census(vid, uid):
         return status.HTTP_401_UNAUTHORIZED
 
-    vote = Vote.objects.filter(voter_id=uid, voting_id=vid).first()
+    Vote.objects.replace_ballot(vid, uid, ciphertexts)
+
+    return status.HTTP_200_OK
 
-    if vote is not None:
-        Vote.objects.filter(voter_id=uid, voting_id=vid).delete()
 
-    for v in votes:
-        a = v.get("a")
-        b = v.get("b")
+def parse_ballot(ballot, voting_types):
+    """
+    Reads a ballot of a batch, with the same fields as the data of a single vote plus the token of the voter.
 
-        defs = {"a": a, "b": b}
-        voteDB, _ = Vote.objects.get_or_create(
-            voting_id=vid, voter_id=uid, a=a, b=b, defaults=defs)
-        voteDB.a = a
-        voteDB.b = b
+    Args:
+        ballot (dict): The ballot.
+        voting_types (dict): The store function of each voting type.
 
-        voteDB.save()
+    Returns:
+        tuple: (voting, voter, token, ciphertexts, multiple, proof), or None if the ballot is invalid.
+    """
 
-    return status.HTTP_200_OK
+    if not isinstance(ballot, dict):
+        return None
+    voting_type = ballot.get('voting_type')
+    if voting_type not in voting_types:
+        return None
+
+    multiple = voting_types[voting_type] is choices_store
+    vid = ballot.get('voting')
+    uid = ballot.get('voter')
+    token = ballot.get('token')
+    votes = ballot.get('votes') if multiple else [ballot.get('vote')]
+    if not isinstance(vid, int) or not isinstance(uid, int) or not token:
+        return None
+    if not votes or not isinstance(votes, list):
+        return None
+    if not all(isinstance(v, dict) for v in votes):
+        return None
+
+    ciphertexts = [(v.get("a"), v.get("b")) for v in votes]
+    return vid, uid, token, ciphertexts, multiple, ballot.get('proof')
+
+
+def batch_store(ballots, voting_types):
+    """
+    Processes and stores a batch of ballots, of one or more votings, in one transaction.
+
+    Every ballot is validated like a single vote, but with one lookup for all the votings, one for all the
+    tokens and one for the census of each voting, and the accepted ones are written with a single upsert.
+
+    Args:
+        ballots (list): The ballots. Each one is a dict with the same fields as the data of a single vote
+            ('voting', 'voter', 'vote' or 'votes' and 'voting_type') plus the 'token' of the voter.
+        voting_types (dict): The store function of each voting type.
+
+    Returns:
+        list: The HTTP status code of each ballot, in the same order: HTTP_200_OK if it was stored,
+        HTTP_400_BAD_REQUEST if it's invalid or doesn't fit the tally mode of the voting and
+        HTTP_401_UNAUTHORIZED if the voting isn't open, the token isn't the one of the voter or the voter
+        isn't in the census.
+    """
+
+    results = [status.HTTP_400_BAD_REQUEST] * len(ballots)
+    parsed = {}
+    for i, ballot in enumerate(ballots):
+        ballot = parse_ballot(ballot, voting_types)
+        if ballot:
+            parsed[i] = ballot
+
+    # the voting is open
+    open_votings = {}
+    for vid in {b[0] for b in parsed.values()}:
+        voting = votings.get(vid)
+        if voting and voting.is_open():
+            open_votings[vid] = voting
+
+    # the token is the one of the voter
+    users = get_users([b[2] for b in parsed.values()
+                       if b[0] in open_votings])
+
+    # the users are in the census
+    census = {}
+    for i, (vid, uid, token, ciphertexts, multiple, proof) in parsed.items():
+        if vid in open_votings and users.get(token, {}).get('id') == uid:
+            census.setdefault(vid, set()).add(uid)
+    for vid, uids in census.items():
+        census[vid] = census_members(vid, uids)
+
+    classic, choices = [], []
+    for i, (vid, uid, token, ciphertexts, multiple, proof) in parsed.items():
+        if uid not in census.get(vid, ()):
+            results[i] = status.HTTP_401_UNAUTHORIZED
+            continue
+        if not open_votings[vid].accepts(ciphertexts, multiple, proof):
+            continue
+        results[i] = status.HTTP_200_OK
+        if multiple:
+            choices.append((vid, uid, ciphertexts))
+        else:
+            a, b = ciphertexts[0]
+            classic.append(Vote(voting_id=vid, voter_id=uid, a=a, b=b))
+
+    with transaction.atomic():
+        Vote.objects.upsert(classic)
+        if choices:
+            Vote.objects.replace_ballots(choices)
+
+    return results
@@ -1,11 +1,19 @@
+import json
+from itertools import islice
+
+from django.http import StreamingHttpResponse
 from django.utils.dateparse import parse_datetime
 import django_filters.rest_framework
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework import generics
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from django.conf import settings
 
 from .models import Vote
 from .serializers import VoteSerializer
+from base import wire
 from base.perms import UserIsStaff
 from . import utils
 
@@ -15,6 +23,7 @@ VOTING_TYPES = {
     'choices': utils.choices_store,
     'comment': utils.classic_store,
     'classic': utils.classic_store,
+    'homomorphic': utils.choices_store,
 }
 
 
@@ -36,6 +45,8 @@ class StoreView(generics.ListAPIView):
     serializer_class = VoteSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filterset_fields = ('voting_id', 'voter_id')
+    renderer_classes = (list(api_settings.DEFAULT_RENDERER_CLASSES) +
+                        [wire.BatchRenderer])
 
     def get(self, request):
         """
@@ -53,8 +64,59 @@ class StoreView(generics.ListAPIView):
 
         self.permission_classes = (UserIsStaff,)
         self.check_permissions(request)
+        if request.GET.get('export') == 'ndjson':
+            return self.export(request)
         return super().get(request)
 
+    def export(self, request):
+        """
+        Streams the votes as NDJSON, one JSON object per line with the id, voting_id, voter_id, a and b of the
+        vote, in id order. The votes are read from the database in pages while the response is sent, so the
+        memory used doesn't depend on the number of votes.
+
+        When the request accepts the binary format of base.wire, the votes are sent in it instead, with the
+        names of the fields in the meta and one batch of (id, voting_id, voter_id, a, b) items per page.
+
+        Args:
+            request: HttpRequest object. Besides the voting_id and voter_id filters, it can contain 'after',
+                to get only the votes with a greater id (the id of the last vote received, to resume an
+                export), and 'limit', the max number of votes.
+
+        Returns:
+            StreamingHttpResponse with the votes, or a Response with HTTP_400_BAD_REQUEST if a param is invalid.
+        """
+
+        filters = {}
+        try:
+            for field in self.filterset_fields:
+                if request.GET.get(field):
+                    filters[field] = int(request.GET[field])
+            after = int(request.GET.get('after', 0))
+            limit = request.GET.get('limit', None)
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = getattr(settings, 'STORE_EXPORT_CHUNK_SIZE', 5000)
+        votes = Vote.objects.stream(after=after, limit=limit,
+                                    chunk_size=chunk_size, **filters)
+        fields = ('id', 'voting_id', 'voter_id', 'a', 'b')
+        if wire.MEDIA_TYPE in request.META.get('HTTP_ACCEPT', ''):
+            return StreamingHttpResponse(
+                self.batches(fields, votes, chunk_size),
+                content_type=wire.MEDIA_TYPE)
+        lines = (json.dumps(dict(zip(fields, vote))) + '\n' for vote in votes)
+        return StreamingHttpResponse(lines,
+                                     content_type='application/x-ndjson')
+
+    def batches(self, fields, votes, chunk_size):
+        yield wire.pack_meta({'fields': fields})
+        while True:
+            chunk = list(islice(votes, chunk_size))
+            if not chunk:
+                return
+            yield wire.pack_batch(chunk, arity=len(fields))
+
     def post(self, request):
         """
         Handles POST requests to create a new vote based on the voting type.
@@ -74,3 +136,71 @@ class StoreView(generics.ListAPIView):
             return Response({}, status=status.HTTP_400_BAD_REQUEST)
         status_code = VOTING_TYPES[voting_type](request)
         return Response({}, status=status_code)
+
+
+class StoreBatchView(APIView):
+    """
+    API view for storing many ballots, of one or more votings, in a single request.
+
+    It's meant for kiosks and proxies that collect the ballots of many voters before forwarding them, so
+    only staff users can use it and every ballot carries the token of its voter.
+    """
+
+    permission_classes = (UserIsStaff,)
+
+    def post(self, request):
+        """
+        Handles POST requests to store a batch of ballots.
+
+        Args:
+            request: HttpRequest object containing the list of ballots, each one with the data of a single
+                vote plus the token of the voter.
+
+        Returns:
+            Response object with the HTTP status code of each ballot in 'results'.
+
+        Raises:
+            HTTP_400_BAD_REQUEST: If the ballots aren't a list or there are more than STORE_BATCH_MAX_BALLOTS.
+        """
+
+        ballots = request.data.get('ballots')
+        limit = getattr(settings, 'STORE_BATCH_MAX_BALLOTS', 10000)
+        if not isinstance(ballots, list) or len(ballots) > limit:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        results = utils.batch_store(ballots, VOTING_TYPES)
+        return Response({'results': results})
+
+
+class StoreAggregateView(APIView):
+    """
+    API view for the products of the ciphertexts of each option of a voting, read by the homomorphic tally
+    when the store isn't served by the same instance as the voting.
+    """
+
+    permission_classes = (UserIsStaff,)
+
+    def get(self, request):
+        """
+        Handles GET requests to aggregate the votes of a voting, see VoteManager.aggregate.
+
+        Args:
+            request: HttpRequest object with the 'voting_id', the prime 'p' of its key and the number of
+                options in 'size'.
+
+        Returns:
+            Response object with the product of each option in 'msgs' and the number of ballots in 'ballots'.
+
+        Raises:
+            HTTP_400_BAD_REQUEST: If a parameter is missing or isn't a positive integer.
+        """
+
+        try:
+            vid, p, size = (int(request.GET[k])
+                            for k in ('voting_id', 'p', 'size'))
+        except (KeyError, ValueError):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        if vid <= 0 or p <= 1 or size <= 0:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        chunk_size = getattr(settings, 'STORE_EXPORT_CHUNK_SIZE', 5000)
+        msgs, ballots = Vote.objects.aggregate(vid, p, size, chunk_size)
+        return Response({'msgs': msgs, 'ballots': ballots})
@@ -1,20 +1,49 @@
-from django.contrib import admin
-from django.utils import timezone
+from django.contrib import admin, messages
 
 from .models import QuestionOption
 from .models import QuestionOptionRanked
 from .models import Question
 from .models import Voting
+from .models import TallyJob
 from .models import QuestionOptionYesNo
 
+from . import bulk
 from .filters import StartedFilter
 
 
+def run_bulk(modeladmin, request, queryset, action):
+    """
+    Runs an action on the selected votings with the orchestrator of voting.bulk, some of them at the same
+    time, and reports the result of each one.
+
+    :param modeladmin: The current ModelAdmin instance.
+    :type modeladmin: ModelAdmin
+    :param request: The HTTP request triggering this action.
+    :type request: HttpRequest
+    :param queryset: The queryset of selected items.
+    :type queryset: QuerySet
+    :param action: 'start', 'stop' or 'tally'.
+    :type action: str
+    """
+
+    token = request.session.get('auth-token', '')
+    results = bulk.run(action, queryset.all(), token)
+    done = [r for r in results if r['ok']]
+    if done:
+        modeladmin.message_user(request, '{} of {} votings: {}'.format(
+            len(done), len(results), done[0]['msg']))
+    for r in results:
+        if not r['ok']:
+            modeladmin.message_user(
+                request, '{}: {}'.format(r['name'], r['msg']),
+                level=messages.ERROR)
+
+
 def start(modeladmin, request, queryset):
     """
     Admin action to start the voting process for selected items.
 
-    This action sets the start date of each selected voting to the current time.
+    This action creates the public key of each selected voting and sets its start date to the current time.
 
     :param modeladmin: The current ModelAdmin instance.
     :type modeladmin: ModelAdmin
@@ -24,10 +53,7 @@ def start(modeladmin, request, queryset):
     :type queryset: QuerySet
     """
 
-    for v in queryset.all():
-        v.create_pubkey()
-        v.start_date = timezone.now()
-        v.save()
+    run_bulk(modeladmin, request, queryset, 'start')
 
 
 def stop(ModelAdmin, request, queryset):
@@ -44,16 +70,14 @@ def stop(ModelAdmin, request, queryset):
     :type queryset: QuerySet
     """
 
-    for v in queryset.all():
-        v.end_date = timezone.now()
-        v.save()
+    run_bulk(ModelAdmin, request, queryset, 'stop')
 
 
 def tally(ModelAdmin, request, queryset):
     """
     Admin action to tally votes for selected items.
 
-    This action triggers vote tallying for each selected voting that has ended.
+    This action queues a tally job for each selected voting that has ended, see TallyJobAdmin.
 
     :param ModelAdmin: The current ModelAdmin instance.
     :type ModelAdmin: ModelAdmin
@@ -63,9 +87,7 @@ def tally(ModelAdmin, request, queryset):
     :type queryset: QuerySet
     """
 
-    for v in queryset.filter(end_date__lt=timezone.now()):
-        token = request.session.get('auth-token', '')
-        v.tally_votes(token)
+    run_bulk(ModelAdmin, request, queryset, 'tally')
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -116,7 +138,7 @@ class VotingAdmin(admin.ModelAdmin):
 
     list_display = ('name', 'start_date', 'end_date', 'future_stop')
     readonly_fields = ('start_date', 'end_date', 'pub_key',
-                       'tally', 'postproc')
+                       'tally', 'postproc', 'tally_timings')
     date_hierarchy = 'start_date'
     list_filter = (StartedFilter,)
     search_fields = ('name', )
@@ -124,7 +146,25 @@ class VotingAdmin(admin.ModelAdmin):
     actions = [start, stop, tally]
 
 
+class TallyJobAdmin(admin.ModelAdmin):
+    """
+    Admin interface for following the tally jobs.
+
+    Attributes:
+        list_display: Fields to be displayed in the list view.
+        list_filter: Filters to apply in the list view.
+        readonly_fields: Fields that are read-only in the admin interface.
+    """
+
+    list_display = ('voting', 'status', 'stage', 'processed', 'total',
+                    'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('voting', 'status', 'stage', 'processed', 'total',
+                       'error', 'started_at', 'finished_at')
+
+
 admin.site.register(Voting, VotingAdmin)
+admin.site.register(TallyJob, TallyJobAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(QuestionOption)
 admin.site.register(QuestionOptionRanked, QuestionOptionRankedAdmin)
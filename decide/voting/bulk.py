@@ -0,0 +1,122 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from base import mods
+
+
+logger = logging.getLogger(__name__)
+
+
+def start(voting, token=''):
+    """
+    Starts a voting, creating its public key with the mixnet.
+
+    :param voting: The voting.
+    :type voting: Voting
+    :param token: Not used, all the actions take it.
+    :type token: str
+    :return: If it was started, and a message.
+    :rtype: tuple
+    """
+
+    if voting.start_date:
+        return False, 'Voting already started'
+    voting.create_pubkey()
+    voting.start_date = timezone.now()
+    voting.save()
+    return True, 'Voting started'
+
+
+def stop(voting, token=''):
+    """
+    Stops a voting that is started.
+
+    :param voting: The voting.
+    :type voting: Voting
+    :param token: Not used, all the actions take it.
+    :type token: str
+    :return: If it was stopped, and a message.
+    :rtype: tuple
+    """
+
+    if not voting.start_date:
+        return False, 'Voting is not started'
+    if voting.end_date:
+        return False, 'Voting already stopped'
+    voting.end_date = timezone.now()
+    voting.save()
+    return True, 'Voting stopped'
+
+
+def tally(voting, token=''):
+    """
+    Queues the tally of a voting that is stopped, see Voting.enqueue_tally.
+
+    :param voting: The voting.
+    :type voting: Voting
+    :param token: Authorization token to read the votes.
+    :type token: str
+    :return: If the tally was queued, and a message.
+    :rtype: tuple
+    """
+
+    if not voting.start_date:
+        return False, 'Voting is not started'
+    if not voting.end_date or voting.end_date > timezone.now():
+        return False, 'Voting is not stopped'
+    if voting.tally is not None:
+        return False, 'Voting already tallied'
+    job = voting.enqueue_tally(token)
+    if not job:
+        return False, 'Voting tally in progress'
+    return True, 'Tally job {} {}'.format(job.id, job.status)
+
+
+ACTIONS = {'start': start, 'stop': stop, 'tally': tally}
+
+
+def run(action, votings, token='', concurrency=None):
+    """
+    Runs an action (start, stop or tally) on some votings, up to concurrency of them at the same time in
+    threads, and reports the result of each one. An error in one voting doesn't stop the others.
+
+    The votings are processed one at a time inside a transaction, like in the tests, as the threads
+    wouldn't see its changes.
+
+    :param action: 'start', 'stop' or 'tally'.
+    :type action: str
+    :param votings: The votings.
+    :type votings: iterable
+    :param token: Authorization token of the user, used by the tally.
+    :type token: str
+    :param concurrency: Max votings processed at the same time, VOTING_BULK_CONCURRENCY by default.
+    :type concurrency: int, optional
+    :return: A dict for every voting, in the same order, with its "id", "name", "ok" and "msg".
+    :rtype: list
+    """
+
+    if action not in ACTIONS:
+        raise ValueError('Action not found, try with {}'.format(
+            ', '.join(ACTIONS)))
+    func = ACTIONS[action]
+    if concurrency is None:
+        concurrency = getattr(settings, 'VOTING_BULK_CONCURRENCY', 4)
+    if connection.in_atomic_block:
+        concurrency = 1
+
+    def process(voting):
+        try:
+            ok, msg = func(voting, token)
+        except Exception as e:
+            logger.exception('%s of voting %s failed', action, voting.id)
+            ok, msg = False, str(e) or type(e).__name__
+        finally:
+            if concurrency > 1:
+                # every thread has its own connection
+                connection.close()
+        return {'id': voting.id, 'name': voting.name, 'ok': ok, 'msg': msg}
+
+    return list(mods.pipeline(process, ((v,) for v in votings), concurrency))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from voting import bulk
+from voting.models import Voting
+
+
+class Command(BaseCommand):
+    help = ('Starts, stops or tallies some votings, several of them at the '
+            'same time, and shows the result of each one')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=sorted(bulk.ACTIONS))
+        parser.add_argument('ids', type=int, nargs='*',
+                            help='ids of the votings')
+        parser.add_argument('--all', action='store_true',
+                            help='every voting, instead of the ids')
+        parser.add_argument('--concurrency', type=int,
+                            help='votings processed at the same time, '
+                                 'VOTING_BULK_CONCURRENCY by default')
+        parser.add_argument('--token', default='',
+                            help='authorization token of a staff user, to '
+                                 'read the votes of the tally when the '
+                                 'store is remote')
+
+    def handle(self, *args, **options):
+        if options['all'] == bool(options['ids']):
+            raise CommandError('Give the ids of the votings or --all')
+
+        votings = Voting.objects.order_by('id')
+        if not options['all']:
+            votings = votings.filter(id__in=options['ids'])
+            missing = set(options['ids']) - {v.id for v in votings}
+            if missing:
+                raise CommandError('Votings not found: {}'.format(
+                    ', '.join(str(i) for i in sorted(missing))))
+
+        results = bulk.run(options['action'], votings, options['token'],
+                           options['concurrency'])
+        for r in results:
+            style = self.style.SUCCESS if r['ok'] else self.style.ERROR
+            self.stdout.write(style('{:>6} {:<30} {}'.format(
+                r['id'], r['name'][:30], r['msg'])))
+
+        failed = len([r for r in results if not r['ok']])
+        if failed:
+            raise CommandError('{} of {} votings failed'.format(
+                failed, len(results)))
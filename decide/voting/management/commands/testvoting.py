@@ -9,8 +9,7 @@ from django.utils import timezone
 from base import mods
 from base.models import Auth
 from census.models import Census
-from mixnet.mixcrypt import MixCrypt
-from mixnet.mixcrypt import ElGamal
+from mixnet.mixcrypt import encrypt
 from voting.models import Voting, Question, QuestionOption
 
 
@@ -19,10 +18,8 @@ class Command(BaseCommand):
 
     def encrypt_msg(self, msg, v, bits=settings.KEYBITS):
         pk = v.pub_key
-        p, g, y = (pk.p, pk.g, pk.y)
-        k = MixCrypt(bits=bits)
-        k.k = ElGamal.construct((p, g, y))
-        return k.encrypt(msg)
+        # the tables of the key are built with the first vote
+        return encrypt(msg, (pk.p, pk.g, pk.y))
 
     def create_voting(self):
         q = Question(desc='test question')
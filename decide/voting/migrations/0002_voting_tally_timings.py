@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='tally_timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
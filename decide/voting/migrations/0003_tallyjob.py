@@ -0,0 +1,39 @@
+# Generated by Django 4.1 on 2026-10-17 02:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0002_voting_tally_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallyJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('status', models.CharField(
+                    choices=[('queued', 'Queued'), ('running', 'Running'),
+                             ('done', 'Done'), ('failed', 'Failed')],
+                    default='queued', max_length=10)),
+                ('stage', models.CharField(blank=True, default='',
+                                           max_length=10)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('voting', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='tally_jobs', to='voting.voting')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
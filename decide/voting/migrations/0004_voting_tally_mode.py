@@ -0,0 +1,22 @@
+# Generated by Django 4.1 on 2026-10-17 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0003_tallyjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='tally_mode',
+            field=models.CharField(
+                choices=[('mixnet', 'Shuffle and decrypt every vote'),
+                         ('homomorphic',
+                          'Decrypt the sum of the votes of each option')],
+                default='mixnet', max_length=16),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0004_voting_tally_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tallyjob',
+            name='updated_at',
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
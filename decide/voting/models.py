@@ -1,12 +1,23 @@
 import binascii
-from django.db import models
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
 from django.db.models import JSONField
+from django.utils import timezone
 
 from base import mods
 from base.models import Auth, Key
+from mixnet.mixcrypt import dlogs
 import json
 
 
+logger = logging.getLogger(__name__)
+
+
 class Question(models.Model):
     """
     Represents a question in a voting system.
@@ -198,6 +209,11 @@ class Voting(models.Model):
         auths (ManyToManyField): The authorizations related to this voting.
         tally (JSONField): The tally of votes.
         postproc (JSONField): The post-processing data of the voting.
+        tally_timings (JSONField): The number of votes and chunks of the last tally and the seconds spent in
+            each stage of it.
+        TALLY_MODES (list): The ways to tally the votes.
+        tally_mode (CharField): How the votes are tallied, chosen from TALLY_MODES. The homomorphic tally
+            is only for classic and yes/no questions, see tally_homomorphic.
     """
 
     name = models.CharField(max_length=200)
@@ -221,6 +237,45 @@ class Voting(models.Model):
 
     tally = JSONField(blank=True, null=True)
     postproc = JSONField(blank=True, null=True)
+    tally_timings = JSONField(blank=True, null=True)
+
+    MIXNET = 'mixnet'
+    HOMOMORPHIC = 'homomorphic'
+    TALLY_MODES = [
+        (MIXNET, 'Shuffle and decrypt every vote'),
+        (HOMOMORPHIC, 'Decrypt the sum of the votes of each option'),
+    ]
+    tally_mode = models.CharField(max_length=16, choices=TALLY_MODES,
+                                  default=MIXNET)
+
+    def clean(self):
+        """
+        Checks that the homomorphic tally is only used with classic and yes/no questions.
+
+        :raises ValidationError: If the question can't be tallied homomorphically.
+        """
+
+        if (self.tally_mode == self.HOMOMORPHIC and self.question_id
+                and self.question.type not in ('C', 'Y')):
+            raise ValidationError({
+                'tally_mode': 'The homomorphic tally is only for classic '
+                              'and yes/no questions'})
+
+    def option_numbers(self):
+        """
+        Returns the numbers of the options of the question, in the order of the ciphertexts of the ballots of
+        the homomorphic tally, by number and then by creation.
+
+        :return: The numbers of the options.
+        :rtype: list
+        """
+
+        if self.question.type == 'Y':
+            options = self.question.yesno_options
+        else:
+            options = self.question.options
+        options = options.order_by('number', 'id')
+        return list(options.values_list('number', flat=True))
 
     def create_pubkey(self):
         """
@@ -248,35 +303,154 @@ class Voting(models.Model):
         :rtype: list
         """
 
-        # gettings votes from store
-        votes = mods.get(
+        # gettings votes from store, streamed as NDJSON
+        votes = mods.stream(
             'store',
             params={
-                'voting_id': self.id},
+                'voting_id': self.id,
+                'export': 'ndjson'},
             HTTP_AUTHORIZATION='Token ' +
             token)
         # anon votes
-        votes_format = []
-        vote_list = []
+        return [[vote['a'], vote['b']] for vote in votes]
+
+    def get_vote_chunks(self, token='', size=None):
+        """
+        Retrieves the votes for the voting in chunks, reading them from the store while they are consumed.
+
+        The votes are read straight from the database when the store module runs in this process, and
+        streamed from the store otherwise. Every chunk has between size and 2 * size - 1 votes, the last
+        votes are added to the previous chunk instead of making a small one, except when there are less
+        than size votes in total. Without a size all the votes are in one chunk.
+
+        :param token: Authorization token for retrieving votes.
+        :type token: str
+        :param size: Number of votes of each chunk, TALLY_CHUNK_SIZE by default.
+        :type size: int, optional
+        :return: A generator of lists of formatted votes.
+        :rtype: generator
+        """
+
+        size = size or getattr(settings, 'TALLY_CHUNK_SIZE', None)
+        if mods.is_local('store'):
+            from store.models import Vote
+            chunk_size = getattr(settings, 'STORE_EXPORT_CHUNK_SIZE', 5000)
+            votes = Vote.objects.stream(voting_id=self.id,
+                                        chunk_size=size or chunk_size)
+            votes = ([a, b] for id, voting_id, voter_id, a, b in votes)
+        else:
+            votes = mods.stream(
+                'store',
+                params={
+                    'voting_id': self.id,
+                    'export': 'ndjson'},
+                HTTP_AUTHORIZATION='Token ' +
+                token,
+                binary=getattr(settings, 'MODS_BINARY_WIRE', False))
+            votes = ([vote['a'], vote['b']] for vote in votes)
+
+        previous, chunk = None, []
         for vote in votes:
-            for info in vote:
-                if info == 'a':
-                    votes_format.append(vote[info])
-                if info == 'b':
-                    votes_format.append(vote[info])
-            vote_list.append(votes_format)
-            votes_format = []
-        return vote_list
+            chunk.append(vote)
+            if size and len(chunk) == size:
+                if previous:
+                    yield previous
+                previous, chunk = chunk, []
+        if previous:
+            yield previous + chunk
+        elif chunk:
+            yield chunk
+
+    def pending_tally(self):
+        """
+        Gets the tally job of the voting that is queued or running, if any.
+
+        The jobs without news from their worker for TALLY_JOB_TIMEOUT seconds, like the ones of a worker that
+        died, are failed first, so the voting can be tallied again.
+
+        :return: The job or None.
+        :rtype: TallyJob
+        """
+
+        pending = self.tally_jobs.filter(
+            status__in=(TallyJob.QUEUED, TallyJob.RUNNING))
+        timeout = getattr(settings, 'TALLY_JOB_TIMEOUT', 600)
+        pending.filter(
+            updated_at__lt=timezone.now() - timedelta(seconds=timeout)).update(
+            status=TallyJob.FAILED, finished_at=timezone.now(),
+            error='No news from the worker in {} seconds'.format(timeout))
+        return pending.last()
+
+    def enqueue_tally(self, token=''):
+        """
+        Creates a tally job for the voting and sends it to the celery workers, see voting.tasks.tally_task. The
+        job is run right away in this process when TALLY_EAGER is set, for the tests and the deployments
+        without workers.
+
+        The token is only used by the eager jobs. It isn't sent to the workers, as it would be kept in the
+        broker and the result backend, they read the votes with their TALLY_SERVICE_TOKEN.
+
+        :param token: Authorization token for tallying votes.
+        :type token: str
+        :return: The job, or None if the voting has a tally job queued or running already.
+        :rtype: TallyJob
+        """
+
+        from .tasks import tally_task
+
+        with transaction.atomic():
+            Voting.objects.select_for_update().get(pk=self.pk)
+            if self.pending_tally():
+                return None
+            total = None
+            if mods.is_local('store'):
+                from store.models import Vote
+                votes = Vote.objects.filter(voting_id=self.id)
+                if self.tally_mode == self.HOMOMORPHIC:
+                    # one vote per option and ballot
+                    votes = votes.filter(position=0)
+                total = votes.count()
+            job = TallyJob.objects.create(voting=self, total=total)
+
+        if getattr(settings, 'TALLY_EAGER', False):
+            tally_task.apply(args=[job.id, token])
+            job.refresh_from_db()
+        else:
+            tally_task.apply_async(args=[job.id])
+        return job
 
-    def tally_votes(self, token=''):
+    def tally_votes(self, token='', progress=None):
         """
         Tally votes for the voting.
 
+        By default all the votes are shuffled and decrypted together. With TALLY_CHUNK_SIZE they're read,
+        shuffled and decrypted in chunks of that many votes (see get_vote_chunks), so the memory used doesn't
+        depend on the number of votes, but each chunk is shuffled on its own, so the chunk size is the number
+        of voters each vote is mixed with. The decrypted votes are sorted before saving them, so the tally
+        doesn't tell which chunk, and so which period of the voting, each vote came from. The seconds spent
+        in each stage are saved in tally_timings.
+
+        Up to MIXNET_CHAIN_WINDOW chunks are in flight along the chain of authorities at the same time, so
+        while an authority shuffles or decrypts a chunk the previous one is processed by the next authority
+        and the next one is being read. Every authority must acknowledge each chunk with its number and its
+        count of messages, or the tally fails with a ValueError and nothing is saved. With a window above 1
+        the stages overlap, so their timings add up to more than the total.
+
+        The authorities checkpoint their output of every chunk (see mixnet.models.Checkpoint), so when a tally
+        that failed is retried, the chunks and stages already processed are answered without shuffling or
+        decrypting them again, as long as the votes are the same.
+
+        The votings with the homomorphic tally mode are tallied with tally_homomorphic instead.
+
         :param token: Authorization token for tallying votes.
         :type token: str
+        :param progress: Called with the stage, 'mixnet' or 'postproc', and the number of votes decrypted,
+            after every chunk and before the postproc.
+        :type progress: callable
         """
 
-        votes = self.get_votes(token)
+        if self.tally_mode == self.HOMOMORPHIC:
+            return self.tally_homomorphic(token, progress)
 
         auth = self.auths.first()
         shuffle_url = "/shuffle/{}/".format(self.id)
@@ -284,30 +458,60 @@ class Voting(models.Model):
         decrypt_aes_url = "/decrypt_aes/{}/".format(self.id)
         auths = [{"name": a.name, "url": a.url} for a in self.auths.all()]
 
-        # first, we do the shuffle
-        data = {"msgs": votes}
-        response = mods.post(
-            'mixnet',
-            entry_point=shuffle_url,
-            baseurl=auth.url,
-            json=data,
-            response=True)
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
-
-        # then, we can decrypt that
-        data = {"msgs": response.json()}
-        response = mods.post(
-            'mixnet',
-            entry_point=decrypt_url,
-            baseurl=auth.url,
-            json=data,
-            response=True)
-
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
+        timings = {'votes': 0, 'chunks': 0, 'read': 0.0, 'shuffle': 0.0,
+                   'decrypt': 0.0}
+        started = time.perf_counter()
+        lock = threading.Lock()
+
+        def timed(stage, f, *args, **kwargs):
+            start = time.perf_counter()
+            result = f(*args, **kwargs)
+            with lock:
+                timings[stage] += time.perf_counter() - start
+            return result
+
+        def read():
+            chunks = self.get_vote_chunks(token)
+            while True:
+                votes = timed('read', next, chunks, None)
+                if votes is None:
+                    break
+                timings['votes'] += len(votes)
+                timings['chunks'] += 1
+                yield timings['chunks'], votes
+
+        binary = getattr(settings, 'MODS_BINARY_WIRE', False)
+
+        def post(stage, url, seq, msgs):
+            response = timed(stage, mods.post, 'mixnet', entry_point=url,
+                             baseurl=auth.url, json={"seq": seq, "msgs": msgs},
+                             response=True, binary=binary)
+            try:
+                data = mods.read_body(response)
+            except ValueError:
+                data = None
+            return mods.read_chunk(data, seq, len(msgs))
+
+        def mix(seq, votes):
+            # first, we do the shuffle, then, we can decrypt that
+            return post('decrypt', decrypt_url, seq,
+                        post('shuffle', shuffle_url, seq, votes))
+
+        # the in-process views can't run in other threads, they wouldn't see
+        # the transaction of the request
+        window = 1
+        if not mods.is_local('mixnet', auth.url):
+            window = getattr(settings, 'MIXNET_CHAIN_WINDOW', 2)
+
+        msgs = []
+        for clear in mods.pipeline(mix, read(), window):
+            msgs.extend(clear)
+            if progress:
+                progress('mixnet', len(msgs))
+        if progress:
+            progress('postproc', len(msgs))
+        # the order of the chunks is the order the votes arrived
+        msgs.sort()
 
         def decimal_to_ascii(decimal_string):
             """
@@ -340,21 +544,123 @@ class Voting(models.Model):
                 return "Invalid decimal string"
 
         if self.question.type == 'R':
-            data = {"msgs": response.json()}
+            data = {"msgs": msgs}
             for key, values in data.items():
                 data[key] = [decimal_to_ascii(value) for value in values]
             self.tally = data
-            self.save()
         elif self.question.type == 'T':
-            data = {"msgs": response.json()}
+            data = {"msgs": msgs}
             for key, values in data.items():
                 data[key] = [decimal_to_ascii(v) for v in values]
             self.tally = data
-            self.save()
         else:
-            self.tally = response.json()
-            self.save()
+            self.tally = msgs
+        timings['postproc'] = 0.0
+        self.tally_timings = timings
+        # saves the tally too
+        timed('postproc', self.do_postproc)
+
+        timings['total'] = time.perf_counter() - started
+        self.save(update_fields=['tally_timings'])
+        self.purge_checkpoints(token)
+
+    def tally_homomorphic(self, token='', progress=None):
+        """
+        Tallies the votes of a voting with the homomorphic tally mode, decrypting one ciphertext per option.
+
+        Every ballot has the exponential ElGamal encryption of 1 (g^1) for the option voted and of 0 for the
+        rest, in the order of option_numbers. The store multiplies the ciphertexts of each option of all the
+        ballots (see store.models.VoteManager.aggregate), which gives the encryption of g^votes. The mixnet
+        decrypts the aggregates without shuffling them, and the votes are found with the baby-step giant-step
+        discrete logs of mixnet.mixcrypt.dlogs, up to the number of ballots.
+
+        A ciphertext of g^k or g^-1 would change the counts without being noticed, unlike a malformed vote of
+        the mixnet tally, which is decrypted to an invalid option. So the store only accepts the ballots
+        with the proofs that their ciphertexts are the ones of 0 or 1 and add up to 1 (see
+        store.cache.VotingMeta.accepts), and the tally fails if the counts don't add up to the ballots.
+
+        The tally is {"ballots": int, "options": [{"number": int, "votes": int}]}.
+
+        :param token: Authorization token for reading the aggregates from the store.
+        :type token: str
+        :param progress: Called with 'postproc' and the number of ballots before the postproc.
+        :type progress: callable
+        :raises ValueError: If the counts aren't between 0 and the number of ballots or don't add up to it.
+        """
+
+        numbers = self.option_numbers()
+        timings = {'votes': 0, 'chunks': 0, 'read': 0.0, 'decrypt': 0.0}
+        started = time.perf_counter()
+
+        p = int(self.pub_key.p) if self.pub_key else 0
+        if mods.is_local('store'):
+            from store.models import Vote
+            msgs, ballots = Vote.objects.aggregate(self.id, p, len(numbers))
+        else:
+            aggregate = mods.get(
+                'store/aggregate',
+                params={
+                    'voting_id': self.id,
+                    'p': p,
+                    'size': len(numbers)},
+                HTTP_AUTHORIZATION='Token ' +
+                token)
+            msgs, ballots = aggregate['msgs'], aggregate['ballots']
+        timings['read'] = time.perf_counter() - started
+        timings['votes'] = ballots
+
+        counts = [0] * len(numbers)
+        if ballots:
+            start = time.perf_counter()
+            auth = self.auths.first()
+            data = mods.post('mixnet',
+                             entry_point='/decrypt/{}/'.format(self.id),
+                             baseurl=auth.url,
+                             json={'seq': 0, 'msgs': msgs, 'shuffle': False})
+            clear = mods.read_chunk(data, 0, len(numbers))
+            g = int(self.pub_key.g)
+            counts = dlogs(clear, g, p, ballots)
+            if sum(counts) != ballots:
+                raise ValueError(
+                    'The votes of the options add up to {}, there are {} '
+                    'ballots'.format(sum(counts), ballots))
+            timings['chunks'] = 1
+            timings['decrypt'] = time.perf_counter() - start
+        if progress:
+            progress('postproc', ballots)
+
+        self.tally = {'ballots': ballots, 'options': [
+            {'number': n, 'votes': c} for n, c in zip(numbers, counts)]}
+        start = time.perf_counter()
         self.do_postproc()
+        timings['postproc'] = time.perf_counter() - start
+        timings['total'] = time.perf_counter() - started
+        self.tally_timings = timings
+        self.save(update_fields=['tally_timings'])
+        self.purge_checkpoints(token)
+
+    def purge_checkpoints(self, token):
+        """
+        Asks the authorities to delete their checkpoints of the voting once its tally is saved, as they're
+        only needed to resume a failed tally, and they keep the intermediate shuffles of the votes. An error
+        is only logged, the tally is already saved.
+
+        :param token: Authorization token of a staff user, the one of the tally.
+        :type token: str
+        """
+
+        auth = self.auths.first()
+        try:
+            response = mods.post('mixnet',
+                                 entry_point='/purge/{}/'.format(self.id),
+                                 baseurl=auth.url, json={}, response=True,
+                                 HTTP_AUTHORIZATION='Token ' + token)
+            if response.status_code != 200:
+                logger.warning('Purging the checkpoints of voting %s failed: '
+                               '%s', self.id, response.status_code)
+        except Exception:
+            logger.exception('Purging the checkpoints of voting %s failed',
+                             self.id)
 
     def do_postproc(self):
         """
@@ -364,12 +670,17 @@ class Voting(models.Model):
         tally = self.tally
         options = self.question.options.all()
 
+        def count(number):
+            if self.tally_mode == self.HOMOMORPHIC:
+                return sum(o['votes'] for o in tally['options']
+                           if o['number'] == number)
+            if isinstance(tally, list):
+                return tally.count(number)
+            return 0
+
         opts = []
         for opt in options:
-            if isinstance(tally, list):
-                votes = tally.count(opt.number)
-            else:
-                votes = 0
+            votes = count(opt.number)
             opts.append({
                 'option': opt.option,
                 'number': opt.number,
@@ -403,10 +714,7 @@ class Voting(models.Model):
         elif self.question.type == 'Y':
             yesno_options = self.question.yesno_options.all()
             for opt in yesno_options:
-                if isinstance(tally, list):
-                    votes = tally.count(opt.number)
-                else:
-                    votes = 0
+                votes = count(opt.number)
                 opts.append({
                     'option': opt.option,
                     'number': opt.number,
@@ -438,3 +746,135 @@ class Voting(models.Model):
         :rtype: str
         """
         return self.name
+
+
+class TallyJob(models.Model):
+    """
+    Represents a tally of a voting run in background by a celery worker, and its progress.
+
+    Attributes:
+        voting (ForeignKey): The voting tallied.
+        status (CharField): queued, running, done or failed.
+        stage (CharField): The stage running, mixnet while the votes are shuffled and decrypted, then postproc.
+        processed (PositiveIntegerField): The number of votes shuffled and decrypted.
+        total (PositiveIntegerField): The number of votes of the voting, null if the store isn't served by
+            this instance.
+        error (TextField): The error of a failed tally.
+        created_at (DateTimeField): When the job was queued.
+        updated_at (DateTimeField): The last news from the worker, that saves it every TALLY_HEARTBEAT
+            seconds while it runs the job.
+        started_at (DateTimeField): When a worker started it.
+        finished_at (DateTimeField): When it ended, successfully or not.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    voting = models.ForeignKey(
+        Voting, related_name='tally_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    stage = models.CharField(max_length=10, blank=True, default='')
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('id',)
+
+    def update(self, **fields):
+        """
+        Saves some fields of the job, and its updated_at, without overwriting the rest of them.
+        """
+
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save(update_fields=list(fields) + ['updated_at'])
+
+    def heartbeat(self, stop):
+        """
+        Saves the updated_at of the job every TALLY_HEARTBEAT seconds until stop is set, from a thread, so
+        pending_tally knows the worker is alive while a stage takes long.
+
+        :param stop: Set when the job ends.
+        :type stop: threading.Event
+        """
+
+        interval = getattr(settings, 'TALLY_HEARTBEAT', 30)
+        try:
+            while not stop.wait(interval):
+                TallyJob.objects.filter(id=self.id).update(
+                    updated_at=timezone.now())
+        finally:
+            # the thread has its own connection
+            connection.close()
+
+    def progress(self, stage, processed):
+        self.update(stage=stage, processed=processed)
+
+    def run(self, token=''):
+        """
+        Tallies the voting, saving the progress of the job. An error fails the job instead of being raised.
+
+        Only a queued job is run, not one that was failed by pending_tally after waiting too long or that
+        another worker took.
+
+        :param token: Authorization token for tallying votes.
+        :type token: str
+        """
+
+        now = timezone.now()
+        queued = TallyJob.objects.filter(id=self.id, status=self.QUEUED)
+        taken = queued.update(status=self.RUNNING, stage='mixnet',
+                              started_at=now, updated_at=now)
+        self.refresh_from_db()
+        if not taken:
+            return
+
+        stop = threading.Event()
+        # a thread doesn't see the job inside a transaction, like in the tests
+        if not connection.in_atomic_block:
+            threading.Thread(target=self.heartbeat, args=(stop,),
+                             daemon=True).start()
+        try:
+            self.voting.tally_votes(token, progress=self.progress)
+        except Exception as e:
+            logger.exception('Tally job %s of voting %s failed', self.id,
+                             self.voting_id)
+            self.update(status=self.FAILED, error=str(e),
+                        finished_at=timezone.now())
+        else:
+            self.update(status=self.DONE, finished_at=timezone.now())
+        finally:
+            stop.set()
+
+    def eta(self):
+        """
+        Estimates the seconds left to shuffle and decrypt the votes, from the pace of the ones processed.
+
+        :return: The seconds, 0 once the votes are decrypted, or None if they can't be estimated yet.
+        :rtype: float
+        """
+
+        if self.status == self.DONE or self.stage == 'postproc':
+            return 0.0
+        if (self.status != self.RUNNING or not self.processed or
+                self.total is None or not self.started_at):
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        left = max(self.total - self.processed, 0)
+        return elapsed / self.processed * left
+
+    def __str__(self):
+        return 'Tally of {}: {}'.format(self.voting_id, self.status)
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Question, QuestionOption, QuestionOptionRanked, Voting, QuestionOptionYesNo
+from .models import Question, QuestionOption, QuestionOptionRanked, Voting, QuestionOptionYesNo, TallyJob
 from base.serializers import KeySerializer, AuthSerializer
 
 
@@ -153,7 +153,8 @@ class VotingSerializer(serializers.HyperlinkedModelSerializer):
             'pub_key',
             'auths',
             'tally',
-            'postproc')
+            'postproc',
+            'tally_mode')
 
 
 class SimpleVotingSerializer(serializers.HyperlinkedModelSerializer):
@@ -184,3 +185,41 @@ class SimpleVotingSerializer(serializers.HyperlinkedModelSerializer):
             'start_date',
             'end_date',
             'future_stop')
+
+
+class TallyJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for TallyJob model.
+
+    Provides the status and the progress of a tally job, with the estimated seconds left.
+
+    Attributes:
+        eta (SerializerMethodField): Seconds left to decrypt the votes, or null if unknown.
+        Meta: Meta class with model and field specifications.
+    """
+
+    eta = serializers.SerializerMethodField()
+
+    class Meta:
+        """
+        Meta class for TallyJobSerializer.
+
+        Specifies the model and fields to be serialized.
+        """
+
+        model = TallyJob
+        fields = (
+            'id',
+            'voting',
+            'status',
+            'stage',
+            'processed',
+            'total',
+            'eta',
+            'error',
+            'created_at',
+            'started_at',
+            'finished_at')
+
+    def get_eta(self, job):
+        return job.eta()
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
+from base.channels import publish_on_commit
 from .models import Voting
 from .utils import future_stop_task_manager
 
@@ -26,3 +27,24 @@ def future_stop_add_task(sender, created, instance, **kwargs):
     """
     instance.created_at = timezone.now()
     future_stop_task_manager(instance.id)
+
+
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+def invalidate_voting_caches(sender, instance, **kwargs):
+    """
+    A Django signal receiver that notifies every process that a Voting has changed.
+
+    The ID of the voting is published in the 'voting' topic of the channel, so the caches of the voting
+    metadata, like the one used by the store to validate the votes, drop their copy of it. It's published
+    to the other processes once the change is committed, or they could load the old voting again.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Voting): The instance of the Voting model that was saved or deleted.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    publish_on_commit('voting', instance.id, local=True)
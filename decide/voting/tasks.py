@@ -1,6 +1,7 @@
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
-from .models import Voting
+from .models import TallyJob, Voting
 from decide.celery import app
 
 
@@ -29,3 +30,26 @@ def future_stop_voting_task(voting_id, created_at):
     app.control.revoke(
         f'future_stop_voting_task-{voting_id}-{created_at}',
         terminate=True)
+
+
+@shared_task()
+def tally_task(job_id, token=''):
+    """
+    A Celery task to tally a voting in background, saving its progress in a TallyJob.
+
+    The shuffle, the decryption and the postproc of the votes run in the worker instead of in the request
+    that asked for the tally, which only queues the job, see Voting.enqueue_tally. The queued jobs don't
+    carry a token, the worker reads the votes from the store with TALLY_SERVICE_TOKEN.
+
+    Args:
+        job_id (int): The ID of the TallyJob.
+        token (str): The authorization token used to read the votes from the store, only given to the
+            jobs run in the process that queues them.
+
+    Returns:
+        str: The final status of the job.
+    """
+
+    job = TallyJob.objects.select_related('voting').get(id=job_id)
+    job.run(token or getattr(settings, 'TALLY_SERVICE_TOKEN', ''))
+    return job.status
@@ -1,12 +1,18 @@
 from datetime import timedelta, datetime
 import random
 import itertools
+import threading
 import time
+from io import StringIO
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+from unittest import mock
 from nose.tools import nottest
 
 from selenium import webdriver
@@ -17,9 +23,12 @@ from base.tests import BaseTestCase
 from census.models import Census
 from mixnet.mixcrypt import ElGamal
 from mixnet.mixcrypt import MixCrypt
-from mixnet.models import Auth
-from voting.models import Voting, Question, QuestionOption, QuestionOptionRanked, QuestionOptionYesNo
+from mixnet.mixcrypt import encrypt_exponent, prove_ballot
+from mixnet.models import Auth, Checkpoint, Mixnet
+from store.models import Vote
+from voting.models import Voting, Question, QuestionOption, QuestionOptionRanked, QuestionOptionYesNo, TallyJob
 
+from . import bulk
 from .tasks import future_stop_voting_task
 
 
@@ -560,6 +569,397 @@ class VotingTestCase(BaseTestCase):
         for q in v.postproc:
             self.assertEqual(tally.get(q["number"], 0), q["votes"])
 
+    def store_homomorphic_votes(self, v):
+        """
+        Stores mock ballots for a voting with the homomorphic tally, with the encryption of 1 for the option
+        voted and of 0 for the rest and their proofs.
+
+        :param v: The voting instance.
+        :type v: Voting
+        :return: A dictionary of the clear votes count.
+        :rtype: dict
+        """
+
+        pk = v.pub_key
+        pubkey = (int(pk.p), int(pk.g), int(pk.y))
+        numbers = v.option_numbers()
+        clear = {n: 0 for n in numbers}
+        for voter in Census.objects.filter(voting_id=v.id)[:12]:
+            chosen = random.randrange(len(numbers))
+            clear[numbers[chosen]] += 1
+            votes, proof = prove_ballot(chosen, len(numbers), pubkey)
+            data = {
+                'voting': v.id,
+                'voter': voter.voter_id,
+                'voting_type': 'homomorphic',
+                'votes': [{'a': a, 'b': b} for a, b in votes],
+                'proof': proof,
+            }
+            user = self.get_or_create_user(voter.voter_id)
+            self.login(user=user.username)
+            mods.post('store', json=data)
+        return clear
+
+    def test_homomorphic_tally(self):
+        """
+        Test method to verify the homomorphic tally of classic and Yes/No votings, that decrypts one
+        ciphertext per option.
+        """
+
+        for create in (self.create_classic_voting, self.create_yesno_voting):
+            v = create()
+            v.tally_mode = Voting.HOMOMORPHIC
+            v.save()
+            self.create_voters(v)
+
+            v.create_pubkey()
+            v.start_date = timezone.now()
+            v.save()
+
+            clear = self.store_homomorphic_votes(v)
+            self.assertEqual(Vote.objects.filter(voting_id=v.id).count(),
+                             12 * len(v.option_numbers()))
+
+            self.login()
+            v.tally_votes(self.token)
+
+            self.assertEqual(v.tally['ballots'], 12)
+            tally = dict.fromkeys(clear, 0)
+            for o in v.tally['options']:
+                tally[o['number']] += o['votes']
+            self.assertEqual(tally, clear)
+            self.assertEqual({o['number']: o['votes'] for o in v.postproc},
+                             clear)
+            self.assertEqual(v.tally_timings['chunks'], 1)
+
+    def test_homomorphic_tally_forged(self):
+        """
+        Test method to verify that the homomorphic tally fails when the counts don't add up to the ballots,
+        like with a ballot without proofs that votes twice.
+        """
+
+        v = self.create_classic_voting()
+        v.tally_mode = Voting.HOMOMORPHIC
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        pk = v.pub_key
+        pubkey = (int(pk.p), int(pk.g), int(pk.y))
+        size = len(v.option_numbers())
+        Vote.objects.replace_ballot(v.id, 1, [
+            encrypt_exponent(int(i == 0), pubkey) for i in range(size)])
+        Vote.objects.replace_ballot(v.id, 2, [
+            encrypt_exponent(1, pubkey) for i in range(size)])
+
+        self.login()
+        with self.assertRaises(ValueError):
+            v.tally_votes(self.token)
+        v.refresh_from_db()
+        self.assertIsNone(v.tally)
+
+    def test_homomorphic_tally_mode(self):
+        """
+        Test method to verify that only classic and Yes/No votings can use the homomorphic tally.
+        """
+
+        v = self.create_classic_voting()
+        v.tally_mode = Voting.HOMOMORPHIC
+        v.clean()
+
+        v = self.create_ranked_voting()
+        v.tally_mode = Voting.HOMOMORPHIC
+        with self.assertRaises(ValidationError):
+            v.clean()
+
+    def test_chunked_tally(self):
+        """
+        Test method to verify that tallying the votes in chunks gives the same result.
+
+        The votes of a Yes/No voting are tallied in chunks of 3 votes, and the number of votes, chunks and the
+        time of each stage are saved in the voting.
+        """
+
+        v = self.create_yesno_voting()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        clear = self.store_yesno_votes(v)
+        n = sum(clear.values())
+
+        self.login()
+        with self.settings(TALLY_CHUNK_SIZE=3):
+            v.tally_votes(self.token)
+
+        tally = sorted(v.tally)
+        tally = {k: len(list(x)) for k, x in itertools.groupby(tally)}
+        for q in v.question.options.all():
+            self.assertEqual(tally.get(q.number, 0), clear.get(q.number, 0))
+
+        v.refresh_from_db()
+        self.assertEqual(v.tally_timings['votes'], n)
+        self.assertEqual(v.tally_timings['chunks'], n // 3 or int(n > 0))
+        for stage in ('read', 'shuffle', 'decrypt', 'postproc', 'total'):
+            self.assertGreaterEqual(v.tally_timings[stage], 0)
+
+    def test_tally_order(self):
+        """
+        Test method to verify that the tally doesn't keep the order of the chunks, which is the order the votes
+        arrived, and that the votes are shuffled together by default.
+        """
+
+        v = self.create_classic_voting()
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        # every chunk of 3 votes has a single option, the last ones first
+        numbers = sorted(v.question.options.values_list('number', flat=True))
+        clear = [n for n in reversed(numbers[:3]) for i in range(3)]
+        Vote.objects.bulk_create([
+            Vote(voting_id=v.id, voter_id=i, a=a, b=b)
+            for i, (a, b) in enumerate(self.encrypt_msg(n, v) for n in clear)
+        ])
+
+        self.login()
+        with self.settings(TALLY_CHUNK_SIZE=3):
+            v.tally_votes(self.token)
+        self.assertEqual(v.tally_timings['chunks'], 3)
+        self.assertEqual(v.tally, sorted(clear))
+
+        v.tally = None
+        v.tally_votes(self.token)
+        self.assertEqual(v.tally_timings['chunks'], 1)
+        self.assertEqual(v.tally, sorted(clear))
+
+    def test_binary_tally(self):
+        """
+        Test method to verify that tallying the votes sent in the binary format of base.wire gives the same result.
+        """
+
+        v = self.create_yesno_voting()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        clear = self.store_yesno_votes(v)
+
+        self.login()
+        with self.settings(TALLY_CHUNK_SIZE=3, MODS_BINARY_WIRE=True):
+            v.tally_votes(self.token)
+
+        tally = sorted(v.tally)
+        tally = {k: len(list(x)) for k, x in itertools.groupby(tally)}
+        for q in v.question.options.all():
+            self.assertEqual(tally.get(q.number, 0), clear.get(q.number, 0))
+
+    def test_tally_job(self):
+        """
+        Test method to verify that the tally runs as a job whose progress can be followed.
+
+        The job is queued by the tally action with a 202, and run in this process with TALLY_EAGER.
+        """
+
+        v = self.create_yesno_voting()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        clear = self.store_yesno_votes(v)
+        n = sum(clear.values())
+        v.end_date = timezone.now()
+        v.save()
+
+        self.login()
+        seen = []
+        tally_votes = Voting.tally_votes
+
+        def tally_and_track(voting, token, progress=None):
+            def report(stage, processed):
+                progress(stage, processed)
+                job = voting.tally_jobs.get()
+                seen.append((job.status, job.stage, job.processed, job.total))
+            return tally_votes(voting, token, progress=report)
+
+        data = {'action': 'tally'}
+        with mock.patch('voting.tasks.tally_task.apply_async') as apply_async:
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+            self.assertEqual(response.status_code, 202)
+            job = response.json()
+            self.assertEqual(job['status'], 'queued')
+            self.assertEqual(job['total'], n)
+            self.assertIsNone(job['eta'])
+            apply_async.assert_called_once_with(args=[job['id']])
+
+            # only one job at a time
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), 'Voting tally in progress')
+
+        # what the worker does
+        from voting.tasks import tally_task
+        with mock.patch.object(Voting, 'tally_votes', tally_and_track), \
+                self.settings(TALLY_CHUNK_SIZE=3,
+                              TALLY_SERVICE_TOKEN=self.token):
+            self.assertEqual(tally_task(job['id']), 'done')
+
+        self.assertEqual(seen[-1], ('running', 'postproc', n, n))
+        processed = [p[2] for p in seen if p[1] == 'mixnet']
+        self.assertEqual(processed, sorted(processed))
+        self.assertEqual(len(processed), n // 3 or int(n > 0))
+
+        response = self.client.get('/voting/tally/{}/'.format(job['id']))
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['processed'], job['eta']), (n, 0.0))
+        v.refresh_from_db()
+        self.assertIsNotNone(v.tally)
+
+        self.logout()
+        response = self.client.get('/voting/tally/{}/'.format(job['id']))
+        self.assertEqual(response.status_code, 401)
+
+    def test_failed_tally_job(self):
+        """
+        Test method to verify that a tally that fails is saved in its job, and can be retried.
+        """
+
+        v = self.create_yesno_voting()
+        v.create_pubkey()
+        v.start_date = v.end_date = timezone.now()
+        v.save()
+
+        self.login()
+        data = {'action': 'tally'}
+        with mock.patch.object(Voting, 'tally_votes',
+                               side_effect=ValueError('Chunk 1 not acknowledged')), \
+                self.settings(TALLY_EAGER=True):
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(response.json()['error'], 'Chunk 1 not acknowledged')
+
+        with self.settings(TALLY_EAGER=True):
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(v.tally_jobs.count(), 2)
+
+    def test_stale_tally_job(self):
+        """
+        Test method to verify that a tally job whose worker died is failed after TALLY_JOB_TIMEOUT, and the
+        voting can be tallied again.
+        """
+
+        v = self.create_yesno_voting()
+        v.create_pubkey()
+        v.start_date = v.end_date = timezone.now()
+        v.save()
+
+        self.login()
+        data = {'action': 'tally'}
+        with mock.patch('voting.tasks.tally_task.apply_async'):
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+        job = TallyJob.objects.get(pk=response.json()['id'])
+        job.update(status=TallyJob.RUNNING)
+
+        with self.settings(TALLY_EAGER=True):
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+            self.assertEqual(response.status_code, 400)
+
+            TallyJob.objects.filter(pk=job.pk).update(
+                updated_at=timezone.now() - timedelta(seconds=601))
+            response = self.client.put('/voting/{}/'.format(v.pk), data,
+                                       format='json')
+        self.assertEqual(response.json()['status'], 'done')
+        job.refresh_from_db()
+        self.assertEqual(job.status, TallyJob.FAILED)
+        self.assertIn('600 seconds', job.error)
+
+        # a late worker doesn't run the failed job
+        from voting.tasks import tally_task
+        with mock.patch.object(Voting, 'tally_votes') as tally_votes:
+            self.assertEqual(tally_task(job.pk), 'failed')
+        tally_votes.assert_not_called()
+
+    def test_resumed_tally(self):
+        """
+        Test method to verify that a tally that fails in a chunk is resumed from it.
+
+        The decryption of the second of three chunks fails, and the retried tally only shuffles the third
+        chunk and decrypts the last two ones, the rest is taken from the checkpoints of the mixnet.
+        """
+
+        v = self.create_yesno_voting()
+        v.create_pubkey()
+        v.start_date = v.end_date = timezone.now()
+        v.save()
+
+        clear = [random.choice([1, 2]) for i in range(6)]
+        Vote.objects.bulk_create([
+            Vote(voting_id=v.id, voter_id=i, a=a, b=b)
+            for i, (a, b) in enumerate(self.encrypt_msg(c, v) for c in clear)
+        ])
+
+        decrypt = Mixnet.decrypt
+        calls = []
+
+        def failing(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise ValueError('Authority timed out')
+            return decrypt(*args, **kwargs)
+
+        self.login()
+        with self.settings(TALLY_CHUNK_SIZE=2):
+            with mock.patch.object(Mixnet, 'decrypt', autospec=True,
+                                   side_effect=failing):
+                with self.assertRaises(ValueError):
+                    v.tally_votes(self.token)
+            self.assertIsNone(v.tally)
+
+            with mock.patch.object(Mixnet, 'shuffle', autospec=True,
+                                   side_effect=Mixnet.shuffle) as shuffle, \
+                    mock.patch.object(Mixnet, 'decrypt', autospec=True,
+                                      side_effect=decrypt) as decrypted:
+                v.tally_votes(self.token)
+            self.assertEqual(shuffle.call_count, 1)
+            self.assertEqual(decrypted.call_count, 2)
+
+        self.assertEqual(sorted(v.tally), sorted(clear))
+        # purged once the tally is saved
+        self.assertFalse(
+            Checkpoint.objects.filter(mixnet__voting_id=v.id).exists())
+
+    def test_vote_chunks(self):
+        """
+        Test method to verify the sizes of the chunks of votes of a tally.
+        """
+
+        v = self.create_yesno_voting()
+        for n, sizes in ((0, []), (3, [3]), (8, [4, 4]), (10, [4, 6])):
+            Vote.objects.filter(voting_id=v.id).delete()
+            Vote.objects.bulk_create([
+                Vote(voting_id=v.id, voter_id=i, a=i, b=i) for i in range(n)
+            ])
+            chunks = list(v.get_vote_chunks(size=4))
+            self.assertEqual([len(c) for c in chunks], sizes)
+            self.assertEqual([vote for c in chunks for vote in c],
+                             [[i, i] for i in range(n)])
+
     def test_create_voting_from_api_ranked(self):
         """
         Test method to verify the ranked voting creation process via API.
@@ -662,6 +1062,48 @@ class VotingTestCase(BaseTestCase):
         response = self.client.post('/voting/', data, format='json')
         self.assertEqual(response.status_code, 201)
 
+    def test_bulk_actions(self):
+        """
+        Test method to verify that the bulk actions report the result of every voting.
+
+        The votings that can't be started, stopped or tallied and the ones that fail are reported, without
+        stopping the rest.
+        """
+
+        votings = [self.create_classic_voting() for i in range(3)]
+        votings[0].start_date = timezone.now()
+        votings[0].save()
+
+        with mock.patch.object(Voting, 'create_pubkey', autospec=True,
+                               side_effect=[None, ValueError('Mixnet down')]):
+            results = bulk.run('start', Voting.objects.order_by('id'),
+                               concurrency=2)
+        self.assertEqual([(r['id'], r['ok'], r['msg']) for r in results], [
+            (votings[0].id, False, 'Voting already started'),
+            (votings[1].id, True, 'Voting started'),
+            (votings[2].id, False, 'Mixnet down'),
+        ])
+
+        out = StringIO()
+        with self.assertRaisesRegex(CommandError, '1 of 3 votings failed'):
+            call_command('bulkvoting', 'stop', *[v.id for v in votings],
+                         stdout=out)
+        self.assertIn('Voting is not started', out.getvalue())
+        stopped = Voting.objects.filter(end_date__isnull=False)
+        self.assertEqual(stopped.count(), 2)
+
+        with self.settings(TALLY_EAGER=True):
+            results = bulk.run('tally',
+                               Voting.objects.filter(id=votings[0].id))
+        self.assertTrue(results[0]['ok'])
+        self.assertEqual(results[0]['msg'], 'Tally job {} done'.format(
+            TallyJob.objects.get(voting=votings[0]).id))
+
+        with self.assertRaises(CommandError):
+            call_command('bulkvoting', 'tally', 1000)
+        with self.assertRaises(ValueError):
+            bulk.run('delete', [])
+
     def test_update_voting(self):
         """
         Test method to verify the process of updating a voting's status.
@@ -735,10 +1177,13 @@ class VotingTestCase(BaseTestCase):
         self.assertEqual(response.json(), 'Voting already stopped')
 
         data = {'action': 'tally'}
-        response = self.client.put(
-            '/voting/{}/'.format(voting.pk), data, format='json')
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), 'Voting tallied')
+        with self.settings(TALLY_EAGER=True):
+            response = self.client.put(
+                '/voting/{}/'.format(voting.pk), data, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(response['Location'],
+                         '/voting/tally/{}/'.format(response.json()['id']))
 
         # STATUS VOTING: tallied
         data = {'action': 'start'}
@@ -990,6 +1435,41 @@ class QuestionTestCases(BaseTestCase):
 
 
 @nottest
+class VotingBulkTestCase(TransactionTestCase):
+    """
+    Test case class for the concurrency of the bulk actions, outside of a transaction.
+    """
+
+    def test_concurrency(self):
+        """
+        Tests that no more than the given number of votings are processed at the same time, and that the
+        results keep the order of the votings.
+        """
+
+        q = Question.objects.create(desc='test question')
+        votings = [
+            Voting.objects.create(name='voting {}'.format(i), question=q)
+            for i in range(8)]
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def action(voting, token=''):
+            with lock:
+                running.append(voting.id)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(voting.id)
+            return True, token
+
+        with mock.patch.dict(bulk.ACTIONS, {'start': action}):
+            results = bulk.run('start', votings, 'abc', concurrency=3)
+        self.assertEqual([r['id'] for r in results], [v.id for v in votings])
+        self.assertTrue(all(r['ok'] and r['msg'] == 'abc' for r in results))
+        self.assertEqual(max(peak), 3)
+
+
 class PostProcTest(TestCase):
     """
     Test case class for testing the post-processing functionalities of votings.
@@ -13,6 +13,10 @@ urlpatterns = [
         '<int:voting_id>/',
         views.VotingUpdate.as_view(),
         name='voting'),
+    path(
+        'tally/<int:job_id>/',
+        views.TallyJobView.as_view(),
+        name='tally_job'),
     path(
         'list_votings/',
         list_votings,
@@ -3,12 +3,13 @@ import django_filters.rest_framework
 from django.conf import settings
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import generics, status
 from rest_framework.response import Response
 
-from .models import Question, QuestionOption, Voting
+from .models import Question, QuestionOption, TallyJob, Voting
 from census.models import Census
-from .serializers import SimpleVotingSerializer, VotingSerializer
+from .serializers import SimpleVotingSerializer, TallyJobSerializer, VotingSerializer
 from base.perms import UserIsStaff
 from base.models import Auth
 from django.utils import timezone
@@ -77,6 +78,9 @@ class VotingView(generics.ListCreateAPIView):
         for data in ['name', 'desc', 'question', 'question_opt']:
             if data not in request.data:
                 return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        tally_mode = request.data.get('tally_mode', Voting.MIXNET)
+        if tally_mode not in dict(Voting.TALLY_MODES):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
         question = Question(desc=request.data.get('question'))
         question.save()
@@ -87,7 +91,8 @@ class VotingView(generics.ListCreateAPIView):
             name=request.data.get('name'),
             desc=request.data.get('desc'),
             question=question,
-            future_stop=request.data.get('future_stop'))
+            future_stop=request.data.get('future_stop'),
+            tally_mode=tally_mode)
         voting.save()
 
         auth, _ = Auth.objects.get_or_create(
@@ -162,18 +167,45 @@ class VotingUpdate(generics.RetrieveUpdateDestroyAPIView):
             elif not voting.end_date:
                 msg = 'Voting is not stopped'
                 st = status.HTTP_400_BAD_REQUEST
-            elif voting.tally:
+            elif voting.tally is not None:
                 msg = 'Voting already tallied'
                 st = status.HTTP_400_BAD_REQUEST
             else:
-                voting.tally_votes(request.auth.key)
-                msg = 'Voting tallied'
+                # the tally runs in a celery worker, see TallyJobView
+                job = voting.enqueue_tally(request.auth.key)
+                if not job:
+                    msg = 'Voting tally in progress'
+                    st = status.HTTP_400_BAD_REQUEST
+                else:
+                    url = reverse('tally_job', args=[job.id])
+                    return Response(TallyJobSerializer(job).data,
+                                    status=status.HTTP_202_ACCEPTED,
+                                    headers={'Location': url})
         else:
             msg = 'Action not found, try with start, stop or tally'
             st = status.HTTP_400_BAD_REQUEST
         return Response(msg, status=st)
 
 
+class TallyJobView(generics.RetrieveAPIView):
+    """
+    View for retrieving the status and the progress of a tally job.
+
+    The tally action of VotingUpdate answers with a 202 and the URL of this view in the Location header.
+
+    Attributes:
+        queryset: Default queryset for TallyJob objects.
+        serializer_class: Serializer class for TallyJob objects.
+        permission_classes: Permission classes required for the view.
+        lookup_url_kwarg: Name of the URL param with the ID of the job.
+    """
+
+    queryset = TallyJob.objects.all()
+    serializer_class = TallyJobSerializer
+    permission_classes = (UserIsStaff,)
+    lookup_url_kwarg = 'job_id'
+
+
 @login_required(login_url="/authentication/login-view/")
 def list_votings(request):
     """
@@ -325,18 +357,24 @@ def tally_view(request, voting_id):
     """
     View function to tally votes for a specific voting.
 
-    Tally the votes and display the results for a specific voting.
+    Starts the tally of the votes of a specific voting, in background.
 
     :param request: The incoming HTTP request.
     :param voting_id: The ID of the voting to tally.
-    :return: Redirects to the voting list page after tallying, or renders the current page if not confirmed.
+    :return: Redirects to the voting list page after starting the tally, or renders the current page if not
+        confirmed.
     """
 
     voting = get_object_or_404(Voting, pk=voting_id)
     if request.method == 'POST':
         token = request.session.get('auth-token', '')
-        voting.tally_votes(token)
-        messages.success(request, 'Tally completed successfully.')
+        if voting.tally is not None:
+            messages.error(request, 'Voting already tallied.')
+        elif not voting.enqueue_tally(token):
+            messages.error(request, 'Voting tally in progress.')
+        else:
+            messages.success(request, 'Tally started, the results will be '
+                                      'available when it finishes.')
         return redirect('list_votings')
 
     return render(request, 'tally_view.html', {'voting': voting})
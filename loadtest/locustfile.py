@@ -1,4 +1,6 @@
 import json
+import os
+import sys
 
 from random import choice
 
@@ -10,6 +12,11 @@ from locust import (
     between
 )
 
+# the ballots are encrypted with the mixnet module of decide
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'decide'))
+from mixnet.mixcrypt import encrypt  # noqa: E402
+
 
 HOST = "http://localhost:8000"
 VOTING = 1
@@ -24,12 +31,34 @@ class DefVisualizer(TaskSet):
         self.client.get("/visualizer/{0}/".format(VOTING))
 
 
+def get_voting(client):
+    """
+    Returns the public key and the option numbers of the voting.
+    """
+    voting = client.get("/voting/?id={0}".format(VOTING)).json()[0]
+    pk = voting['pub_key']
+    # the comment questions have no options
+    options = voting['question']['options'] or [{'number': 1}]
+    options = [o['number'] for o in options]
+    return (int(pk['p']), int(pk['g']), int(pk['y'])), options
+
+
+def gen_ballot(pk, options):
+    """
+    Encrypts a random option with the public key of the voting. The key is
+    the same for every ballot, so its fixed-base tables are built only once.
+    """
+    a, b = encrypt(choice(options), pk)
+    return {"a": str(a), "b": str(b)}
+
+
 class DefVoters(SequentialTaskSet):
 
     def on_start(self):
         with open('voters.json') as f:
             self.voters = json.loads(f.read())
         self.voter = choice(list(self.voters.items()))
+        self.pk, self.options = get_voting(self.client)
 
     @task
     def login(self):
@@ -63,10 +92,7 @@ class DefVoters(SequentialTaskSet):
         if VOTING_TYPE != "choices":
             self.client.post("/store/", json.dumps({
                 "token": self.token.get('token'),
-                "vote": {
-                    "a": "12",
-                    "b": "64"
-                },
+                "vote": gen_ballot(self.pk, self.options),
                 "voter": self.usr.get('id'),
                 "voting": VOTING,
                 "voting_type": VOTING_TYPE
@@ -74,14 +100,8 @@ class DefVoters(SequentialTaskSet):
         else:
             self.client.post("/store/", json.dumps({
                 "token": self.token.get('token'),
-                "votes": [{
-                    "a": "12",
-                    "b": "64"
-                },
-                    {
-                    "a": "24",
-                    "b": "38"
-                }],
+                "votes": [gen_ballot(self.pk, self.options),
+                          gen_ballot(self.pk, self.options)],
                 "voter": self.usr.get('id'),
                 "voting": VOTING,
                 "voting_type": VOTING_TYPE